@@ -4,29 +4,75 @@ from PyQt5.QtCore import Qt, QMimeData, pyqtSignal, QObject, QThreadPool, QRunna
 from PyQt5.QtWidgets import (QMainWindow, QAction, QApplication, qApp, QLabel, QFileDialog, QLineEdit,
                              QTabWidget, QWidget, QMessageBox, QVBoxLayout, QListWidget, QInputDialog, QPushButton)
 import sys
+from collections import namedtuple
 from client import Client
+from lib.engine import COMPUTER
 from lib.gamemodel import GameModel
+from lib.presence import BEATS_PER_TTL, TTL as PRESENCE_TTL
+from lib.store import STORE_ERRORS
+from tabs.dashboard import Dashboard
 from tabs.gametab import GameTab
 from tabs.panel import HomeScreen
-import time
-import pickle
 import os
+import time
+
+#Everything the home screen shows, gathered off the GUI thread. Names
+#are without their newline, players are a sorted tuple and invites sorted
+#(game name, save file) pairs. missing is the current game's save file if
+#the store lost it, else None.
+LobbySnapshot = namedtuple('LobbySnapshot', ['name', 'players', 'invites', 'missing'])
 
 class WorkerSignals(QObject):
-    notify = pyqtSignal()
+    lobby = pyqtSignal(object)
 
 class ClientMonitor(QRunnable):
+    '''Reads the lobby on its own thread and hands the home screen a
+    LobbySnapshot whenever what it shows has changed'''
     def __init__(self, client, *args, **kwargs):
         super().__init__()
         self.signals = WorkerSignals()
         self.client = client
         self.working = True
+        self.wanted = True
+        self.last = None
 
     def run(self):
         self.working = True
+        #Refresh once to start, then only when the lobby files change
+        watcher = self.client.watchLobby()
+        recheck = time.monotonic() + PRESENCE_TTL/BEATS_PER_TTL
         while self.working:
-            time.sleep(1)
-            self.signals.notify.emit()
+            self.client.heartbeat()
+            #Players timing out doesn't change any files so look again
+            #every so often anyway
+            if self.wanted or time.monotonic() > recheck:
+                self.wanted = False
+                recheck = time.monotonic() + PRESENCE_TTL/BEATS_PER_TTL
+                self.gather()
+            #The timeout is only how quickly end is noticed
+            if watcher.wait(0.5):
+                self.wanted = True
+        watcher.close()
+
+    def gather(self):
+        '''Only reads, the GUI thread applies the snapshot to the client'''
+        try:
+            players = self.client.getOnlinePlayers()
+            invites = self.client.readInvites()
+            missing = self.client.missingCurrentGame()
+        except STORE_ERRORS:
+            print('Did not connect to server!')
+            return
+        snapshot = LobbySnapshot(self.client.getUserName()[:-1], tuple(sorted(player[:-1] for player in players)),
+                                 tuple(sorted(invites.items())), missing)
+        if snapshot != self.last:
+            self.last = snapshot
+            self.signals.lobby.emit(snapshot)
+
+    def poke(self):
+        '''Asks for a fresh snapshot, like after the user name changed'''
+        self.last = None
+        self.wanted = True
 
     def end(self):
         self.working = False
@@ -69,16 +115,24 @@ class Clairxo(QMainWindow):
         self.mainwindow = HomeScreen(self.client, self.statusbar)
         self.mainwindow.signals.newGame.connect(self.newGame)
         self.mainwindow.signals.loadGame.connect(self.loadGame)
+        self.mainwindow.signals.dashboard.connect(self.showDashboard)
 
     def startMonitor(self):
         #Start threading
         self.monitor = ClientMonitor(self.client)
-        self.monitor.signals.notify.connect(self.refresh)
+        self.monitor.signals.lobby.connect(self.showLobby)
         self.threadpool.start(self.monitor)
 
     def refresh(self):
+        self.monitor.poke()
+
+    def showLobby(self, snapshot):
+        self.client.setInvites(snapshot.invites)
+        #Unless another game was picked since
+        if snapshot.missing and snapshot.missing == self.client.getCurrentGame():
+            self.client.removeCurrentGame()
         if self.mainwindow:
-            self.mainwindow.refresh()
+            self.mainwindow.refresh(snapshot)
 
     def setServerPath(self):
         #Attempt to search for a new folder location. If this is canceled or otherwise fails
@@ -129,7 +183,12 @@ class Clairxo(QMainWindow):
         self.monitor.end()
         print('Starting a game with ' + player)
         self.gamemodel = GameModel(self.client.getGamePath(), self.client.getUserName(), player)
-        self.client.createInvite(self.gamemodel.getFileName(), self.gamemodel.getSaveFile())
+        #A game of the same name from earlier today may still be cached
+        self.client.getModels().remove(self.gamemodel.getSaveFile())
+        if player == COMPUTER:
+            self.client.addGame(self.gamemodel.getFileName(), self.gamemodel.getSaveFile())
+        else:
+            self.client.createInvite(self.gamemodel.getFileName(), self.gamemodel.getSaveFile())
         self.gameWidget = GameTab(self.client, self.gamemodel, self.statusbar)
         self.gameWidget.signals.finished.connect(self.returnToMain)
         self.setCentralWidget(self.gameWidget)
@@ -139,31 +198,55 @@ class Clairxo(QMainWindow):
         
     def loadGame(self):
         currentGame = self.client.getCurrentGame()
-        if os.path.exists(currentGame):
-            tries = 4
-            #Give this a few attempts in case the other client is accessing it
-            while tries > 0:
-                #try:
-                if True:
-                    print('trying to open game')
-                    with open(currentGame, 'rb') as gfile:
-                        self.gamemodel = pickle.load(gfile)
-                        self.gameWidget = GameTab(self.client, self.gamemodel, self.statusbar)
-                        print('returned from making game tab')
-                        self.gameWidget.signals.finished.connect(self.returnToMain)
-                        print('setting central widget')
-                        self.setCentralWidget(self.gameWidget)
-                        self.mainwindow = None
-                        self.monitor.end()
-                        tries = 0
-                #except:
-                #    print('Trying again')
-                #    tries -= 1
-                #    time.sleep(0.5)
+        try:
+            exists = self.client.getStore().exists(currentGame)
+        except STORE_ERRORS as err:
+            self.statusbar.showMessage('Could not reach the server: ' + str(err))
+            return
+        if exists:
+            #Snapshots are renamed into place so there's never half a game
+            #file to retry on
+            try:
+                #Straight from the model cache if the dashboard or an
+                #earlier visit already loaded it
+                self.gamemodel = self.client.takeModel(currentGame)
+            except (ValueError,) + STORE_ERRORS as err:
+                #Old pickled games have to be converted first
+                self.statusbar.showMessage(str(err))
+                return
+            self.gameWidget = GameTab(self.client, self.gamemodel, self.statusbar)
+            self.gameWidget.signals.finished.connect(self.returnToMain)
+            self.setCentralWidget(self.gameWidget)
+            self.mainwindow = None
+            self.monitor.end()
         else:
             self.client.removeCurrentGame()
             self.statusbar.showMessage('Game has been deleted or moved')
 
+    def showDashboard(self):
+        self.monitor.end()
+        self.dashboard = Dashboard(self.client, self.statusbar)
+        self.dashboard.signals.openGame.connect(self.openFromDashboard)
+        self.dashboard.signals.finished.connect(self.leaveDashboard)
+        self.setCentralWidget(self.dashboard)
+        self.mainwindow = None
+
+    def openFromDashboard(self, gamename):
+        self.client.setCurrentGame(gamename)
+        self.dashboard = None
+        #Games that fail to load fall back to the main menu
+        self.createHomePanel()
+        self.setCentralWidget(self.mainwindow)
+        self.startMonitor()
+        self.loadGame()
+
+    def leaveDashboard(self):
+        self.dashboard = None
+        self.createHomePanel()
+        self.setCentralWidget(self.mainwindow)
+        self.startMonitor()
+        self.statusbar.showMessage('Main Menu')
+
     def returnToMain(self):
         #Create all the panel widgets again and reconnect the signals
         self.createHomePanel()
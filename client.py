@@ -1,5 +1,7 @@
 import os
 from lib.cfg import CFGFile
+from lib.modelcache import ModelCache
+from lib.store import STORE_ERRORS, make_store, set_store
 import pickle
 
 class Client():
@@ -11,6 +13,8 @@ class Client():
         self.config = None
         self.playerTarget = None
         self.invites = {}
+        self.store = None
+        self.models = None
         self.load()
 
     def load(self):
@@ -38,37 +42,91 @@ class Client():
         #Now that the config file has been loaded in the 
         #remaining functions are guranteed to have a self.config
         #available.
+        self.makeStore()
         self.connect()
 
+    def makeStore(self):
+        '''Opens the server backend the config asks for, games are loaded
+        and saved through it too'''
+        if self.models:
+            self.models.clear()
+        if self.store:
+            self.store.close()
+        self.store = make_store(self.config)
+        set_store(self.store)
+        #Games already loaded, so going back into one is quick
+        self.models = ModelCache(self.store)
+
+    def getStore(self):
+        return self.store
+
+    def getModels(self):
+        return self.models
+
+    def takeModel(self, savefile):
+        '''The game's model to play, from the cache if it's there'''
+        return self.models.take(savefile)
+
+    def giveModel(self, gamemodel):
+        '''Hands a model back to the cache once its game tab closes'''
+        self.models.give(gamemodel)
+
     def getInvites(self):
         return self.invites
 
     def getGames(self):
-        return self.config.getGames()
+        '''This client's games and any others the store knows this user is in'''
+        games = {}
+        try:
+            games.update(self.store.listGames(self.config.getName()))
+        except STORE_ERRORS:
+            pass
+        games.update(self.config.getGames())
+        return games
 
     def setCurrentGame(self, gamename):
-        self.config.getGame(gamename)
+        if gamename not in self.config.getGames() and gamename in self.getGames():
+            self.config.setCurrentGame(gamename, self.getGames()[gamename])
+        else:
+            self.config.getGame(gamename)
 
     def acceptInvite(self, invite):
-        newgamepath = self.invites.pop(invite)
-        self.config.setCurrentGame(invite, newgamepath[:-1])
-        #Check invites
-        ip = self.config.getTransferPath()
-        invites = []
-        if os.path.exists(ip):
-            with open(ip, 'r') as tfile:
-                for line in tfile:
-                    if not line.endswith(newgamepath):
-                        invites.append(line)
-        with open(ip, 'w') as tfile:
-            for invite in invites:
-                tfile.write(invite)
+        '''Claims an invite, returns False if it was already taken'''
+        savefile = self.store.claimInvite(self.config.getName()[:-1], invite)
+        self.invites.pop(invite, None)
+        if not savefile:
+            return False
+        self.config.setCurrentGame(invite, savefile)
+        return True
+
+    def addGame(self, filename, savefile):
+        '''Tracks a game that needs no invite, like one against the computer'''
+        self.config.setCurrentGame(filename, savefile)
+
+    def makeEngine(self):
+        #Imported here so the core stays quick to import for scripts
+        #that only need the rules
+        from lib.engine import Engine, ParallelEngine
+        workers = self.config.getEngineWorkers()
+        if workers > 1:
+            return ParallelEngine(workers, self.config.getEngineTime(), self.config.getEngineRate(),
+                                  hashMB=self.config.getEngineHashMB())
+        return Engine(self.config.getEngineTime(), self.config.getEngineRate(),
+                      hashMB=self.config.getEngineHashMB())
+
+    def watchLobby(self):
+        '''Watcher for what the home screen has to refresh for'''
+        return self.store.watchLobby(self.config.getName()[:-1])
+
+    def watchGame(self, savefile):
+        return self.store.watchGame(savefile)
+
+    def watchGames(self, savefiles):
+        return self.store.watchGames(savefiles)
 
     def createInvite(self, filename, savefile):
-        tp = self.config.getTransferPath()
         self.config.setCurrentGame(filename, savefile)
-        with open(tp, 'a+') as tfile:
-            tfile.write(self.playerTarget[:-1] + '-' + savefile + '\n')
+        self.store.sendInvite(self.config.getName()[:-1], self.playerTarget[:-1], filename, savefile)
 
     def getCurrentGame(self):
         return self.config.getCurrentGame()
@@ -78,8 +136,12 @@ class Client():
 
     def setServerPath(self, newpath):
         self.config.setServerPath(newpath)
+        self.makeStore()
 
     def removeCurrentGame(self):
+        cg = self.config.getCurrentGame()
+        if cg:
+            self.models.remove(cg)
         self.config.removeCurrentGame()
 
     def setUserName(self, newname):
@@ -95,17 +157,22 @@ class Client():
         return self.config.getGamePath()
 
     def getOnlinePlayers(self):
-        players = []
-        sp = self.config.getUserPath()
-        name = self.config.getName()
-        if os.path.exists(sp):
-            with open(sp, 'r') as slink:
-                for line in slink:
-                    if line != name:
-                        players.append(line)
-        else:
+        name = self.config.getName()[:-1]
+        try:
+            roster = self.store.roster()
+        except STORE_ERRORS:
             print('Didnt\'t connect to server to find players')
-        return players
+            return []
+        #Names carry a newline everywhere else
+        return [player + '\n' for player in roster if player != name]
+
+    def heartbeat(self):
+        '''Keeps this user in the lobby, only writes when a beat is due so
+        it's fine to call every time round a loop'''
+        try:
+            self.store.beat(self.config.getName()[:-1])
+        except STORE_ERRORS:
+            print('Did not connect to server!')
 
     def setPlayerTarget(self, playerName):
         self.playerTarget = playerName
@@ -115,56 +182,43 @@ class Client():
 
     def goOffline(self):
         print('Going offline')
-        sp = self.config.getUserPath()
         name = self.config.getName()
         if name == '':
             print('No username so dont disconnect')
             return
-        if os.path.exists(sp):
-            players = []
-            with open(sp, 'r') as slink:
-                for line in slink:
-                    if line != name:
-                        players.append(line)
-            with open(sp, 'w') as slink:
-                for player in players:
-                    slink.write(player)
-        else:
+        try:
+            self.store.leave(name[:-1])
+        except STORE_ERRORS:
             print('Didn\'t connect to server to close')
 
     def connect(self):
-        sp = self.config.getUserPath()
         name = self.config.getName()
         if name == '':
             return
-        if os.path.exists(sp):
-            players = []
-            online = False
-            with open(sp, 'r') as slink:
-                for line in slink:
-                    players.append(line)
-                    if line == name:
-                        online = True
-            if not online:
-                print('Setting status to online')
-                players += name
-                with open(sp, 'w') as slink:
-                    for player in players:
-                        slink.write(player)
-        else:
-            print('Did not connect to server!')
-        #Check invites
-        ip = self.config.getTransferPath()
-        self.invites = {}
-        if os.path.exists(ip):
-            with open(ip, 'r') as tfile:
-                for line in tfile:
-                    if line.startswith(name[:-1]):
-                        #Game invite exits
-                        name, gamepath = line.split('-')
-                        self.invites[os.path.basename(gamepath).split('.')[0]] = gamepath
+        self.heartbeat()
+        #Check invites, only this user's mailbox is read
+        try:
+            self.invites = self.readInvites()
+        except STORE_ERRORS:
+            self.invites = {}
         #Check the current game is accesible
+        if self.missingCurrentGame():
+            self.config.removeCurrentGame()
+
+    def readInvites(self):
+        '''This user's invites as the store has them now, without keeping
+        them, so it's safe off the GUI thread'''
+        name = self.config.getName()
+        if name == '':
+            return {}
+        return self.store.readInvites(name[:-1])
+
+    def setInvites(self, invites):
+        self.invites = dict(invites)
+
+    def missingCurrentGame(self):
+        '''The current game's save file if the store no longer has it'''
         cg = self.config.getCurrentGame()
-        if cg:
-            if not os.path.exists(cg):
-                self.config.removeCurrentGame()
+        if cg and not self.store.exists(cg):
+            return cg
+        return None
@@ -1,6 +1,9 @@
 import pickle
 import os
 from shutil import copy2
+from lib.journal import journal_path
+from lib.storage import atomic_write
+from lib.store import get_store
 
 class CFGFile():
     def __init__(self, path):
@@ -10,8 +13,23 @@ class CFGFile():
         self.userPath = self.serverFolder + 'users.txt'
         self.transferPath = self.serverFolder + 'transfer.txt'
         self.gamePath = self.serverFolder + 'games/'
+        self.presencePath = self.serverFolder + 'presence/'
+        self.invitePath = self.serverFolder + 'invites/'
         self.currentGame = None
         self.games = {}
+        #Computer opponent search settings
+        self.engineTime = 0.5
+        self.engineRate = 20000
+        self.engineHashMB = 16
+        self.engineWorkers = 1
+        #How the lobby and game files are watched, 'auto', 'inotify' or 'poll'
+        self.watcherBackend = 'auto'
+        #Where games, presence and invites are kept, 'files' in the server
+        #folder, 'sqlite' in databasePath or 'network' for a lib.server
+        #running at serverAddress
+        self.serverBackend = 'files'
+        self.databasePath = self.serverFolder + 'clairxo.db'
+        self.serverAddress = '127.0.0.1:8765'
         self.save()
 
     def integrityCheck(self):
@@ -26,10 +44,30 @@ class CFGFile():
             self.transferPath = self.serverFolder + 'transfer.txt'
         if not hasattr(self, 'gamePath'):
             self.gamepath = self.serverFolder + 'games/'
+        if not hasattr(self, 'presencePath'):
+            self.presencePath = self.serverFolder + 'presence/'
+        if not hasattr(self, 'invitePath'):
+            self.invitePath = self.serverFolder + 'invites/'
         if not hasattr(self, 'currentGame'):
             self.currentGame = None
         if not hasattr(self, 'games'):
             self.games = {}
+        if not hasattr(self, 'engineTime'):
+            self.engineTime = 0.5
+        if not hasattr(self, 'engineRate'):
+            self.engineRate = 20000
+        if not hasattr(self, 'engineHashMB'):
+            self.engineHashMB = 16
+        if not hasattr(self, 'engineWorkers'):
+            self.engineWorkers = 1
+        if not hasattr(self, 'watcherBackend'):
+            self.watcherBackend = 'auto'
+        if not hasattr(self, 'serverBackend'):
+            self.serverBackend = 'files'
+        if not hasattr(self, 'databasePath'):
+            self.databasePath = self.serverFolder + 'clairxo.db'
+        if not hasattr(self, 'serverAddress'):
+            self.serverAddress = '127.0.0.1:8765'
         self.save()
 
     def setServerPath(self, newPath):
@@ -45,6 +83,9 @@ class CFGFile():
             self.userPath = self.serverFolder + 'users.txt'
             self.transferPath = self.serverFolder + 'transfer.txt'
             self.gamePath = self.serverFolder + 'games/'
+            self.presencePath = self.serverFolder + 'presence/'
+            self.invitePath = self.serverFolder + 'invites/'
+            self.databasePath = self.serverFolder + 'clairxo.db'
             if not os.path.exists(self.userPath):
                 print('Server missing user file')
                 open(self.userPath, 'w+').close()
@@ -62,6 +103,8 @@ class CFGFile():
                     #Check another user hasn't copied your game over already
                     if not os.path.exists(newpath):
                         copy2(path, newpath)
+                        if os.path.exists(journal_path(path)):
+                            copy2(journal_path(path), journal_path(newpath))
                         self.games[gamename] = newpath
             #If you couldn't connect to your old game server 
             #delete your games :( tough luck buddy
@@ -84,11 +127,10 @@ class CFGFile():
         '''Either called to delete the game in the folder
         or to remove the game from this client'''
         if self.currentGame:
-            if os.path.exists(self.currentGame):
-                try:
-                    os.remove(self.currentGame)
-                except:
-                    pass
+            try:
+                get_store().removeGame(self.currentGame)
+            except:
+                pass
             mark = None
             for game, path in self.games.items():
                 if path == self.currentGame:
@@ -117,6 +159,12 @@ class CFGFile():
     def getUserPath(self):
         return self.userPath
 
+    def getInvitePath(self):
+        return self.invitePath
+
+    def getPresencePath(self):
+        return self.presencePath
+
     def setGamePath(self, newPath):
         self.gamePath = newPath
         self.save()
@@ -131,6 +179,29 @@ class CFGFile():
     def getTransferPath(self):
         return self.transferPath
 
+    def getEngineTime(self):
+        return self.engineTime
+
+    def getEngineRate(self):
+        return self.engineRate
+
+    def getEngineHashMB(self):
+        return self.engineHashMB
+
+    def getEngineWorkers(self):
+        return self.engineWorkers
+
+    def getWatcherBackend(self):
+        return self.watcherBackend
+
+    def getServerBackend(self):
+        return self.serverBackend
+
+    def getDatabasePath(self):
+        return self.databasePath
+
+    def getServerAddress(self):
+        return self.serverAddress
+
     def save(self):
-        with open(self.path, 'wb') as cfile:
-            pickle.dump(self, cfile)
\ No newline at end of file
+        atomic_write(self.path, pickle.dumps(self))
\ No newline at end of file
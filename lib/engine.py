@@ -0,0 +1,502 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from lib.gamemodel import (INVERSE_SYMMETRY, LINE_MASKS, MOVE_LINES, MOVE_SYMMETRY, ZOBRIST_SIDE,
+                           apply_move, canonical, legal_moves, zobrist, zobrist_update)
+from lib.tablebase import Tablebase, decode
+
+#Name the computer opponent plays under, names carry a trailing newline
+COMPUTER = 'Computer\n'
+WIN = 100000
+INFINITY = WIN + 1
+#How often, in nodes, the search looks at the clock
+CHECK_EVERY = 1024
+#Shallowest iteration ParallelEngine hands to its pool, the ones before
+#are only a few thousand nodes and cost less than the round trip
+SPLIT_DEPTH = 4
+#Score for owning 0-5 cubes of a line the opponent has no cube in
+LINE_WEIGHTS = (0, 1, 4, 16, 64, 0)
+
+#Transposition table bound types
+EXACT = 0
+LOWER = 1
+UPPER = 2
+#Each entry is a 64 bit key and 64 bits of packed data
+ENTRY_BYTES = 16
+SCORE_OFFSET = 1 << 20
+#Scores past this are wins or losses, stored relative to the node
+MATE_BOUND = WIN - 1000
+
+class SearchTimeout(Exception):
+    pass
+
+class TranspositionTable():
+    '''Fixed size hash table of search results indexed by Zobrist key.
+
+    An entry is replaced when the new result is searched at least as deep,
+    is an exact score for a position only bounded so far, or the stored
+    one is left over from an earlier search. Keys are stored
+    xor'd with their data so a torn entry just reads as a miss.
+
+    Parameters:
+        sizeMB (float): memory cap, rounded down to a power of two entries
+        shared (bool): keep the entries in shared memory so worker
+            processes can attach to the same table
+        name (str): name of an existing shared table to attach to, it
+            must have been made with the same sizeMB
+    '''
+    def __init__(self, sizeMB=16, shared=False, name=None):
+        entries = 1
+        while entries*2*ENTRY_BYTES <= sizeMB*(1 << 20):
+            entries *= 2
+        self.size = entries
+        self.mask = entries - 1
+        self.memory = None
+        if name:
+            self.memory = attach_shared(name)
+        elif shared:
+            self.memory = shared_memory.SharedMemory(create=True, size=entries*ENTRY_BYTES)
+        if self.memory:
+            buffer = self.memory.buf
+        else:
+            buffer = bytearray(entries*ENTRY_BYTES)
+        #Keys in the first half, data in the second
+        self.buffer = memoryview(buffer)[:entries*ENTRY_BYTES]
+        self.keys = self.buffer[:8*entries].cast('Q')
+        self.data = self.buffer[8*entries:].cast('Q')
+        self.generation = 0
+
+    def getName(self):
+        '''Name workers attach to, None for a private table'''
+        if self.memory:
+            return self.memory.name
+        return None
+
+    def close(self, unlink=False):
+        '''Lets go of a shared table, the creator should unlink it'''
+        self.keys.release()
+        self.data.release()
+        self.buffer.release()
+        if self.memory:
+            self.memory.close()
+            if unlink:
+                self.memory.unlink()
+            self.memory = None
+
+    def newSearch(self):
+        '''Ages the stored entries so they give way to the new search'''
+        self.generation = (self.generation + 1) & 0xFF
+
+    def clear(self):
+        self.buffer[:] = bytes(len(self.buffer))
+
+    def probe(self, key):
+        '''Returns (depth, bound, score, move) for the key or None, move
+        is None if no best move was stored'''
+        idx = key & self.mask
+        data = self.data[idx]
+        if not data or self.keys[idx] ^ data != key:
+            return None
+        move = (data >> 10) & 0xFF
+        return (data & 0xFF, (data >> 8) & 0x3, (data >> 26) - SCORE_OFFSET,
+                move - 1 if move else None)
+
+    def store(self, key, depth, bound, score, move):
+        idx = key & self.mask
+        old = self.data[idx]
+        if old and (old >> 18) & 0xFF == self.generation:
+            oldDepth = old & 0xFF
+            if self.keys[idx] ^ old != key:
+                #Keep a deeper result from this search in the slot
+                if oldDepth > depth:
+                    return
+            elif depth < oldDepth and not (bound == EXACT and (old >> 8) & 0x3 != EXACT):
+                #The same position searched shallower only replaces a
+                #bound with an exact score
+                return
+        if move is None:
+            move = -1
+        data = (depth | bound << 8 | (move+1) << 10 | self.generation << 18
+                | (score + SCORE_OFFSET) << 26)
+        self.data[idx] = data
+        self.keys[idx] = key ^ data
+
+def to_table(score, ply):
+    '''Wins are stored as distance from the node instead of the root'''
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+def from_table(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
+def tablebase_score(value, ply):
+    '''Turns a tablebase value into a search score, quicker wins and
+    slower losses score higher'''
+    result, distance = decode(value)
+    if result == 'win':
+        return WIN - ply - distance
+    if result == 'loss':
+        return ply + distance - WIN
+    return 0
+
+def count(bits):
+    return bin(bits).count('1')
+
+def evaluate(own, opp):
+    '''Scores a position for the side to move, lines only one side has
+    cubes in are worth more the fuller they are'''
+    score = 0
+    for mask in LINE_MASKS:
+        mine = own & mask
+        theirs = opp & mask
+        if not theirs:
+            score += LINE_WEIGHTS[count(mine)]
+        elif not mine:
+            score -= LINE_WEIGHTS[count(theirs)]
+    return score
+
+def outcome(mine, theirs, lines, ply):
+    '''Scores a finished game for the side that just moved, None if the
+    move didn't complete any of the lines. Completing a line for both
+    sides is a tie, same as GameModel.checkIfWon.'''
+    won = False
+    lost = False
+    for mask in lines:
+        if mine & mask == mask:
+            won = True
+        elif theirs & mask == mask:
+            lost = True
+    if won:
+        if lost:
+            return 0
+        return WIN - ply
+    if lost:
+        return ply - WIN
+    return None
+
+def attach_shared(name):
+    '''Opens an existing shared table, leaving the unlinking to whoever
+    made it. Python before 3.13 has no track flag, pool workers share
+    their parent's resource tracker there so it does no harm.'''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+class Engine():
+    '''Negamax search with alpha-beta pruning, iterative deepening and a
+    transposition table shared across iterations and searches.
+
+    Parameters:
+        timeLimit (float): seconds a search may take
+        nodeRate (int): nodes per second the search is expected to manage,
+            what the benchmark is measured against
+        maxDepth (int): deepest iteration to try
+        hashMB (float): transposition table memory cap
+        symmetric (bool): key the table by the canonical position so
+            mirrored and colour swapped positions share entries. Costs a
+            canonicalization per node in exchange for fewer misses.
+        table (TranspositionTable): table to use instead of a new private one
+        tablebase (Tablebase): solved positions to score exactly when found
+        capNodes (bool): also stop after nodeRate*timeLimit nodes, so the
+            same settings search the same tree on any machine. Off by
+            default, the time limit alone already keeps a move in time
+            and a faster machine should get to search deeper.
+    '''
+    def __init__(self, timeLimit=0.5, nodeRate=20000, maxDepth=32, hashMB=16, symmetric=False,
+                 table=None, tablebase=None, capNodes=False):
+        self.timeLimit = timeLimit
+        self.tablebase = tablebase
+        self.nodeRate = nodeRate
+        self.capNodes = capNodes
+        self.maxDepth = maxDepth
+        self.symmetric = symmetric
+        self.table = table
+        if not self.table:
+            self.table = TranspositionTable(hashMB)
+        self.nodes = 0
+        self.deadline = None
+        self.maxNodes = None
+
+    def nodeBudget(self):
+        if self.capNodes and self.nodeRate:
+            return int(self.nodeRate*self.timeLimit)
+        return None
+
+    def search(self, position, player, key=None):
+        '''Finds a move for the player (0 for X, 1 for O) in an (X bits,
+        O bits) position.
+
+        Parameters:
+            key (int): Zobrist key of the position if already known, like
+                GameModel.getKey()
+
+        Returns:
+            move (int): index into MOVES, None if there are no moves
+            score (int): score of the move for the player
+            depth (int): deepest fully searched iteration
+            nodes (int): nodes visited
+        '''
+        if key is None:
+            key = zobrist(position, player)
+        self.nodes = 0
+        self.deadline = time.perf_counter() + self.timeLimit
+        self.maxNodes = self.nodeBudget()
+        self.table.newSearch()
+        moves = legal_moves(position, player)
+        if not moves:
+            return None, 0, 0, 0
+        best = moves[0]
+        score = 0
+        completed = 0
+        for depth in range(1, self.maxDepth+1):
+            try:
+                score, best = self.root(position, player, key, moves, depth, best)
+            except SearchTimeout:
+                break
+            completed = depth
+            #A forced result won't change with more depth
+            if abs(score) >= MATE_BOUND:
+                break
+        return best, score, completed, self.nodes
+
+    def root(self, position, player, key, moves, depth, first):
+        #Search the previous iteration's best move first
+        ordered = [first] + [move for move in moves if move != first]
+        alpha, best = self.searchMoves(position, player, key, ordered, depth)
+        tableKey, sym = self.tableKey(position, player, key)
+        self.table.store(tableKey, depth, EXACT, alpha, MOVE_SYMMETRY[sym][best])
+        return alpha, best
+
+    def searchMoves(self, position, player, key, moves, depth):
+        '''Searches each of the moves, returns the best score and move'''
+        alpha = -INFINITY
+        best = moves[0]
+        for move in moves:
+            child = apply_move(position, player, move)
+            score = outcome(child[player], child[1-player], MOVE_LINES[move], 1)
+            if score is None:
+                childKey = zobrist_update(key, position, child) ^ ZOBRIST_SIDE
+                score = -self.negamax(child, 1-player, childKey, depth-1, -INFINITY, -alpha, 1)
+            if score > alpha:
+                alpha = score
+                best = move
+        return alpha, best
+
+    def tableKey(self, position, player, key):
+        '''Returns the key to use in the table and the symmetry the stored
+        moves are kept in'''
+        if not self.symmetric:
+            return key, 0
+        board, sym = canonical(position, player)
+        return zobrist(board, 0), sym
+
+    def negamax(self, position, player, key, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self.checkLimits()
+        if self.tablebase:
+            value = self.tablebase.value(position[player], position[1-player])
+            if value is not None:
+                return tablebase_score(value, ply)
+        if depth == 0:
+            return evaluate(position[player], position[1-player])
+        hashMove = None
+        tableKey, sym = self.tableKey(position, player, key)
+        entry = self.table.probe(tableKey)
+        if entry:
+            storedDepth, bound, score, hashMove = entry
+            if hashMove is not None and sym:
+                hashMove = MOVE_SYMMETRY[INVERSE_SYMMETRY[sym]][hashMove]
+            if storedDepth >= depth:
+                score = from_table(score, ply)
+                if bound == EXACT:
+                    return score
+                if bound == LOWER and score > alpha:
+                    alpha = score
+                elif bound == UPPER and score < beta:
+                    beta = score
+                if alpha >= beta:
+                    return score
+        origAlpha = alpha
+        moves = legal_moves(position, player)
+        if hashMove in moves:
+            moves.remove(hashMove)
+            moves.insert(0, hashMove)
+        best = -INFINITY
+        bestMove = None
+        for move in moves:
+            child = apply_move(position, player, move)
+            score = outcome(child[player], child[1-player], MOVE_LINES[move], ply+1)
+            if score is None:
+                childKey = zobrist_update(key, position, child) ^ ZOBRIST_SIDE
+                score = -self.negamax(child, 1-player, childKey, depth-1, -beta, -alpha, ply+1)
+            if score > best:
+                best = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        if best <= origAlpha:
+            bound = UPPER
+        elif best >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        if bestMove is not None and sym:
+            bestMove = MOVE_SYMMETRY[sym][bestMove]
+        self.table.store(tableKey, depth, bound, to_table(best, ply), bestMove)
+        return best
+
+    def checkLimits(self):
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        if self.maxNodes and self.nodes >= self.maxNodes:
+            raise SearchTimeout()
+
+    def benchmark(self, positions):
+        '''Searches each (position, player) pair with the node cap off
+        and returns the nodes per second reached'''
+        capNodes = self.capNodes
+        self.capNodes = False
+        nodes = 0
+        start = time.perf_counter()
+        try:
+            for position, player in positions:
+                self.table.clear()
+                nodes += self.search(position, player)[3]
+        finally:
+            self.capNodes = capNodes
+        return nodes/max(time.perf_counter() - start, 1e-9)
+
+    def close(self):
+        pass
+
+#Engine each pool worker searches with, set up by start_worker
+_worker = None
+
+def start_worker(name, hashMB, settings):
+    global _worker
+    _worker = Engine(table=TranspositionTable(hashMB, name=name), **settings)
+
+def search_split(position, player, key, moves, depth, remaining, maxNodes, generation):
+    '''Searches a worker's share of the root moves within the seconds and
+    nodes left of the search, returns (score, move, nodes) with a None
+    score if it ran out'''
+    engine = _worker
+    engine.table.generation = generation
+    engine.nodes = 0
+    engine.deadline = time.perf_counter() + remaining
+    engine.maxNodes = maxNodes
+    try:
+        score, best = engine.searchMoves(position, player, key, moves, depth)
+    except SearchTimeout:
+        return None, None, engine.nodes
+    return score, best, engine.nodes
+
+class ParallelEngine(Engine):
+    '''Engine that splits the root moves of each iteration across a pool
+    of processes sharing one transposition table in shared memory.
+
+    Parameters:
+        workers (int): processes to search with
+        The rest are as for Engine, a node cap is shared by all the workers
+    '''
+    def __init__(self, workers=2, timeLimit=0.5, nodeRate=20000, maxDepth=32, hashMB=16,
+                 symmetric=False, capNodes=False):
+        table = TranspositionTable(hashMB, shared=True)
+        super().__init__(timeLimit, nodeRate, maxDepth, hashMB, symmetric, table, capNodes=capNodes)
+        self.workers = workers
+        settings = {'timeLimit': timeLimit, 'nodeRate': nodeRate, 'maxDepth': maxDepth,
+                    'symmetric': symmetric}
+        self.pool = ProcessPoolExecutor(workers, initializer=start_worker,
+                                        initargs=(table.getName(), hashMB, settings))
+
+    def root(self, position, player, key, moves, depth, first):
+        if depth < SPLIT_DEPTH:
+            return super().root(position, player, key, moves, depth, first)
+        ordered = [first] + [move for move in moves if move != first]
+        remaining = self.deadline - time.perf_counter()
+        if remaining <= 0:
+            raise SearchTimeout()
+        #Deal the moves out so the previous best starts the first share
+        shares = [share for share in (ordered[idx::self.workers] for idx in range(self.workers)) if share]
+        #Whatever is left of the search's node cap is split between them
+        maxNodes = None
+        if self.maxNodes:
+            maxNodes = (self.maxNodes - self.nodes)//len(shares)
+            if maxNodes <= 0:
+                raise SearchTimeout()
+        futures = [self.pool.submit(search_split, position, player, key, share, depth,
+                                    remaining, maxNodes, self.table.generation)
+                   for share in shares]
+        alpha = -INFINITY
+        best = first
+        finished = True
+        for future in futures:
+            score, move, nodes = future.result()
+            self.nodes += nodes
+            if score is None:
+                finished = False
+            elif score > alpha:
+                alpha = score
+                best = move
+        if not finished:
+            raise SearchTimeout()
+        tableKey, sym = self.tableKey(position, player, key)
+        self.table.store(tableKey, depth, EXACT, alpha, MOVE_SYMMETRY[sym][best])
+        return alpha, best
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.table.close(unlink=True)
+
+#Fixed positions for benchmarking, an empty board and two midgames
+BENCH_POSITIONS = [
+    ((0, 0), 0),
+    ((0b0000100010000010001000001, 0b1000000100010000100000010), 0),
+    ((0b0011000001100100000110001, 0b1100011000010011000001000), 1),
+]
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='Benchmark the Clairxo engine')
+    parser.add_argument('--time', type=float, default=0.5, help='seconds per search')
+    parser.add_argument('--rate', type=int, default=20000, help='target nodes per second')
+    parser.add_argument('--hash', type=float, default=16, help='transposition table MB')
+    parser.add_argument('--symmetric', action='store_true', help='key the table by canonical position')
+    parser.add_argument('--tablebase', help='folder of solved partitions to probe')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='benchmark the parallel search with 1 to N worker processes')
+    args = parser.parse_args()
+    if args.workers:
+        #Scaling run, same positions and time for every pool size
+        base = None
+        for workers in range(1, args.workers+1):
+            engine = ParallelEngine(workers, args.time, args.rate, hashMB=args.hash,
+                                    symmetric=args.symmetric)
+            try:
+                nps = engine.benchmark(BENCH_POSITIONS)
+            finally:
+                engine.close()
+            if base is None:
+                base = nps
+            print('%2d workers: %9.0f nodes/sec  x%.2f' % (workers, nps, nps/base))
+        sys.exit(0)
+    tablebase = None
+    if args.tablebase:
+        tablebase = Tablebase(args.tablebase)
+    engine = Engine(args.time, args.rate, hashMB=args.hash, symmetric=args.symmetric,
+                    tablebase=tablebase)
+    nps = engine.benchmark(BENCH_POSITIONS)
+    print('%.0f nodes/sec, target %d' % (nps, args.rate))
+    sys.exit(0 if nps >= args.rate else 1)
@@ -0,0 +1,122 @@
+import os
+import struct
+
+#A .gtp game file, all little endian:
+#  header   magic, version, player name lengths, X bits, O bits, turn
+#           count, journal offset, move count, chat count, chat bytes
+#  names    player one then player two, utf-8
+#  moves    one byte per move played, indices into gamemodel.MOVES
+#  offsets  one uint32 per chat message, where it starts in the chat
+#  chat     every message, utf-8, back to back
+#Everything else in a GameModel is worked out from these on load.
+MAGIC = b'CLXG'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBxIIIQIII')
+OFFSET = struct.Struct('<I')
+#What a pickled GameModel starts with, protocol 2 and up
+PICKLE_MAGIC = b'\x80'
+
+class GameFile():
+    '''Parsed game file. The sections are memoryview slices of the data
+    it was given, nothing is copied until it's asked for.
+
+    Parameters:
+        data (bytes-like): the whole file
+    '''
+    def __init__(self, data):
+        view = memoryview(data)
+        if len(view) < HEADER.size:
+            raise ValueError('Game file is too short')
+        (magic, version, first, second, self.xbits, self.obits, self.turnCount,
+         self.journalOffset, moveCount, chatCount, chatBytes) = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a game file')
+        if version > VERSION:
+            raise ValueError('Game file version ' + str(version) + ' is newer than this client')
+        self.version = version
+        start = HEADER.size
+        sections = []
+        for size in (first, second, moveCount, chatCount*OFFSET.size, chatBytes):
+            sections.append(view[start:start+size])
+            start += size
+        if start > len(view):
+            raise ValueError('Game file is cut short')
+        first, second, self.moves, self.offsets, self.chat = sections
+        self.players = [bytes(first).decode('utf-8'), bytes(second).decode('utf-8')]
+        self.chatCount = chatCount
+
+    def getBoards(self):
+        return [self.xbits, self.obits]
+
+    def getMoves(self):
+        return list(self.moves)
+
+    def getMessage(self, idx):
+        start = OFFSET.unpack_from(self.offsets, idx*OFFSET.size)[0]
+        if idx+1 < self.chatCount:
+            end = OFFSET.unpack_from(self.offsets, (idx+1)*OFFSET.size)[0]
+        else:
+            end = len(self.chat)
+        return bytes(self.chat[start:end]).decode('utf-8', 'replace')
+
+    def getMessages(self):
+        return [self.getMessage(idx) for idx in range(self.chatCount)]
+
+def pack_game(players, boards, turnCount, journalOffset, moves, messages):
+    '''Returns the bytes of a game file'''
+    names = [player.encode('utf-8')[:255] for player in players]
+    chat = [message.encode('utf-8') for message in messages]
+    offsets = bytearray()
+    start = 0
+    for message in chat:
+        offsets += OFFSET.pack(start)
+        start += len(message)
+    header = HEADER.pack(MAGIC, VERSION, len(names[0]), len(names[1]), boards[0], boards[1],
+                         turnCount, journalOffset, len(moves), len(chat), start)
+    return b''.join([header, names[0], names[1], bytes(moves), bytes(offsets)] + chat)
+
+def read_game(savefile):
+    with open(savefile, 'rb') as gfile:
+        return GameFile(gfile.read())
+
+def is_pickled(savefile):
+    with open(savefile, 'rb') as gfile:
+        return gfile.read(1) == PICKLE_MAGIC
+
+def migrate(folders, keep=False):
+    '''Converts every pickled .gtp file under the folders to the binary
+    format. Old saves may hold NumPy arrays so NumPy has to be installed
+    to read them. Only run this on folders you trust, it unpickles.
+
+    Parameters:
+        keep (bool): leave the pickle beside it as .gtp.pickle
+    '''
+    import pickle
+    converted = 0
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            for name in files:
+                savefile = os.path.join(root, name)
+                if not name.endswith('.gtp') or not is_pickled(savefile):
+                    continue
+                with open(savefile, 'rb') as gfile:
+                    gamemodel = pickle.load(gfile)
+                if keep:
+                    os.replace(savefile, savefile + '.pickle')
+                #Saves next to where it was found rather than where the
+                #old model thought the server was
+                gamemodel.gamePath = root
+                gamemodel.filename = os.path.splitext(name)[0]
+                gamemodel.save()
+                converted += 1
+                print('Converted ' + savefile)
+    print('Converted ' + str(converted) + ' games')
+    return converted
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Convert pickled .gtp games to the binary format')
+    parser.add_argument('folders', nargs='+', help='folders to search for games')
+    parser.add_argument('--keep', action='store_true', help='keep the pickles as .gtp.pickle')
+    args = parser.parse_args()
+    migrate(args.folders, args.keep)
@@ -1,78 +1,552 @@
 import datetime as dt
 import os
-import pickle
-import numpy as np
+import random
+from lib.gamefile import PICKLE_MAGIC, GameFile, pack_game
+from lib.journal import CHAT_RECORD, MOVE_RECORD
+from lib.store import STORE_ERRORS, get_store
+
+#Turns between snapshots of the whole model, in between loading replays
+#the journal past the last snapshot
+SNAPSHOT_EVERY = 16
+
+#The 5x5 playing grid is stored as two 25 bit integers, one per player.
+#Cell (row, col), 1 indexed to match the 7x7 widget grid, is bit
+#(row-1)*WIDTH + (col-1) of either board.
+WIDTH = 5
+CELLS = WIDTH*WIDTH
+FULL = (1 << CELLS) - 1
+
+def cell_bit(row, col):
+    return 1 << ((row-1)*WIDTH + col-1)
+
+def shift_masks(pickup, drop):
+    '''Works out the masks needed to push a cube in from the drop point.
+
+    Parameters:
+        pickup (tuple): row, col of the picked up cube on the 5x5 grid
+        drop (tuple): row, col of the drop square on the 7x7 grid
+
+    Returns:
+        moving (int): mask of the cubes that slide one place
+        step (int): bit shift that slides them, positive is a left shift
+        insert (int): bit the new cube is pushed into
+    '''
+    pRow, pCol = pickup
+    dRow, dCol = drop
+    if dRow == 0:
+        #Pushed in from the top, everything above the gap moves down
+        cells = [(row, pCol) for row in range(1, pRow)]
+        step = WIDTH
+        insert = cell_bit(1, pCol)
+    elif dRow == WIDTH+1:
+        #Pushed in from the bottom, everything below the gap moves up
+        cells = [(row, pCol) for row in range(pRow+1, WIDTH+1)]
+        step = -WIDTH
+        insert = cell_bit(WIDTH, pCol)
+    elif dCol == 0:
+        #Pushed in from the left, everything left of the gap moves right
+        cells = [(pRow, col) for col in range(1, pCol)]
+        step = 1
+        insert = cell_bit(pRow, 1)
+    else:
+        #Pushed in from the right, everything right of the gap moves left
+        cells = [(pRow, col) for col in range(pCol+1, WIDTH+1)]
+        step = -1
+        insert = cell_bit(pRow, WIDTH)
+    moving = 0
+    for row, col in cells:
+        moving |= cell_bit(row, col)
+    return moving, step, insert
+
+def move_cells(pickup, drop):
+    '''Returns the cells a move rewrites in order from the one the cube
+    is pushed into to the one it was picked up from'''
+    pRow, pCol = pickup
+    dRow, dCol = drop
+    if dRow == 0:
+        return [(row, pCol) for row in range(1, pRow+1)]
+    if dRow == WIDTH+1:
+        return [(row, pCol) for row in range(WIDTH, pRow-1, -1)]
+    if dCol == 0:
+        return [(pRow, col) for col in range(1, pCol+1)]
+    return [(pRow, col) for col in range(WIDTH, pCol-1, -1)]
+
+def shift(position, player, moving, step, insert):
+    '''Slides the moving cubes of both boards one place and drops the
+    player's cube into the insert bit. Returns the new position tuple.'''
+    #Every cell from the insert point to the picked up cube is rewritten
+    if step > 0:
+        line = (moving << step) | insert
+        board = [(bits & ~line) | ((bits & moving) << step) for bits in position]
+    else:
+        line = (moving >> -step) | insert
+        board = [(bits & ~line) | ((bits & moving) >> -step) for bits in position]
+    board[player] |= insert
+    return tuple(board)
+
+def row_mask(row):
+    mask = 0
+    for col in range(1, WIDTH+1):
+        mask |= cell_bit(row, col)
+    return mask
+
+def col_mask(col):
+    mask = 0
+    for row in range(1, WIDTH+1):
+        mask |= cell_bit(row, col)
+    return mask
+
+def make_lines():
+    '''Builds the 12 winning lines, the rows, the columns and both diaganols'''
+    lines = [row_mask(row) for row in range(1, WIDTH+1)]
+    lines += [col_mask(col) for col in range(1, WIDTH+1)]
+    diag = 0
+    anti = 0
+    for step in range(1, WIDTH+1):
+        diag |= cell_bit(step, step)
+        anti |= cell_bit(WIDTH+1-step, step)
+    lines += [diag, anti]
+    return tuple(lines)
+
+LINE_MASKS = make_lines()
+
+def lines_through(span):
+    '''Returns the winning lines that cross any cell of the span'''
+    return tuple(mask for mask in LINE_MASKS if mask & span)
+
+#A shift only rewrites one row or column so only these lines can change
+ROW_LINES = {row: lines_through(row_mask(row)) for row in range(1, WIDTH+1)}
+COL_LINES = {col: lines_through(col_mask(col)) for col in range(1, WIDTH+1)}
+
+def shifted_lines(pickup, drop):
+    '''Returns the lines touched by pushing a cube in from the drop point'''
+    if drop[0] == 0 or drop[0] == WIDTH+1:
+        return COL_LINES[pickup[1]]
+    return ROW_LINES[pickup[0]]
+
+def winners(position, lines=LINE_MASKS):
+    '''Tests the lines against both boards, returns (X won, O won)'''
+    xbits, obits = position
+    xwon = False
+    owon = False
+    for mask in lines:
+        if xbits & mask == mask:
+            xwon = True
+        elif obits & mask == mask:
+            owon = True
+    return xwon, owon
+
+def edge_cells():
+    '''Returns the 16 cells on the outside of the grid, the only ones
+    that can be picked up'''
+    return [(row, col) for row in range(1, WIDTH+1) for col in range(1, WIDTH+1)
+            if row == 1 or row == WIDTH or col == 1 or col == WIDTH]
+
+def drops_for(pickup):
+    '''Returns the 7x7 drop squares a picked up cube can be pushed back in
+    from. Any end of its row or column is valid except the one that would
+    put it straight back where it came from.'''
+    row, col = pickup
+    drops = []
+    if 1 < row < WIDTH and 1 < col < WIDTH:
+        #Interior cubes can't be picked up
+        return drops
+    if row != 1:
+        drops.append((0, col))
+    if row != WIDTH:
+        drops.append((WIDTH+1, col))
+    if col != 1:
+        drops.append((row, 0))
+    if col != WIDTH:
+        drops.append((row, WIDTH+1))
+    return drops
+
+def make_moves():
+    '''Builds every (pickup, drop) pair once. A move is its index in
+    MOVES, MOVE_TABLE holds the shift masks for it and PICKUP_MOVES
+    groups the move indices by the pickup cell\'s bit.'''
+    moves = []
+    table = []
+    pickups = []
+    for pickup in edge_cells():
+        ids = []
+        for drop in drops_for(pickup):
+            ids.append(len(moves))
+            moves.append((pickup, drop))
+            table.append(shift_masks(pickup, drop))
+        pickups.append((cell_bit(*pickup), tuple(ids)))
+    return tuple(moves), tuple(table), tuple(pickups)
+
+MOVES, MOVE_TABLE, PICKUP_MOVES = make_moves()
+MOVE_INDEX = {move: idx for idx, move in enumerate(MOVES)}
+#Lines each move can complete, for checking wins incrementally
+MOVE_LINES = tuple(shifted_lines(pickup, drop) for pickup, drop in MOVES)
+#Cells each move rewrites, all a board view has to redraw after it
+MOVE_CELLS = tuple(tuple(move_cells(pickup, drop)) for pickup, drop in MOVES)
+EDGE_MASK = row_mask(1) | row_mask(WIDTH) | col_mask(1) | col_mask(WIDTH)
+
+def legal_moves(position, player):
+    '''Returns every legal move for the player (0 for X, 1 for O) as a
+    list of indices into MOVES. Edge cubes that are blank or already the
+    player\'s own can be picked up.'''
+    theirs = position[1-player]
+    moves = []
+    for bit, ids in PICKUP_MOVES:
+        if not theirs & bit:
+            moves.extend(ids)
+    return moves
+
+def apply_move(position, player, move):
+    '''Returns the position after the player makes the move'''
+    moving, step, insert = MOVE_TABLE[move]
+    return shift(position, player, moving, step, insert)
+
+def make_zobrist(seed=0x51A1):
+    '''Random 64 bit keys for each player on each cell plus one for the
+    side to move. Seeded so every process agrees on the keys.'''
+    rng = random.Random(seed)
+    keys = tuple(tuple(rng.getrandbits(64) for cell in range(CELLS)) for player in range(2))
+    return keys, rng.getrandbits(64)
+
+ZOBRIST, ZOBRIST_SIDE = make_zobrist()
+
+def zobrist(position, player):
+    '''Builds the hash key of a position from scratch'''
+    return zobrist_update(ZOBRIST_SIDE if player else 0, (0, 0), position)
+
+def zobrist_update(key, before, after):
+    '''Updates the key for only the cells that differ between the two
+    positions, a shift touches 5 cells at most'''
+    for player in range(2):
+        changed = before[player] ^ after[player]
+        table = ZOBRIST[player]
+        while changed:
+            low = changed & -changed
+            key ^= table[low.bit_length()-1]
+            changed ^= low
+    return key
+
+#The 8 symmetries of the square as maps of (row, col). The 5x5 grid and
+#the 7x7 widget grid share their centre so one map works for cells and
+#drop squares alike.
+EDGE = WIDTH+1
+SYMMETRIES = (
+    lambda row, col: (row, col),
+    lambda row, col: (col, EDGE-row),
+    lambda row, col: (EDGE-row, EDGE-col),
+    lambda row, col: (EDGE-col, row),
+    lambda row, col: (row, EDGE-col),
+    lambda row, col: (EDGE-row, col),
+    lambda row, col: (col, row),
+    lambda row, col: (EDGE-col, EDGE-row),
+)
+#Index of the symmetry that undoes each one
+INVERSE_SYMMETRY = (0, 3, 2, 1, 4, 5, 6, 7)
+
+def make_symmetry_tables():
+    '''For each symmetry and each row of the grid maps the 32 patterns
+    that row can hold to where those bits land, so a whole board is
+    permuted with 5 lookups'''
+    tables = []
+    for sym in SYMMETRIES:
+        rows = []
+        for row in range(1, WIDTH+1):
+            patterns = []
+            for pattern in range(1 << WIDTH):
+                bits = 0
+                for col in range(1, WIDTH+1):
+                    if pattern & (1 << (col-1)):
+                        bits |= cell_bit(*sym(row, col))
+                patterns.append(bits)
+            rows.append(tuple(patterns))
+        tables.append(tuple(rows))
+    return tuple(tables)
+
+SYMMETRY_TABLES = make_symmetry_tables()
+
+def transform(bits, sym):
+    '''Permutes one board by a symmetry index'''
+    rows = SYMMETRY_TABLES[sym]
+    return (rows[0][bits & 31] | rows[1][(bits >> 5) & 31] | rows[2][(bits >> 10) & 31]
+            | rows[3][(bits >> 15) & 31] | rows[4][bits >> 20])
+
+#Where each move goes under each symmetry
+MOVE_SYMMETRY = tuple(tuple(MOVE_INDEX[(sym(*pickup), sym(*drop))] for pickup, drop in MOVES)
+                      for sym in SYMMETRIES)
+
+def canonical(position, player):
+    '''Maps a position to the smallest of its equivalents. The colour swap
+    is folded in by putting the side to move first, so X to move and the
+    mirror image with O to move land on the same representative.
+
+    Returns:
+        board (tuple): (side to move bits, opponent bits) of the representative
+        sym (int): symmetry taking the position to the representative,
+            MOVE_SYMMETRY[sym] maps moves the same way
+    '''
+    own = position[player]
+    opp = position[1-player]
+    best = (own, opp)
+    bestSym = 0
+    for sym in range(1, len(SYMMETRIES)):
+        board = (transform(own, sym), transform(opp, sym))
+        if board < best:
+            best = board
+            bestSym = sym
+    return best, bestSym
+
+def canonical_key(position, player):
+    '''Zobrist key of the canonical representative, shared by every
+    position that is the same up to symmetry and colour'''
+    return zobrist(canonical(position, player)[0], 0)
 
 class Cube():
-    def __init__(self, x, y, edge=False):
+    '''Thin view of one cell of a GameModel's bitboards, the widgets
+    still work in cubes so they read and write through this'''
+    def __init__(self, model, x, y, edge=False):
+        self.model = model
         self.x = x
         self.y = y
-        self.state = None
         self.oldstate = None
+        self.changed = False
         self.edge = edge
 
+    @property
+    def state(self):
+        return self.model.getCell(self.x, self.y)
+
     def setState(self, state):
-        self.oldstate = self.state
-        self.state = state
+        self.oldstate = self.getState()
+        self.changed = True
+        self.model.setCell(self.x, self.y, state)
 
     def setEdge(self, state=True):
         self.edge = state
 
     def getState(self):
-        return self.state
+        return self.model.getCell(self.x, self.y)
 
     def revertState(self):
-        self.state = self.oldstate
+        #Only undo what this view set, shifts no longer go through setState
+        if self.changed:
+            self.model.setCell(self.x, self.y, self.oldstate)
+            self.changed = False
 
     def getPos(self):
         return self.x, self.y
 
     def clear(self):
-        self.state = None
+        self.model.setCell(self.x, self.y, None)
 
     def compareState(self, other):
-        return self.state == other.state
+        return self.getState() == other.getState()
 
     def __eq__(self, other):
-        return self.x == other.x and self.y == other.y and self.state == other.state
+        return self.x == other.x and self.y == other.y and self.getState() == other.getState()
 
     def __str__(self):
-        return str(self.x) + ', ' + str(self.y) + ' State: ' +  str(self.state)
+        return str(self.x) + ', ' + str(self.y) + ' State: ' +  str(self.getState())
+
+class MoveDelta():
+    '''What one move changed, handed to a model's move listeners so views
+    only redraw the shifted line
+
+    Attributes:
+        move (int): index into MOVES
+        cells (tuple): (row, col) of every cell rewritten, from the one
+            the cube was pushed into to the one it was picked up from
+        step (tuple): (row, col) direction the line slid in
+        state (str): symbol pushed in, the mover's
+        turn (int): turn the move was played on
+    '''
+    def __init__(self, move, state, turn):
+        self.move = move
+        self.cells = MOVE_CELLS[move]
+        first, last = self.cells[0], self.cells[-1]
+        self.step = ((last[0] > first[0]) - (last[0] < first[0]),
+                     (last[1] > first[1]) - (last[1] < first[1]))
+        self.state = state
+        self.turn = turn
 
 class GameModel():
-    def __init__(self, gamepath, player1, player2):
+    def __init__(self, gamepath, player1, player2, store=None):
+        #Where the game and its journal are kept, see lib.store
+        self.store = store or get_store()
         self.players = [player1, player2]
         self.currentPlayer = self.players[0]
         self.gamePath = gamepath
         time = dt.datetime.now()
         self.filename = time.strftime("%d%m%Y") + self.players[0][:-1] + self.players[1][:-1]
-        self.maxwidth = 5
-        self.cubes = np.ndarray(shape=(self.maxwidth+2,self.maxwidth+2), dtype=object)
-        for row in range(1, self.maxwidth+1):
-            for col in range(1, self.maxwidth+1):
-                edge = False
-                if row==1 or row==self.maxwidth or col==1 or col==self.maxwidth:
-                    edge = True
-                self.cubes[row][col] = Cube(row, col, edge)
+        self.maxwidth = WIDTH
         self.states = ['X', 'O']
+        #X and O bitboards
+        self.boards = [0, 0]
+        self.key = zobrist(self.getPosition(), 0)
+        self.makeCubes()
         self.state = self.states[0]
         self.turnCount = 0
         self.dropPoints = []
         self.droppedPoint = None
         self.pickedUpCube = None
         self.gameover = False
+        #Every move played and chat message, kept for the game file
+        self.moves = []
+        self.messages = []
         self.chatText = ''
+        self.journal = None
+        #How far into the journal this model has seen, 0 for none of it
+        self.journalOffset = 0
+        #Called with a MoveDelta for every move applied, see addMoveListener
+        self.moveListeners = []
+        #Same players on the same day reuse the save name, the new game
+        #mustn't replay the old one's moves
+        self.journal = self.store.openJournal(self.getSaveFile(), self.players, fresh=True)
         self.save()
 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        #Games saved before the bitboards kept the states on the cubes
+        if 'boards' not in state:
+            self.boards = [0, 0]
+            for row in range(1, self.maxwidth+1):
+                for col in range(1, self.maxwidth+1):
+                    old = self.cubes[row][col].__dict__.get('state')
+                    if old in self.states:
+                        self.boards[self.states.index(old)] |= cell_bit(row, col)
+            del self.cubes
+        if 'key' not in state:
+            self.key = zobrist(self.getPosition(), self.turnCount%2)
+        if not hasattr(self, 'cubes'):
+            self.makeCubes()
+        #Games saved before the journal have seen none of it
+        if 'journalOffset' not in state:
+            self.journalOffset = 0
+        if 'moves' not in state:
+            self.moves = []
+            self.messages = [self.chatText] if self.chatText else []
+        self.store = get_store()
+        self.journal = None
+        self.moveListeners = []
+
+    def restore(self, savefile, gamefile):
+        '''Sets the model up from a GameFile read from savefile, everything
+        the file doesn't hold is worked out from the board and turn'''
+        self.players = gamefile.players
+        self.gamePath, name = os.path.split(savefile)
+        self.filename = os.path.splitext(name)[0]
+        self.maxwidth = WIDTH
+        self.states = ['X', 'O']
+        self.boards = gamefile.getBoards()
+        self.turnCount = gamefile.turnCount
+        self.key = zobrist(self.getPosition(), self.turnCount%2)
+        self.makeCubes()
+        self.state = self.states[self.turnCount%2]
+        self.currentPlayer = self.players[self.turnCount%2]
+        self.dropPoints = []
+        self.droppedPoint = None
+        self.pickedUpCube = None
+        #Only the last move can have finished the game so every line is
+        #clear unless it's over
+        self.gameover = self.checkIfWon()
+        self.moves = gamefile.getMoves()
+        self.messages = gamefile.getMessages()
+        self.chatText = ''.join(self.messages)
+        self.journal = None
+        self.journalOffset = gamefile.journalOffset
+        self.moveListeners = []
+
+    def __getstate__(self):
+        #The cubes are only views of the bitboards, rebuilt on load
+        state = self.__dict__.copy()
+        state.pop('cubes', None)
+        state.pop('journal', None)
+        state.pop('store', None)
+        state.pop('moveListeners', None)
+        return state
+
+    def getJournal(self):
+        if not self.journal:
+            self.journal = self.store.openJournal(self.getSaveFile(), self.players)
+        return self.journal
+
+    def catchUp(self):
+        '''Applies any moves and chat the journal has past what this model
+        has seen, returns the (kind, value) records applied'''
+        records, self.journalOffset = self.store.readJournal(self.getSaveFile(), self.journalOffset)
+        for kind, value in records:
+            if kind == MOVE_RECORD:
+                move, turn, stamp = value
+                #Skip moves this model has already played
+                if turn == self.turnCount:
+                    self.applyMove(move)
+            elif kind == CHAT_RECORD:
+                self.messages.append(value)
+                self.chatText += value
+        return records
+
+    def addMoveListener(self, listener):
+        '''listener is called with a MoveDelta after every move this model
+        applies, its own and any caught up from the journal'''
+        self.moveListeners.append(listener)
+
+    def removeMoveListener(self, listener):
+        if listener in self.moveListeners:
+            self.moveListeners.remove(listener)
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+    def makeCubes(self):
+        '''Builds the cube views the widgets bind to, a 7x7 grid of rows
+        with None around the edge where the drop squares go'''
+        self.cubes = [[None]*(self.maxwidth+2) for row in range(self.maxwidth+2)]
+        for row in range(1, self.maxwidth+1):
+            for col in range(1, self.maxwidth+1):
+                edge = False
+                if row==1 or row==self.maxwidth or col==1 or col==self.maxwidth:
+                    edge = True
+                self.cubes[row][col] = Cube(self, row, col, edge)
+
+    def getCell(self, row, col):
+        bit = cell_bit(row, col)
+        if self.boards[0] & bit:
+            return self.states[0]
+        if self.boards[1] & bit:
+            return self.states[1]
+        return None
+
+    def setCell(self, row, col, state):
+        before = self.getPosition()
+        bit = cell_bit(row, col)
+        self.boards[0] &= ~bit
+        self.boards[1] &= ~bit
+        if state in self.states:
+            self.boards[self.states.index(state)] |= bit
+        self.key = zobrist_update(self.key, before, self.getPosition())
+
+    def getPosition(self):
+        '''Returns the board as an (X bits, O bits) tuple'''
+        return tuple(self.boards)
+
+    def getKey(self):
+        '''Zobrist key of the position and side to move'''
+        return self.key
+
     def addMessage(self, player, newmessage):
         msg = '-'+ player
         msg += newmessage + '\n\n'
-        self.chatText += msg
-        self.save()
+        #Read back through the journal so anything the other player
+        #appended first isn't skipped
+        with self.store.lock(self.getSaveFile()):
+            self.getJournal().appendChat(msg)
+            self.catchUp()
 
     def setChat(self, chat):
+        '''Only updates the model, the chat is already in the journal'''
         self.chatText = chat
-        self.save()
+        self.messages = [chat] if chat else []
 
     def getChat(self):
         return self.chatText
@@ -101,6 +575,10 @@ class GameModel():
     def getState(self):
         return self.state
 
+    def getTurnIndex(self):
+        '''Index of the current player, 0 for X and 1 for O'''
+        return self.turnCount%2
+
     def getDropPoints(self):
         return self.dropPoints
 
@@ -122,160 +600,105 @@ class GameModel():
         self.droppedPoint = None
 
     def save(self):
-        '''Saves in the game folder'''
-        savefile = os.path.join(self.gamePath, self.filename)
-        with open(savefile + '.gtp', 'wb') as gfile:
-            pickle.dump(self, gfile)
+        '''Saves a snapshot in the game folder, the journal carries
+        everything after it. Readers see the old snapshot or this one,
+        never part of it.'''
+        with self.store.lock(self.getSaveFile()):
+            self.catchUp()
+            self.getJournal().sync()
+            data = pack_game(self.players, self.boards, self.turnCount, self.journalOffset,
+                             self.moves, self.messages)
+            self.store.writeGame(self.getSaveFile(), data)
 
     def passTurn(self):
-        #Move the dropped block into the grid shifting all of the cubes.
-        #Determine whether the shift is a row or column shift
-        startRow, startCol = self.droppedPoint
+        #Move the dropped block into the grid shifting all of the cubes
+        #between the drop point and where the cube was picked up. The
+        #whole row or column slides in one masked shift of each board.
         puc = self.getPickedUpCube()
-        pRow, pCol = puc.getPos()
-        if startRow == 0:
-            #Top Row, shift down a column
-            #Depending on where the cube was removed, not all the blocks
-            #may need to be moved down. Take where the cube was picked
-            #up and move all others above it down.
-            for row in range(pRow-1, 0, -1):
-                #Start with right above the picked up cubes location
-                #and move that state down into the cube. Cascade to the 
-                #top.
-                cube = self.cubes[row][startCol]
-                self.cubes[row+1][startCol].setState(cube.getState())
-            #Then row 1 needs the new game state added to its cube
-            self.cubes[1][startCol].setState(self.state)
-        elif startRow == self.maxwidth+1:
-            #Bottom row, shift up
-            #Start with right below the picked up cubes location
-            #and move that state into where the picked up cube was
-            #cascade down to the bottom.
-            for row in range(pRow+1, self.maxwidth+1):
-                cube = self.cubes[row][startCol]
-                self.cubes[row-1][startCol].setState(cube.getState())
-            #Then row 6 needs the new game state added to its cube
-            self.cubes[self.maxwidth][startCol].setState(self.state)
-        elif startCol == 0:
-            #Left row shift right
-            #Start with the one the left of the picked up cube
-            #and move its value to the picked up cube
-            #cascade to the left
-            for col in range(pCol-1, 0, -1):
-                #Starts with max column
-                #ends with col 1
-                cube = self.cubes[startRow][col]
-                self.cubes[startRow][col+1].setState(cube.getState())
-            #Finally put the cube on the left edge to the game state
-            self.cubes[startRow][1].setState(self.state)
-        elif startCol == self.maxwidth+1:
-            #Right row shift left
-            #Start with the one to the right of the picked up cube
-            #and move its value to the picked up cube
-            #cascade to the right
-            for col in range(pCol+1, self.maxwidth+1):
-                cube = self.cubes[startRow][col]
-                self.cubes[startRow][col-1].setState(cube.getState())
-            #Finally put the cube on the right to the game state
-            self.cubes[startRow][self.maxwidth].setState(self.state)
-        self.turnCount += 1
+        drop = self.droppedPoint
+        move = MOVE_INDEX[(puc.getPos(), drop)]
         self.pickedUpCube = None
         self.droppedPoint = None
+        #Only the move goes to the shared drive, it's applied when the
+        #journal is read back. The whole model is snapshotted every so
+        #often and when the game ends.
+        with self.store.lock(self.getSaveFile()):
+            self.catchUp()
+            try:
+                self.getJournal().appendMove(move, self.turnCount)
+            except STORE_ERRORS:
+                #Never written, put the move back to try again
+                self.pickedUpCube = puc
+                self.droppedPoint = drop
+                raise
+            self.catchUp()
+        if self.turnCount % SNAPSHOT_EVERY == 0 or self.gameover:
+            self.save()
+        return self.gameover
+
+    def applyMove(self, move):
+        '''Updates the board and turn for a move index from MOVES'''
+        pickup, drop = MOVES[move]
+        before = self.getPosition()
+        delta = MoveDelta(move, self.state, self.turnCount)
+        self.boards = list(apply_move(before, self.turnCount%2, move))
+        #Only the shifted cells and the side to move change the key
+        self.key = zobrist_update(self.key, before, self.getPosition()) ^ ZOBRIST_SIDE
+        self.turnCount += 1
+        self.moves.append(move)
         self.state = self.states[self.turnCount%2]
         self.currentPlayer = self.players[self.turnCount%2]
-        self.gameover = self.checkIfWon()
-        self.save()
+        self.gameover = self.checkLastShift(pickup, drop)
+        for listener in self.moveListeners:
+            listener(delta)
         return self.gameover
 
-    def checkIfWon(self):
-        '''Checks for rows, cols, or diaganols full of X's or O's'''
-        xwon = False
-        ywon = False
-        #Check from row 1 to maxwidth
-        for row in range(1, self.maxwidth+1):
-            #Grab the first cube in the row's state
-            state = self.cubes[row][1].getState()
-            #If its none don't check the row, its not full yet
-            if state:
-                #Go through each cube in the row not including the first
-                #and see if its the same
-                #2 to maxwidth
-                for col in range(2, self.maxwidth+1):
-                    #Get the state of that cube
-                    colstate = self.cubes[row][col].getState()
-                    if state != colstate:
-                        #Dont continue this row doesnt have all of the 
-                        #same sate
-                        break
-                #If we reached the end and didnt break it was a full
-                #row of the same
-                else:
-                    #Won on a row!
-                    if state == 'X':
-                        xwon = True
-                    else:
-                        ywon = True
-        #Check from column 1 through maxwidth
-        for col in range(1, self.maxwidth+1):
-            #Grab the first cube in the rows state
-            state = self.cubes[1][col].getState()
-            #Verify the state is not None
-            if state:
-                #Go through each column not including the first
-                #and see if tis the same
-                for row in range(2, self.maxwidth+1):
-                    rowstate = self.cubes[row][col].getState()
-                    if state != rowstate:
-                        break
-                #If you reach the end of a column and they're all the 
-                #same you won on a column
-                else:
-                    #Won on a column!
-                    if state == 'X':
-                        xwon = True
-                    else:
-                        ywon = True
-        #Diagonol Check
-        state = self.cubes[1][1].getState()
-        #Check it isn't none
-        if state:
-            for diag in range(2, self.maxwidth+1):
-                diagstate = self.cubes[diag][diag].getState()
-                if state != diagstate:
-                    break
-            #If you reach the end of the diaganol and 
-            #they the same you won on a diaganol
-            else:
-                #Won a diaganol
-                if state == 'X':
-                    xwon = True
-                else:
-                    ywon = True
-        #Start from bottom left
-        state = self.cubes[self.maxwidth][1].getState()
-        if state:
-            for diag in range(2, self.maxwidth+1):
-                diagstate = self.cubes[self.maxwidth+1-diag][diag].getState()
-                if state != diagstate:
-                    break
-            else:
-                #Won a diagaonl
-                if state == 'X':
-                    xwon = True
-                else:
-                    ywon = True
+    def checkIfWon(self, lines=LINE_MASKS):
+        '''Checks for rows, cols, or diaganols full of X's or O's
+
+        Parameters:
+            lines (tuple): line masks to test, defaults to all 12. Passing
+                only the lines a shift touched is enough after a move
+                since the game would already be over otherwise.
+        '''
+        xwon, owon = winners(self.getPosition(), lines)
         #Now that we have who may have won we need to set the winner or not
         if xwon:
-            if ywon:
+            if owon:
                 return 'Tie!'
             else:
                 return self.players[0]
         else:
-            if ywon:
+            if owon:
                 return self.players[1]
             else:
                 return None
 
+    def checkLastShift(self, pickup, drop):
+        '''Incremental checkIfWon testing only the lines crossing the
+        row or column the last move shifted'''
+        return self.checkIfWon(shifted_lines(pickup, drop))
+
+    def playMove(self, move):
+        '''Plays a move index from MOVES through the normal passTurn path'''
+        pickup, drop = MOVES[move]
+        row, col = pickup
+        self.updateDrops(self.cubes[row][col])
+        self.setDroppedPoint(*drop)
+        return self.passTurn()
+
+    def legalMoves(self):
+        '''Returns the current player's legal moves as indices into MOVES'''
+        return legal_moves(self.getPosition(), self.turnCount%2)
+
+    def canPickUp(self, gamecube):
+        '''Only edge cubes that are blank or the current player's own can
+        be picked up'''
+        bit = cell_bit(*gamecube.getPos())
+        if not bit & EDGE_MASK:
+            return False
+        return not self.boards[1-self.turnCount%2] & bit
+
     def updateDrops(self, gamecube):
         """Selects the valid points on a 7x7 grid that are valid entries based on
         and x y coordinate. If point (1, 1) is picked up, valid entries are due east
@@ -287,46 +710,17 @@ class GameModel():
         """
         self.pickedUpCube = gamecube
         self.dropPoints.clear()
-        north = 0
-        south = self.maxwidth+1
-        east = self.maxwidth+1
-        west = 0
-        row, col = gamecube.getPos()
-        if row == 1:
-            #On a northern edge
-            self.dropPoints.append((south, col))
-            if col == 1:
-                #North West Corner
-                self.dropPoints.append((row, east))
-            elif col == self.maxwidth:
-                #North East Corner
-                self.dropPoints.append((row, west))
-            else:
-                #Northern Edge
-                self.dropPoints.append((row, west))
-                self.dropPoints.append((row, east))
-        elif row == self.maxwidth:
-            #On a southern edge
-            self.dropPoints.append((north, col))
-            if col == 1:
-                #South West Corner
-                self.dropPoints.append((row, east))
-            elif col == self.maxwidth:
-                #South East Corner
-                self.dropPoints.append((row, west))
-            else:
-                self.dropPoints.append((row, west))
-                self.dropPoints.append((row, east))
-        else:
-            #Western or Eastern Front
-            if col == 1:
-                #Western Edge
-                self.dropPoints.append((row, east))
-                self.dropPoints.append((north, col))
-                self.dropPoints.append((south, col))
-            elif col == self.maxwidth:
-                #Eastern Edge
-                self.dropPoints.append((row, west))
-                self.dropPoints.append((north, col))
-                self.dropPoints.append((south, col))
+        self.dropPoints.extend(drops_for(gamecube.getPos()))
         return self.dropPoints
+
+def load_game(savefile, store=None):
+    '''Loads a game's last snapshot and replays its journal on top'''
+    store = store or get_store()
+    data = store.readGame(savefile)
+    if data[:1] == PICKLE_MAGIC:
+        raise ValueError(savefile + ' is an old pickled game, convert it with python -m lib.gamefile')
+    gamemodel = GameModel.__new__(GameModel)
+    gamemodel.store = store
+    gamemodel.restore(savefile, GameFile(data))
+    gamemodel.catchUp()
+    return gamemodel
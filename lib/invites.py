@@ -0,0 +1,85 @@
+import os
+import time
+from urllib.parse import quote, unquote
+from lib.journal import file_token
+from lib.storage import atomic_write
+
+#Seconds an unanswered invite is kept
+INVITE_TTL = 7*24*3600.0
+EXT = '.inv'
+
+class Mailbox():
+    '''A user's invites, one small file per invite in their own folder
+    under the invites folder. Reading only ever lists this user's folder
+    and claiming an invite is a rename, so only one client can accept it.
+
+    Parameters:
+        folder (str): shared invites folder, every user has one inside
+        name (str): whose mailbox this is
+        ttl (float): seconds before an unanswered invite is thrown away
+    '''
+    def __init__(self, folder, name, ttl=INVITE_TTL):
+        self.folder = folder
+        self.name = name
+        self.ttl = ttl
+        self.token = None
+        #Game name to save file
+        self.invites = {}
+
+    def box(self, name):
+        return os.path.join(self.folder, quote(name, safe=''))
+
+    def getBox(self):
+        return self.box(self.name)
+
+    def path(self, name, gamename):
+        return os.path.join(self.box(name), quote(gamename, safe='') + EXT)
+
+    def send(self, recipient, gamename, savefile):
+        '''Puts an invite to gamename in the recipient's mailbox'''
+        box = self.box(recipient)
+        if not os.path.exists(box):
+            os.makedirs(box)
+        atomic_write(self.path(recipient, gamename), (self.name + '\n' + savefile).encode('utf-8'))
+
+    def read(self):
+        '''Returns this user's invites as {game name: save file}, only
+        looking in the folder again when it has changed'''
+        box = self.getBox()
+        token = file_token(box)
+        if token is None:
+            self.invites = {}
+        elif token != self.token:
+            self.invites = {}
+            now = time.time()
+            with os.scandir(box) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(EXT):
+                        continue
+                    try:
+                        if now - entry.stat().st_mtime > self.ttl:
+                            os.remove(entry.path)
+                            continue
+                        with open(entry.path, 'rb') as ifile:
+                            sender, savefile = ifile.read().decode('utf-8').split('\n', 1)
+                    except (OSError, ValueError):
+                        #Claimed or expired by someone else as we looked
+                        continue
+                    self.invites[unquote(entry.name[:-len(EXT)])] = savefile
+        self.token = token
+        return self.invites
+
+    def claim(self, gamename):
+        '''Takes an invite out of the mailbox, returns its save file or None
+        if another client got to it first'''
+        path = self.path(self.name, gamename)
+        claimed = path + '.' + str(os.getpid()) + '.claimed'
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None
+        with open(claimed, 'rb') as ifile:
+            sender, savefile = ifile.read().decode('utf-8').split('\n', 1)
+        os.remove(claimed)
+        self.invites.pop(gamename, None)
+        return savefile
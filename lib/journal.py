@@ -0,0 +1,161 @@
+import os
+import struct
+import time
+
+#A journal is a header followed by records, only ever appended to.
+#Header: magic, version, then the two player names length prefixed.
+#Move record: type, move index, turn it was played on, unix time.
+#Chat record: type, length, then the utf-8 message.
+MAGIC = b'CLXJ'
+VERSION = 1
+HEADER = struct.Struct('<4sBBB')
+MOVE = struct.Struct('<cBHI')
+CHAT = struct.Struct('<cxH')
+MOVE_RECORD = b'M'
+CHAT_RECORD = b'C'
+#Records written between fsyncs, each one is still flushed to the OS
+#straight away so the other player sees it
+FSYNC_EVERY = 8
+
+def journal_path(savefile):
+    '''Journal kept next to a .gtp save file'''
+    return os.path.splitext(savefile)[0] + '.gtj'
+
+def file_token(path):
+    '''Cheap change token for a file, its size and modification time or
+    None if it isn't there. A journal only grows so its size doubles as a
+    generation counter, a smaller size means it was replaced.'''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+def make_header(players):
+    names = [player.encode('utf-8')[:255] for player in players]
+    return HEADER.pack(MAGIC, VERSION, len(names[0]), len(names[1])) + names[0] + names[1]
+
+def move_record(move, turn):
+    return MOVE.pack(MOVE_RECORD, move, turn, int(time.time()))
+
+def chat_record(text):
+    data = text.encode('utf-8')[:0xFFFF]
+    return CHAT.pack(CHAT_RECORD, len(data)) + data
+
+def pack_records(records):
+    '''Turns (kind, value) records from read_journal back into bytes'''
+    parts = []
+    for kind, value in records:
+        if kind == MOVE_RECORD:
+            parts.append(MOVE.pack(MOVE_RECORD, *value))
+        else:
+            parts.append(chat_record(value))
+    return b''.join(parts)
+
+def read_header(data):
+    '''Returns the players and the offset the records start at, None if
+    the header isn't all there yet'''
+    if len(data) < HEADER.size:
+        return None
+    magic, version, first, second = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a game journal')
+    end = HEADER.size + first + second
+    if len(data) < end:
+        return None
+    players = [bytes(data[HEADER.size:HEADER.size+first]).decode('utf-8'),
+               bytes(data[HEADER.size+first:end]).decode('utf-8')]
+    return players, end
+
+def read_records(data, offset):
+    '''Yields (kind, value, end) for every whole record from offset on. A
+    move's value is (move, turn, time), a chat's is its text. A record
+    still being written is left for the next read.'''
+    view = memoryview(data)
+    while offset < len(view):
+        kind = bytes(view[offset:offset+1])
+        if kind == MOVE_RECORD:
+            if offset + MOVE.size > len(view):
+                return
+            record, move, turn, stamp = MOVE.unpack_from(view, offset)
+            offset += MOVE.size
+            yield kind, (move, turn, stamp), offset
+        elif kind == CHAT_RECORD:
+            if offset + CHAT.size > len(view):
+                return
+            record, length = CHAT.unpack_from(view, offset)
+            end = offset + CHAT.size + length
+            if end > len(view):
+                return
+            text = bytes(view[offset+CHAT.size:end]).decode('utf-8', 'replace')
+            offset = end
+            yield kind, text, offset
+        else:
+            raise ValueError('Corrupt journal record at ' + str(offset))
+
+def read_journal(path, offset):
+    '''Reads the records after offset, returns them as a list of (kind,
+    value) and the offset to read from next time'''
+    records = []
+    if not os.path.exists(path):
+        return records, offset
+    with open(path, 'rb') as jfile:
+        if not offset:
+            #Nothing seen yet, start after the header
+            header = read_header(jfile.read(HEADER.size + 2*255))
+            if not header:
+                return records, 0
+            offset = header[1]
+        jfile.seek(offset)
+        data = jfile.read()
+    end = 0
+    for kind, value, end in read_records(data, 0):
+        records.append((kind, value))
+    return records, offset + end
+
+class JournalWriter():
+    '''Appends records to a game's journal, fsyncing every FSYNC_EVERY
+    records and whenever sync is called'''
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.unsynced = 0
+
+    def create(self, players, fresh=False):
+        '''Starts the journal with its header unless it already has one,
+        or over again if fresh. Returns the offset the records start at.'''
+        header = make_header(players)
+        if fresh or not os.path.exists(self.path) or not os.path.getsize(self.path):
+            with open(self.path, 'wb') as jfile:
+                jfile.write(header)
+                jfile.flush()
+                os.fsync(jfile.fileno())
+        return len(header)
+
+    def appendMove(self, move, turn):
+        return self.write(move_record(move, turn))
+
+    def appendChat(self, text):
+        return self.write(chat_record(text))
+
+    def write(self, record):
+        '''Appends one record, returns the offset just past it'''
+        if not self.file:
+            self.file = open(self.path, 'ab')
+        self.file.write(record)
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= FSYNC_EVERY:
+            self.sync()
+        return self.file.tell()
+
+    def sync(self):
+        if self.file and self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    def close(self):
+        if self.file:
+            self.sync()
+            self.file.close()
+            self.file = None
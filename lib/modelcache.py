@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+from lib.gamemodel import load_game
+
+#Parsed games kept, enough for a tournament's worth of correspondence games
+CACHE_SIZE = 32
+
+class ModelCache():
+    '''Loaded game models by save file, the least recently used are closed
+    and dropped past size. A cached model only reads the journal records
+    added since it was last used so going back into a game is quick.
+
+    get keeps the model in the cache for looking at, take hands it over
+    to be played and give puts it back when the player is done with it.
+
+    Parameters:
+        store: store the games are loaded from, see lib.store
+        size (int): models kept
+    '''
+    def __init__(self, store, size=CACHE_SIZE):
+        self.store = store
+        self.size = size
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+
+    def cached(self, savefile):
+        '''The cached model caught up, None if it isn't cached'''
+        with self.lock:
+            gamemodel = self.models.get(savefile)
+            if gamemodel is not None:
+                self.models.move_to_end(savefile)
+                gamemodel.catchUp()
+            return gamemodel
+
+    def get(self, savefile):
+        '''The game's model as it is now, loading it if it isn't cached'''
+        gamemodel = self.cached(savefile)
+        if gamemodel is None:
+            gamemodel = load_game(savefile, self.store)
+            self.give(gamemodel)
+        return gamemodel
+
+    def take(self, savefile):
+        '''Removes the game's model from the cache for the caller to play,
+        loading it if it isn't cached'''
+        gamemodel = self.cached(savefile)
+        if gamemodel is None:
+            return load_game(savefile, self.store)
+        with self.lock:
+            self.models.pop(savefile, None)
+        return gamemodel
+
+    def give(self, gamemodel):
+        '''Puts a model back, one already cached for the game is replaced'''
+        savefile = gamemodel.getSaveFile()
+        evicted = []
+        with self.lock:
+            old = self.models.pop(savefile, None)
+            if old is not None and old is not gamemodel:
+                evicted.append(old)
+            self.models[savefile] = gamemodel
+            while len(self.models) > self.size:
+                evicted.append(self.models.popitem(last=False)[1])
+        for old in evicted:
+            old.close()
+
+    def remove(self, savefile):
+        with self.lock:
+            gamemodel = self.models.pop(savefile, None)
+        if gamemodel is not None:
+            gamemodel.close()
+
+    def clear(self):
+        with self.lock:
+            models = list(self.models.values())
+            self.models = OrderedDict()
+        for gamemodel in models:
+            gamemodel.close()
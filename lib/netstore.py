@@ -0,0 +1,347 @@
+import asyncio
+import os
+import threading
+from contextlib import nullcontext
+from lib.journal import read_records
+from lib.protocol import (CHAT, CLAIM_INVITE, ERROR, EXISTS, HELLO, INVITES, LEAVE, LIST_GAMES, LOAD,
+                          MOVE, RECORD, REMOVE, ROSTER, SAVE, SEND_INVITE, SUBSCRIBE, pack, read_frame)
+from lib.watcher import EventWatcher
+
+#Seconds a request waits for the server before giving up
+TIMEOUT = 5.0
+#Watcher key for roster and invite changes, never a game name
+LOBBY = ''
+
+class RemoteError(OSError):
+    '''The server turned a request down, one of the STORE_ERRORS like
+    the other stores' failures'''
+    pass
+
+def split_address(address):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+class NetJournal():
+    '''Journal writer for NetStore, records are sent to the server which
+    checks them and appends them to the game itself'''
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    def create(self, players):
+        return 0
+
+    def appendMove(self, move, turn):
+        #A refused move raises RemoteError so the model can take it back
+        return self.store.request(MOVE, self.name, move, turn)[0]
+
+    def appendChat(self, text):
+        return self.store.request(CHAT, self.name, text)[0]
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+class NetStore():
+    '''Talks to a lib.server GameServer over TCP. The server plays every
+    move into its own copy of the game and pushes the journal records,
+    roster and invites to the clients that need them, so nothing is
+    polled and reads come out of what has been pushed.
+
+    Requests block the calling thread, the connection lives on an event
+    loop in its own thread. A dropped connection is made again on the
+    next request and the games being followed pick up where they left
+    off.
+
+    Parameters:
+        address (str): host:port of the server
+        gamePath (str): folder save file paths are made in, the server
+            only knows games by name
+    '''
+    def __init__(self, address, gamePath):
+        self.address = address
+        self.gamePath = gamePath
+        self.name = None
+        self.reader = None
+        self.writer = None
+        self.nextRequest = 1
+        self.pending = {}
+        #Games followed and the records pushed for them, as (offset
+        #after, records) in the order they came
+        self.journals = {}
+        self.offsets = {}
+        self.players = []
+        self.invites = {}
+        self.watchers = set()
+        #The server plays the computer's moves, clients only wait for them
+        self.playsComputer = True
+        self.cacheLock = threading.Lock()
+        self.loop = asyncio.new_event_loop()
+        self.connecting = None
+        self.listener = None
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def gameName(self, savefile):
+        return os.path.splitext(os.path.basename(savefile))[0]
+
+    def saveFile(self, name):
+        return os.path.join(self.gamePath, name + '.gtp')
+
+    def request(self, kind, *fields):
+        '''Sends a request and waits for its reply's fields, raises
+        ConnectionError if the server can't be reached and RemoteError if
+        it refused'''
+        future = asyncio.run_coroutine_threadsafe(self.send(kind, fields), self.loop)
+        try:
+            return future.result(TIMEOUT)
+        except (TimeoutError, asyncio.TimeoutError):
+            future.cancel()
+            #Whatever is on the other end has stopped answering, the next
+            #request starts a fresh connection
+            self.loop.call_soon_threadsafe(self.hangUp)
+            raise ConnectionError('No reply from server ' + self.address)
+
+    def hangUp(self):
+        '''Drops the connection, anything still waiting on it fails'''
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = None
+            self.writer = None
+        for reply in self.pending.values():
+            if not reply.done():
+                reply.set_exception(ConnectionError('Lost connection to ' + self.address))
+        self.pending = {}
+
+    async def shutDown(self):
+        '''Hangs up and waits for the listener to finish'''
+        for task in (self.connecting, self.listener):
+            if task is not None:
+                task.cancel()
+        self.hangUp()
+        for task in (self.connecting, self.listener):
+            if task is not None:
+                try:
+                    await task
+                except (asyncio.CancelledError, OSError):
+                    pass
+        self.listener = None
+
+    async def send(self, kind, fields, reconnect=True):
+        if reconnect:
+            await self.connect()
+        if self.writer is None:
+            raise ConnectionError('Not connected to ' + self.address)
+        request = self.nextRequest
+        self.nextRequest += 1
+        reply = self.loop.create_future()
+        self.pending[request] = reply
+        self.writer.write(pack(kind, request, *fields))
+        await self.writer.drain()
+        kind, fields = await reply
+        if kind == ERROR:
+            raise RemoteError(fields[0])
+        return fields
+
+    async def connect(self):
+        '''Opens the connection if it isn't, says hello and follows the
+        same games again'''
+        if self.writer is not None and self.connecting is None:
+            return
+        if self.connecting is None:
+            self.connecting = self.loop.create_task(self.open())
+        try:
+            await asyncio.shield(self.connecting)
+        finally:
+            self.connecting = None
+
+    async def open(self):
+        host, port = split_address(self.address)
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.listener = self.loop.create_task(self.listen(self.reader, self.writer))
+        if self.name:
+            await self.send(HELLO, [self.name], False)
+        for name in list(self.offsets):
+            offset, data = await self.send(SUBSCRIBE, [name, self.offsets[name]], False)
+            self.addRecords(name, offset, data)
+
+    async def listen(self, reader, writer):
+        '''Hands out replies and takes in pushes until the connection goes'''
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                kind, request, fields = frame
+                if request in self.pending:
+                    reply = self.pending.pop(request)
+                    #Left waiting too long and given up on
+                    if not reply.done():
+                        reply.set_result((kind, fields))
+                elif kind == RECORD:
+                    self.addRecords(*fields)
+                elif kind == ROSTER:
+                    with self.cacheLock:
+                        self.players = list(fields)
+                    self.notify(LOBBY)
+                elif kind == INVITES:
+                    with self.cacheLock:
+                        self.invites = {fields[i]: self.saveFile(fields[i+1]) for i in range(0, len(fields), 2)}
+                    self.notify(LOBBY)
+        except (ValueError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            if self.writer is writer:
+                self.hangUp()
+
+    def addRecords(self, name, offset, data):
+        if name not in self.offsets:
+            return
+        with self.cacheLock:
+            if offset <= self.offsets[name]:
+                return
+            records = [(kind, value) for kind, value, end in read_records(data, 0)]
+            self.journals[name].append((offset, records))
+            self.offsets[name] = offset
+        self.notify(name)
+
+    def notify(self, key):
+        for watcher in list(self.watchers):
+            watcher.notify(key)
+
+    def track(self, name):
+        '''Keeps the records pushed for a game from now on'''
+        with self.cacheLock:
+            if name not in self.offsets:
+                self.journals[name] = []
+                self.offsets[name] = 0
+
+    def follow(self, name):
+        '''Starts getting a game's records pushed if they aren't already'''
+        if name in self.offsets:
+            return
+        self.track(name)
+        try:
+            offset, data = self.request(SUBSCRIBE, name, 0)
+        except RemoteError:
+            #Not on the server yet, a new game is followed once it's saved
+            with self.cacheLock:
+                self.journals.pop(name, None)
+                self.offsets.pop(name, None)
+            return
+        self.addRecords(name, offset, data)
+
+    def watch(self, keys):
+        watcher = EventWatcher(keys, self.watchers.discard)
+        self.watchers.add(watcher)
+        return watcher
+
+    def lock(self, savefile):
+        #The server takes requests one at a time
+        return nullcontext()
+
+    def exists(self, savefile):
+        return bool(self.request(EXISTS, self.gameName(savefile))[0])
+
+    def readGame(self, savefile):
+        name = self.gameName(savefile)
+        #Loading follows the game from the snapshot on
+        self.track(name)
+        return self.request(LOAD, name)[0]
+
+    def writeGame(self, savefile, data):
+        name = self.gameName(savefile)
+        self.track(name)
+        self.request(SAVE, name, data)
+
+    def openJournal(self, savefile, players, fresh=False):
+        name = self.gameName(savefile)
+        if fresh:
+            #The server keeps games it already has, so the old one goes
+            #before the new one is saved
+            self.removeGame(savefile)
+        return NetJournal(self, name)
+
+    def readJournal(self, savefile, offset):
+        name = self.gameName(savefile)
+        self.follow(name)
+        records = []
+        with self.cacheLock:
+            for end, pushed in self.journals.get(name, []):
+                if end > offset:
+                    records += pushed
+                    offset = end
+        return records, offset
+
+    def gameToken(self, savefile):
+        name = self.gameName(savefile)
+        self.follow(name)
+        if name not in self.offsets:
+            return None
+        return (self.offsets[name],)
+
+    def watchGame(self, savefile):
+        name = self.gameName(savefile)
+        self.follow(name)
+        return self.watch([name])
+
+    def watchGames(self, savefiles):
+        names = [self.gameName(savefile) for savefile in savefiles]
+        for name in names:
+            self.follow(name)
+        return self.watch(names)
+
+    def removeGame(self, savefile):
+        name = self.gameName(savefile)
+        self.request(REMOVE, name)
+        with self.cacheLock:
+            self.journals.pop(name, None)
+            self.offsets.pop(name, None)
+
+    def listGames(self, player):
+        return {name: self.saveFile(name) for name in self.request(LIST_GAMES, player)}
+
+    def beat(self, name, force=False):
+        '''Being connected is being online, this only says who we are'''
+        if not name or (name == self.name and self.writer is not None and not force):
+            return False
+        self.name = name
+        self.request(HELLO, name)
+        return True
+
+    def leave(self, name):
+        if self.writer is not None:
+            self.request(LEAVE)
+        self.name = None
+
+    def roster(self):
+        with self.cacheLock:
+            return list(self.players)
+
+    def sendInvite(self, sender, recipient, gamename, savefile):
+        self.request(SEND_INVITE, recipient, gamename, self.gameName(savefile))
+
+    def readInvites(self, name):
+        with self.cacheLock:
+            return dict(self.invites)
+
+    def claimInvite(self, name, gamename):
+        game = self.request(CLAIM_INVITE, gamename)[0]
+        return self.saveFile(game) if game else None
+
+    def watchLobby(self, name):
+        return self.watch([LOBBY])
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.shutDown(), self.loop).result(TIMEOUT)
+        except (TimeoutError, asyncio.TimeoutError):
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
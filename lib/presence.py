@@ -0,0 +1,111 @@
+import os
+import threading
+import time
+from urllib.parse import quote, unquote
+from lib.journal import file_token
+from lib.storage import atomic_write
+
+#Seconds without a heartbeat before a user counts as offline. Heartbeat
+#times are the share's file times, so this also has to cover clock
+#differences between the machines and the server.
+TTL = 60.0
+#Heartbeats per TTL, a couple can be missed before anyone drops off
+BEATS_PER_TTL = 3
+EXT = '.hb'
+
+class Presence():
+    '''Who is online, kept as one heartbeat file per user in a folder. A
+    heartbeat only touches its own file so users never rewrite each
+    other's entries.
+
+    The roster is cached. The folder is only listed again when its
+    modification time says someone joined or left, in between only the
+    users whose heartbeat looks expired are checked again.
+
+    Parameters:
+        folder (str): shared presence folder
+        ttl (float): seconds a heartbeat lasts
+    '''
+    def __init__(self, folder, ttl=TTL):
+        self.folder = folder
+        self.ttl = ttl
+        self.token = None
+        #Online users and the time of their last heartbeat, the lobby
+        #and the game monitor both read the roster
+        self.seen = {}
+        self.seenLock = threading.Lock()
+        self.lastBeat = 0.0
+
+    def path(self, name):
+        return os.path.join(self.folder, quote(name, safe='') + EXT)
+
+    def beat(self, name, force=False):
+        '''Refreshes name's heartbeat if it's due, returns True if it wrote'''
+        now = time.time()
+        if not name or (not force and now - self.lastBeat < self.ttl/BEATS_PER_TTL):
+            return False
+        path = self.path(name)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            #Joining, or someone expired us while we were away
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+            atomic_write(path, name.encode('utf-8'))
+        self.lastBeat = now
+        return True
+
+    def leave(self, name):
+        if not name:
+            return
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+        self.lastBeat = 0.0
+
+    def stamp(self, name):
+        try:
+            return os.stat(self.path(name)).st_mtime
+        except OSError:
+            return None
+
+    def scan(self):
+        seen = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(EXT):
+                    try:
+                        seen[unquote(entry.name[:-len(EXT)])] = entry.stat().st_mtime
+                    except OSError:
+                        pass
+        return seen
+
+    def roster(self):
+        '''Sorted names of everyone online'''
+        with self.seenLock:
+            token = file_token(self.folder)
+            if token is None:
+                self.seen = {}
+                return []
+            if token != self.token:
+                self.token = token
+                self.seen = self.scan()
+            now = time.time()
+            for name, stamp in list(self.seen.items()):
+                if now - stamp <= self.ttl:
+                    continue
+                #Touching a file doesn't change the folder so look again
+                stamp = self.stamp(name)
+                if stamp is not None and now - stamp <= self.ttl:
+                    self.seen[name] = stamp
+                    continue
+                self.seen.pop(name, None)
+                if stamp is not None:
+                    #They'll be written again by their next heartbeat if
+                    #they're really still around
+                    try:
+                        os.remove(self.path(name))
+                    except OSError:
+                        pass
+            return sorted(self.seen)
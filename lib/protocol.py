@@ -0,0 +1,114 @@
+import asyncio
+import struct
+
+#Every message is a frame: uint32 length of the rest, uint8 kind, uint32
+#request id, then the fields. Requests get a reply with the same id,
+#pushes from the server have id 0. Each field is a one byte tag then
+#  s  uint16 length and utf-8 text
+#  b  uint32 length and raw bytes
+#  i  int64
+#  f  float64
+#  n  None
+FRAME = struct.Struct('<I')
+HEAD = struct.Struct('<BI')
+SHORT = struct.Struct('<H')
+INT = struct.Struct('<q')
+FLOAT = struct.Struct('<d')
+#Largest frame accepted, a snapshot with a long chat is well under this
+MAX_FRAME = 16*1024*1024
+
+#Requests, client to server
+HELLO = 1
+BEAT = 2
+LEAVE = 3
+SEND_INVITE = 4
+CLAIM_INVITE = 5
+LOAD = 6
+SAVE = 7
+MOVE = 8
+CHAT = 9
+EXISTS = 10
+LIST_GAMES = 11
+REMOVE = 12
+SUBSCRIBE = 13
+#Replies
+OK = 64
+ERROR = 65
+#Pushes, server to client
+RECORD = 128
+ROSTER = 129
+INVITES = 130
+
+class ProtocolError(ValueError):
+    pass
+
+def pack(kind, request, *fields):
+    '''Returns a whole frame'''
+    parts = [HEAD.pack(kind, request)]
+    for field in fields:
+        if field is None:
+            parts.append(b'n')
+        elif isinstance(field, str):
+            data = field.encode('utf-8')
+            parts += [b's', SHORT.pack(len(data)), data]
+        elif isinstance(field, (bytes, bytearray, memoryview)):
+            parts += [b'b', FRAME.pack(len(field)), bytes(field)]
+        elif isinstance(field, float):
+            parts += [b'f', FLOAT.pack(field)]
+        elif isinstance(field, int):
+            parts += [b'i', INT.pack(field)]
+        else:
+            raise ProtocolError('Can\'t send a ' + type(field).__name__)
+    body = b''.join(parts)
+    return FRAME.pack(len(body)) + body
+
+def unpack(body):
+    '''Splits a frame's body into (kind, request id, fields)'''
+    try:
+        return unpack_fields(memoryview(body))
+    except struct.error as err:
+        #Cut short or garbled on the way
+        raise ProtocolError('Bad frame: ' + str(err))
+
+def unpack_fields(view):
+    kind, request = HEAD.unpack_from(view, 0)
+    offset = HEAD.size
+    fields = []
+    while offset < len(view):
+        tag = bytes(view[offset:offset+1])
+        offset += 1
+        if tag == b'n':
+            fields.append(None)
+        elif tag == b's':
+            length = SHORT.unpack_from(view, offset)[0]
+            offset += SHORT.size
+            fields.append(bytes(view[offset:offset+length]).decode('utf-8'))
+            offset += length
+        elif tag == b'b':
+            length = FRAME.unpack_from(view, offset)[0]
+            offset += FRAME.size
+            fields.append(bytes(view[offset:offset+length]))
+            offset += length
+        elif tag == b'i':
+            fields.append(INT.unpack_from(view, offset)[0])
+            offset += INT.size
+        elif tag == b'f':
+            fields.append(FLOAT.unpack_from(view, offset)[0])
+            offset += FLOAT.size
+        else:
+            raise ProtocolError('Bad field tag ' + repr(tag))
+    if offset != len(view):
+        raise ProtocolError('Frame ran past its end')
+    return kind, request, fields
+
+async def read_frame(reader):
+    '''Reads the next frame from an asyncio stream, None at the end'''
+    try:
+        head = await reader.readexactly(FRAME.size)
+        length = FRAME.unpack(head)[0]
+        if length > MAX_FRAME:
+            raise ProtocolError('Frame of ' + str(length) + ' bytes is too big')
+        body = await reader.readexactly(length)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    return unpack(body)
@@ -0,0 +1,214 @@
+import os
+import random
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from lib.engine import Engine
+from lib.gamemodel import MOVE_LINES, apply_move, legal_moves, winners
+
+#Winner column codes
+X_WON = 0
+O_WON = 1
+TIE = 2
+UNFINISHED = 3
+
+#Column name and array type, one file each. Games are one row in the
+#game columns and length rows in the move columns.
+GAME_COLUMNS = [('length', 'H'), ('seconds', 'd'), ('winner', 'B')]
+MOVE_COLUMNS = [('move', 'B'), ('seconds', 'f')]
+
+class ColumnStore():
+    '''Append only columnar results file, a folder with one flat array file
+    per column. The winner column is written last for each batch so its
+    length is the number of complete games, anything past that in the
+    other columns is cut off when the store is reopened.
+
+    Parameters:
+        folder (str): folder to keep the column files in
+    '''
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        self.files = {}
+        games = self.read('game', 'winner')
+        lengths = self.read('game', 'length')[:len(games)]
+        self.games = len(games)
+        self.moves = sum(lengths)
+        #Cut off anything from a batch that didn't finish writing
+        for name, code in GAME_COLUMNS:
+            self.truncate('game', name, code, self.games)
+        for name, code in MOVE_COLUMNS:
+            self.truncate('move', name, code, self.moves)
+        for table, columns in (('game', GAME_COLUMNS), ('move', MOVE_COLUMNS)):
+            for name, code in columns:
+                self.files[(table, name)] = open(self.path(table, name), 'ab')
+
+    def path(self, table, name):
+        return os.path.join(self.folder, table + '.' + name + '.col')
+
+    def code(self, table, name):
+        columns = GAME_COLUMNS if table == 'game' else MOVE_COLUMNS
+        return dict(columns)[name]
+
+    def read(self, table, name):
+        '''Reads a whole column back as an array'''
+        values = array(self.code(table, name))
+        path = self.path(table, name)
+        if os.path.exists(path):
+            with open(path, 'rb') as cfile:
+                data = cfile.read()
+            whole = len(data) - len(data) % values.itemsize
+            values.frombytes(data[:whole])
+        return values
+
+    def truncate(self, table, name, code, rows):
+        path = self.path(table, name)
+        if os.path.exists(path):
+            with open(path, 'r+b') as cfile:
+                cfile.truncate(rows*array(code).itemsize)
+
+    def append(self, results):
+        '''Writes a batch of (winner, moves, move seconds) games'''
+        if not results:
+            return
+        moves = array('B')
+        moveSeconds = array('f')
+        lengths = array('H')
+        gameSeconds = array('d')
+        winnerCodes = array('B')
+        for winner, gameMoves, seconds in results:
+            moves.extend(gameMoves)
+            moveSeconds.extend(seconds)
+            lengths.append(len(gameMoves))
+            gameSeconds.append(sum(seconds))
+            winnerCodes.append(winner)
+        columns = [(('move', 'move'), moves), (('move', 'seconds'), moveSeconds),
+                   (('game', 'length'), lengths), (('game', 'seconds'), gameSeconds),
+                   (('game', 'winner'), winnerCodes)]
+        for key, values in columns:
+            cfile = self.files[key]
+            values.tofile(cfile)
+            cfile.flush()
+            os.fsync(cfile.fileno())
+        self.games += len(results)
+        self.moves += len(moves)
+
+    def close(self):
+        for cfile in self.files.values():
+            cfile.close()
+        self.files = {}
+
+#Engine each pool worker plays with, set up by start_player
+_engine = None
+
+def start_player(timeLimit, maxDepth, hashMB):
+    global _engine
+    _engine = Engine(timeLimit, None, maxDepth, hashMB)
+
+def play_game(gameIndex, seed, randomPlies, maxPlies):
+    '''Plays one engine against engine game from the empty starting board.
+    The first randomPlies moves are random, seeded by the game index, so
+    the games differ and a resumed run replays the same ones.
+
+    Returns:
+        gameIndex (int), winner code, list of moves, list of move seconds
+    '''
+    rng = random.Random(seed*1000003 + gameIndex)
+    _engine.table.clear()
+    position = (0, 0)
+    player = 0
+    moves = []
+    seconds = []
+    winner = UNFINISHED
+    for ply in range(maxPlies):
+        start = time.perf_counter()
+        if ply < randomPlies:
+            move = rng.choice(legal_moves(position, player))
+        else:
+            move = _engine.search(position, player)[0]
+        seconds.append(time.perf_counter() - start)
+        position = apply_move(position, player, move)
+        moves.append(move)
+        xwon, owon = winners(position, MOVE_LINES[move])
+        if xwon and owon:
+            winner = TIE
+        elif xwon:
+            winner = X_WON
+        elif owon:
+            winner = O_WON
+        if winner != UNFINISHED:
+            break
+        player = 1 - player
+    return gameIndex, winner, moves, seconds
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered)-1, int(fraction*len(ordered)))]
+
+def run(folder, games, workers=1, timeLimit=0.05, maxDepth=32, hashMB=4, seed=0,
+        randomPlies=4, maxPlies=200, batch=16):
+    '''Plays games until the store in folder holds the requested number,
+    then reports throughput. Stopping and rerunning carries on from the
+    last complete batch.'''
+    store = ColumnStore(folder)
+    first = store.games
+    if first < games:
+        print('Playing games ' + str(first) + ' to ' + str(games-1) + ' on ' + str(workers) + ' workers')
+    start = time.perf_counter()
+    pending = []
+    with ProcessPoolExecutor(workers, initializer=start_player,
+                             initargs=(timeLimit, maxDepth, hashMB)) as pool:
+        #map keeps the results in game order so the store stays in order
+        results = pool.map(play_game, range(first, games), [seed]*(games-first),
+                           [randomPlies]*(games-first), [maxPlies]*(games-first))
+        for gameIndex, winner, moves, seconds in results:
+            pending.append((winner, moves, seconds))
+            if len(pending) >= batch:
+                store.append(pending)
+                pending = []
+        store.append(pending)
+    elapsed = time.perf_counter() - start
+    played = store.games - first
+    store.close()
+    report(folder, played, elapsed)
+
+def report(folder, played=0, elapsed=0.0):
+    store = ColumnStore(folder)
+    outcomes = store.read('game', 'winner')
+    lengths = store.read('game', 'length')
+    gameSeconds = store.read('game', 'seconds')
+    moveSeconds = store.read('move', 'seconds')
+    store.close()
+    print(str(len(outcomes)) + ' games stored')
+    if played and elapsed:
+        print('This run: %d games in %.1fs, %.2f games/sec' % (played, elapsed, played/elapsed))
+    names = {X_WON: 'X', O_WON: 'O', TIE: 'tie', UNFINISHED: 'unfinished'}
+    print('Results: ' + ', '.join(names[code] + ' ' + str(outcomes.count(code)) for code in names))
+    for label, values, unit in (('Game length', list(lengths), ' plies'),
+                                ('Game time', list(gameSeconds), 's'),
+                                ('Move time', list(moveSeconds), 's')):
+        print('%s p50 %.3g%s, p90 %.3g%s, p99 %.3g%s' % (label, percentile(values, 0.5), unit,
+              percentile(values, 0.9), unit, percentile(values, 0.99), unit))
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Play engine against engine games without the GUI')
+    parser.add_argument('folder', help='results folder, reused to resume')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--time', type=float, default=0.05, help='seconds per move')
+    parser.add_argument('--depth', type=int, default=32, help='deepest iteration per move')
+    parser.add_argument('--hash', type=float, default=4, help='transposition table MB per worker')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--random-plies', type=int, default=4, help='random opening moves per game')
+    parser.add_argument('--max-plies', type=int, default=200, help='call the game unfinished after this')
+    parser.add_argument('--report', action='store_true', help='only report on stored games')
+    args = parser.parse_args()
+    if args.report:
+        report(args.folder)
+    else:
+        run(args.folder, args.games, args.workers, args.time, args.depth, args.hash, args.seed,
+            args.random_plies, args.max_plies)
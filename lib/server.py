@@ -0,0 +1,470 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from lib.engine import COMPUTER, Engine
+from lib.gamefile import GameFile, pack_game
+from lib.gamemodel import MOVES, GameModel, load_game
+from lib.journal import pack_records
+from lib.protocol import (CHAT, CLAIM_INVITE, ERROR, EXISTS, HELLO, INVITES, LEAVE, LIST_GAMES, LOAD,
+                          MOVE, OK, RECORD, REMOVE, ROSTER, SAVE, SEND_INVITE, SUBSCRIBE, BEAT,
+                          ProtocolError, pack, read_frame)
+from lib.store import STORE_ERRORS, FileStore, SQLStore
+
+DEFAULT_PORT = 8765
+#Executor key for calls that aren't about one game, never a game name
+LOBBY = ''
+
+class Connection():
+    '''One client, a user once it has said hello'''
+    def __init__(self, writer):
+        self.writer = writer
+        self.name = None
+        self.games = set()
+
+    def send(self, frame):
+        self.writer.write(frame)
+
+class GameServer():
+    '''Holds the games being played in memory and is the only one that
+    writes them. Moves are checked with the same canPickUp, updateDrops
+    and passTurn a client uses, then every record added to a game's
+    journal is pushed to the clients watching that game. Being online is
+    having a connection open. The server plays the Computer's side of a
+    game itself, a move is only taken from the player whose turn it is.
+
+    Games are named without their folder or .gtp on the wire, each side
+    keeps them wherever it likes.
+
+    Store calls block on locks, fsyncs and SQLite, so they run on a
+    thread per game rather than on the event loop. The connections and
+    who is watching what are only touched on the loop.
+
+    Parameters:
+        store: FileStore or SQLStore the games and invites persist in
+        folder (str): where the store keeps the games' save files
+    '''
+    def __init__(self, store, folder):
+        self.store = store
+        self.folder = folder
+        self.games = {}
+        self.watching = {}
+        self.online = {}
+        self.gamesLock = threading.Lock()
+        self.executors = {}
+        #One engine searching one game at a time, off the event loop
+        self.engine = None
+        self.engineExecutor = ThreadPoolExecutor(1)
+        self.thinking = set()
+        self.handlers = {HELLO: self.hello, BEAT: self.beat, LEAVE: self.leave,
+                         SEND_INVITE: self.sendInvite, CLAIM_INVITE: self.claimInvite,
+                         LOAD: self.load, SAVE: self.save, SUBSCRIBE: self.subscribe,
+                         MOVE: self.move, CHAT: self.chat, EXISTS: self.exists,
+                         LIST_GAMES: self.listGames, REMOVE: self.remove}
+
+    def savefile(self, name):
+        if os.path.basename(name) != name or not name:
+            raise ProtocolError('Bad game name ' + repr(name))
+        return os.path.join(self.folder, name + '.gtp')
+
+    def executor(self, name):
+        '''The thread a game's store calls run on, one per game so its
+        moves and chat are written in the order they came'''
+        if name != LOBBY:
+            self.savefile(name)
+        if name not in self.executors:
+            self.executors[name] = ThreadPoolExecutor(1)
+        return self.executors[name]
+
+    async def run(self, name, func, *args):
+        '''Runs a call that reads or writes the store off the event loop,
+        on the game's thread or LOBBY's for invites and listings, so one
+        slow disk doesn't hold up every client'''
+        return await asyncio.get_running_loop().run_in_executor(self.executor(name), func, *args)
+
+    def game(self, name):
+        '''The game's model, loaded on first use. Only call on the game's
+        thread.'''
+        with self.gamesLock:
+            gamemodel = self.games.get(name)
+        if gamemodel is None:
+            gamemodel = load_game(self.savefile(name), self.store)
+            with self.gamesLock:
+                self.games[name] = gamemodel
+        return gamemodel
+
+    def computerTurn(self, name):
+        '''Starts the computer thinking in case it's its move'''
+        if name in self.thinking:
+            return
+        self.thinking.add(name)
+        asyncio.get_running_loop().create_task(self.computerMove(name))
+
+    def computerPosition(self, name):
+        '''What the engine needs if it's the computer's move, else None'''
+        gamemodel = self.game(name)
+        if gamemodel.gameOver() or gamemodel.getCurrentPlayer() != COMPUTER:
+            return None
+        return gamemodel, gamemodel.turnCount, gamemodel.getPosition(), gamemodel.getTurnIndex(), gamemodel.getKey()
+
+    def playComputer(self, name, gamemodel, turn, move):
+        #Removed or played on while it was thinking
+        with self.gamesLock:
+            if self.games.get(name) is not gamemodel:
+                return None
+        if gamemodel.turnCount != turn:
+            return None
+        after = gamemodel.journalOffset
+        gamemodel.playMove(move)
+        return self.records(name, after)
+
+    async def computerMove(self, name):
+        try:
+            found = await self.run(name, self.computerPosition, name)
+            if found is None:
+                return
+            gamemodel, turn, position, player, key = found
+            if self.engine is None:
+                self.engine = Engine()
+            move = (await asyncio.get_running_loop().run_in_executor(
+                self.engineExecutor, self.engine.search, position, player, key))[0]
+            if move is None:
+                return
+            played = await self.run(name, self.playComputer, name, gamemodel, turn, move)
+            if played:
+                self.publish(name, *played)
+        except (ValueError,) + STORE_ERRORS as err:
+            print('Computer could not move in ' + name + ': ' + str(err))
+        finally:
+            self.thinking.discard(name)
+
+    async def handle(self, reader, writer):
+        conn = Connection(writer)
+        try:
+            while True:
+                frame = await read_frame(reader)
+                if frame is None:
+                    break
+                kind, request, fields = frame
+                try:
+                    if kind not in self.handlers:
+                        raise ProtocolError('Unknown request ' + str(kind))
+                    if kind != HELLO and conn.name is None:
+                        raise ProtocolError('Say hello first')
+                    reply = await self.handlers[kind](conn, *fields)
+                    conn.send(pack(OK, request, *reply))
+                except (ValueError, TypeError, KeyError) + STORE_ERRORS as err:
+                    conn.send(pack(ERROR, request, str(err)))
+                await writer.drain()
+        except (ProtocolError, ConnectionError):
+            pass
+        finally:
+            self.drop(conn)
+            writer.close()
+
+    def drop(self, conn):
+        for name in conn.games:
+            self.watching.get(name, set()).discard(conn)
+        conn.games = set()
+        self.offline(conn)
+
+    def offline(self, conn):
+        if conn.name and conn in self.online.get(conn.name, set()):
+            self.online[conn.name].discard(conn)
+            if not self.online[conn.name]:
+                self.online.pop(conn.name)
+                self.pushRoster()
+
+    def pushRoster(self):
+        frame = pack(ROSTER, 0, *sorted(self.online))
+        for conns in self.online.values():
+            for conn in conns:
+                conn.send(frame)
+
+    async def pushInvites(self, user):
+        fields = []
+        for gamename, savefile in (await self.run(LOBBY, self.store.readInvites, user)).items():
+            fields += [gamename, os.path.splitext(os.path.basename(savefile))[0]]
+        frame = pack(INVITES, 0, *fields)
+        for conn in self.online.get(user, set()):
+            conn.send(frame)
+
+    def records(self, name, after):
+        '''Everything in a game's journal after offset after, as the new
+        offset and the records' bytes'''
+        records, offset = self.store.readJournal(self.savefile(name), after)
+        return offset, pack_records(records)
+
+    def publish(self, name, offset, data):
+        '''Pushes what was just added to a game's journal to its watchers'''
+        frame = pack(RECORD, 0, name, offset, data)
+        for conn in self.watching.get(name, set()):
+            conn.send(frame)
+        return offset
+
+    def watch(self, conn, name):
+        self.watching.setdefault(name, set()).add(conn)
+        conn.games.add(name)
+
+    def unwatch(self, conn, name):
+        self.watching.get(name, set()).discard(conn)
+        conn.games.discard(name)
+
+    async def hello(self, conn, name):
+        if conn.name == name:
+            return []
+        if name + '\n' == COMPUTER:
+            raise ValueError('The computer is played by the server')
+        #Changing name keeps the games being followed
+        self.offline(conn)
+        conn.name = name
+        self.online.setdefault(name, set()).add(conn)
+        self.pushRoster()
+        await self.pushInvites(name)
+        return []
+
+    async def beat(self, conn):
+        #The open connection is the heartbeat
+        return []
+
+    async def leave(self, conn):
+        self.offline(conn)
+        conn.name = None
+        return []
+
+    async def sendInvite(self, conn, recipient, gamename, game):
+        await self.run(LOBBY, self.store.sendInvite, conn.name, recipient, gamename, self.savefile(game))
+        await self.pushInvites(recipient)
+        return []
+
+    async def claimInvite(self, conn, gamename):
+        savefile = await self.run(LOBBY, self.store.claimInvite, conn.name, gamename)
+        await self.pushInvites(conn.name)
+        if not savefile:
+            return [None]
+        return [os.path.splitext(os.path.basename(savefile))[0]]
+
+    def snapshot(self, name):
+        gamemodel = self.game(name)
+        return pack_game(gamemodel.players, gamemodel.boards, gamemodel.turnCount,
+                         gamemodel.journalOffset, gamemodel.moves, gamemodel.messages)
+
+    async def follow(self, conn, name, func, *args):
+        '''Watches the game then runs func on its thread. Watching first
+        means nothing played after func looked is missed.'''
+        self.executor(name)
+        self.watch(conn, name)
+        try:
+            reply = await self.run(name, func, *args)
+        except BaseException:
+            self.unwatch(conn, name)
+            raise
+        self.computerTurn(name)
+        return reply
+
+    async def load(self, conn, name):
+        '''Snapshot of a game as it is now, the caller gets pushed every
+        record from then on'''
+        return [await self.follow(conn, name, self.snapshot, name)]
+
+    def missed(self, name, after):
+        self.game(name)
+        return self.records(name, after)
+
+    async def subscribe(self, conn, name, after):
+        '''Starts pushing a game's records again, after a reconnect say,
+        replying with whatever was missed since offset after'''
+        return list(await self.follow(conn, name, self.missed, name, after))
+
+    def create(self, player, name, data):
+        '''Takes on a game a client has just made. Games already here are
+        the server's to save so those are left alone.'''
+        savefile = self.savefile(name)
+        with self.gamesLock:
+            if name in self.games:
+                return
+        if self.store.exists(savefile):
+            return
+        gamemodel = GameModel.__new__(GameModel)
+        gamemodel.store = self.store
+        gamemodel.restore(savefile, GameFile(data))
+        if player not in gamemodel.players:
+            raise ValueError('Can only start games you are playing in')
+        #The journal starts again here
+        gamemodel.journalOffset = 0
+        gamemodel.save()
+        with self.gamesLock:
+            self.games[name] = gamemodel
+
+    async def save(self, conn, name, data):
+        await self.follow(conn, name, self.create, conn.name + '\n', name, data)
+        return []
+
+    def play(self, player, name, move, turn):
+        gamemodel = self.game(name)
+        if gamemodel.getCurrentPlayer() != player:
+            raise ValueError('It isn\'t your turn')
+        if gamemodel.gameOver():
+            raise ValueError('The game is over')
+        if turn != gamemodel.turnCount:
+            raise ValueError('That move was for turn ' + str(turn) + ', it\'s turn ' + str(gamemodel.turnCount))
+        if not 0 <= move < len(MOVES):
+            raise ValueError('No such move')
+        (row, col), drop = MOVES[move]
+        gamecube = gamemodel.getCubes()[row][col]
+        if not gamemodel.canPickUp(gamecube) or drop not in gamemodel.updateDrops(gamecube):
+            raise ValueError('Illegal move')
+        after = gamemodel.journalOffset
+        gamemodel.setDroppedPoint(*drop)
+        gamemodel.passTurn()
+        return self.records(name, after)
+
+    async def move(self, conn, name, move, turn):
+        offset = self.publish(name, *await self.run(name, self.play, conn.name + '\n', name, move, turn))
+        self.computerTurn(name)
+        return [offset]
+
+    def addChat(self, player, name, text):
+        gamemodel = self.game(name)
+        if player not in gamemodel.players:
+            raise ValueError('Only the players can chat')
+        after = gamemodel.journalOffset
+        with self.store.lock(gamemodel.getSaveFile()):
+            gamemodel.getJournal().appendChat(text)
+            gamemodel.catchUp()
+        return self.records(name, after)
+
+    async def chat(self, conn, name, text):
+        return [self.publish(name, *await self.run(name, self.addChat, conn.name + '\n', name, text))]
+
+    def known(self, name):
+        with self.gamesLock:
+            if name in self.games:
+                return True
+        return self.store.exists(self.savefile(name))
+
+    async def exists(self, conn, name):
+        return [int(await self.run(name, self.known, name))]
+
+    async def listGames(self, conn, player):
+        '''Names of the games player is in'''
+        games = {os.path.splitext(os.path.basename(savefile))[0]
+                 for savefile in (await self.run(LOBBY, self.store.listGames, player)).values()}
+        with self.gamesLock:
+            games.update(name for name, gamemodel in self.games.items() if player in gamemodel.players)
+        return sorted(games)
+
+    def removeGame(self, player, name):
+        if not self.known(name):
+            return
+        if player not in self.game(name).players:
+            raise ValueError('Only the players can remove a game')
+        savefile = self.savefile(name)
+        with self.gamesLock:
+            gamemodel = self.games.pop(name, None)
+        if gamemodel:
+            gamemodel.close()
+        self.store.removeGame(savefile)
+
+    async def remove(self, conn, name):
+        await self.run(name, self.removeGame, conn.name + '\n', name)
+        self.watching.pop(name, None)
+        return []
+
+    def close(self):
+        for executor in self.executors.values():
+            executor.shutdown()
+        self.engineExecutor.shutdown(wait=False)
+        with self.gamesLock:
+            for gamemodel in self.games.values():
+                gamemodel.close()
+            self.games = {}
+
+async def serve(host, port, store, folder, started=None):
+    '''Runs a GameServer until cancelled
+
+    Parameters:
+        started: optional callable given the asyncio server once it's
+            listening
+    '''
+    gameserver = GameServer(store, folder)
+    server = await asyncio.start_server(gameserver.handle, host, port)
+    if started:
+        started(server)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        gameserver.close()
+
+def bench(moves=40):
+    '''Times a move from one client's request to the other client hearing
+    about it, both on localhost'''
+    import tempfile
+    import threading
+    import time
+    from lib.netstore import NetStore
+    folder = tempfile.mkdtemp()
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    addresses = []
+    def started(server):
+        addresses.append(server.sockets[0].getsockname()[:2])
+        ready.set()
+    threading.Thread(target=loop.run_until_complete, daemon=True,
+                     args=(serve('127.0.0.1', 0, FileStore(invitePath=os.path.join(folder, 'invites')), folder, started),)).start()
+    ready.wait()
+    address = '%s:%d' % addresses[0]
+    players = []
+    for name in ('alice', 'bob'):
+        players.append(NetStore(address, folder))
+        players[-1].beat(name)
+    first = GameModel(folder, 'alice\n', 'bob\n', players[0])
+    savefile = first.getSaveFile()
+    models = [first, load_game(savefile, players[1])]
+    watchers = [store.watchGame(savefile) for store in players]
+    latencies = []
+    for ply in range(moves):
+        if models[0].gameOver():
+            break
+        mover = ply % 2
+        other = 1 - mover
+        watchers[other].wait(0)
+        start = time.perf_counter()
+        models[mover].playMove(models[mover].legalMoves()[0])
+        while not watchers[other].wait(5.0):
+            pass
+        latencies.append(time.perf_counter() - start)
+        models[other].catchUp()
+    latencies.sort()
+    print('%d moves, move to other client p50 %.2fms, max %.2fms' % (len(latencies),
+          1000*latencies[len(latencies)//2], 1000*latencies[-1]))
+    for store in players:
+        store.close()
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run the Clairxo game server')
+    parser.add_argument('folder', nargs='?', help='folder for the games')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--sqlite', help='keep games in this SQLite database instead of files')
+    parser.add_argument('--bench', action='store_true', help='time move propagation on localhost')
+    args = parser.parse_args()
+    if args.bench:
+        bench()
+    else:
+        if not args.folder:
+            parser.error('a games folder is needed')
+        if not os.path.exists(args.folder):
+            os.makedirs(args.folder)
+        if args.sqlite:
+            store = SQLStore(args.sqlite)
+        else:
+            #Invites live beside the games, presence is the connections
+            store = FileStore(invitePath=os.path.join(args.folder, 'invites'))
+        print('Serving ' + args.folder + ' on ' + args.host + ':' + str(args.port))
+        try:
+            asyncio.run(serve(args.host, args.port, store, args.folder))
+        except KeyboardInterrupt:
+            pass
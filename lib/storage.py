@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    #Windows has no fcntl, writes are still renamed into place so readers
+    #never see half a file, they just aren't serialised
+    fcntl = None
+
+#Seconds to wait for another client's lock before giving up
+LOCK_TIMEOUT = 5.0
+#Longest sleep between tries for a contended lock
+MAX_BACKOFF = 0.05
+
+#Lock contention for this process, see lock_stats
+STATS = {'acquired': 0, 'contended': 0, 'timeouts': 0, 'waited': 0.0, 'longestWait': 0.0}
+
+class LockTimeout(TimeoutError):
+    pass
+
+def lock_path(path):
+    '''Lock file kept beside a shared file. The file itself gets replaced
+    by renames so the lock can't live on it.'''
+    return path + '.lock'
+
+def temp_path(path):
+    return path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+
+def atomic_write(path, data):
+    '''Writes data to a temp file next to path then renames it over path,
+    anyone reading path sees either the old file or the new one whole'''
+    temp = temp_path(path)
+    try:
+        with open(temp, 'xb') as tfile:
+            tfile.write(data)
+            tfile.flush()
+            os.fsync(tfile.fileno())
+        os.replace(temp, path)
+    except BaseException:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+def read_text(path):
+    '''Contents of a text file, empty if it isn't there'''
+    if not os.path.exists(path):
+        return ''
+    with open(path, 'r') as tfile:
+        return tfile.read()
+
+class FileLock():
+    '''Advisory lock on a shared file for read, change, write updates. Only
+    writers need it, readers are kept safe by atomic_write.
+
+    Parameters:
+        path (str): the shared file, locked through lock_path(path)
+        timeout (float): seconds to wait before raising LockTimeout
+        shared (bool): take a shared lock instead of an exclusive one
+    '''
+    def __init__(self, path, timeout=LOCK_TIMEOUT, shared=False):
+        self.path = path
+        self.timeout = timeout
+        self.shared = shared
+        self.file = None
+
+    def acquire(self):
+        if fcntl is None:
+            return self
+        self.file = open(lock_path(self.path), 'ab')
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        start = time.monotonic()
+        delay = 0.001
+        contended = False
+        while True:
+            try:
+                fcntl.flock(self.file.fileno(), mode | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                contended = True
+                waited = time.monotonic() - start
+                if waited >= self.timeout:
+                    self.file.close()
+                    self.file = None
+                    STATS['timeouts'] += 1
+                    raise LockTimeout('Gave up waiting %.1fs for %s' % (waited, self.path))
+                time.sleep(min(delay, self.timeout - waited))
+                delay = min(delay*2, MAX_BACKOFF)
+        waited = time.monotonic() - start
+        STATS['acquired'] += 1
+        if contended:
+            STATS['contended'] += 1
+            STATS['waited'] += waited
+            STATS['longestWait'] = max(STATS['longestWait'], waited)
+        return self
+
+    def release(self):
+        if self.file:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+def lock_stats():
+    '''Copy of this process's lock counters. contended is how many
+    acquisitions had to wait, waited their total seconds.'''
+    return dict(STATS)
+
+def reset_lock_stats():
+    for name in STATS:
+        STATS[name] = type(STATS[name])()
+
+def _stress_worker(path, rounds):
+    torn = 0
+    for count in range(rounds):
+        with FileLock(path):
+            value = int(read_text(path).split('\n')[0] or 0)
+            atomic_write(path, (str(value+1) + '\n' + 'x'*4096).encode('utf-8'))
+        text = read_text(path)
+        if not text.endswith('x'*4096):
+            torn += 1
+    return torn, lock_stats()
+
+def stress(folder, workers=4, rounds=200):
+    '''Has workers increment a shared counter file, checks none of the
+    updates were lost and no read saw half a file'''
+    from concurrent.futures import ProcessPoolExecutor
+    path = os.path.join(folder, 'counter.txt')
+    atomic_write(path, b'0')
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(_stress_worker, [path]*workers, [rounds]*workers))
+    elapsed = time.perf_counter() - start
+    final = int(read_text(path).split('\n')[0])
+    print('Counter %d of %d, %d torn reads, %.0f updates/sec' % (final, workers*rounds,
+          sum(torn for torn, stats in results), workers*rounds/elapsed))
+    for worker, (torn, stats) in enumerate(results):
+        print('Worker %d: %d of %d locks contended, %.3fs waiting, longest %.1fms, %d timeouts' % (
+              worker, stats['contended'], stats['acquired'], stats['waited'],
+              1000*stats['longestWait'], stats['timeouts']))
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+    parser = argparse.ArgumentParser(description='Stress the shared file locking')
+    parser.add_argument('folder', nargs='?', help='folder to test in, defaults to a temp folder')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+    stress(args.folder or tempfile.mkdtemp(), args.workers, args.rounds)
@@ -0,0 +1,467 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from lib.gamefile import GameFile
+from lib.invites import INVITE_TTL, Mailbox
+from lib.journal import (JournalWriter, chat_record, file_token, journal_path, move_record,
+                         pack_records, read_journal, read_records)
+from lib.presence import BEATS_PER_TTL, TTL, Presence
+from lib.storage import LOCK_TIMEOUT, FileLock, atomic_write, lock_path
+from lib.watcher import make_watcher
+
+#What a store raises when the server can't be reached
+STORE_ERRORS = (OSError, sqlite3.Error)
+
+#Every store offers the same calls, games are always named by their save
+#file path so a model doesn't care which one it's using. lib.netstore's
+#NetStore is the third, talking to a lib.server over the network.
+#  games     lock, exists, readGame, writeGame, openJournal, readJournal,
+#            gameToken, watchGame, watchGames, removeGame, listGames
+#  presence  beat, leave, roster
+#  invites   sendInvite, readInvites, claimInvite, watchLobby
+#playsComputer says whether the store moves for the computer itself or
+#leaves it to the client playing it.
+
+class FileStore():
+    '''Everything kept as files in the shared server folder
+
+    Parameters:
+        presencePath (str): heartbeat folder, see lib.presence
+        invitePath (str): mailbox folder, see lib.invites
+        watcherBackend (str): how files are watched, see lib.watcher
+    '''
+    def __init__(self, presencePath=None, invitePath=None, watcherBackend='auto'):
+        self.presence = Presence(presencePath) if presencePath else None
+        self.invitePath = invitePath
+        self.watcherBackend = watcherBackend
+        #The client playing against the computer makes its moves
+        self.playsComputer = False
+        self.mailboxes = {}
+
+    def lock(self, savefile):
+        return FileLock(savefile)
+
+    def exists(self, savefile):
+        return os.path.exists(savefile)
+
+    def readGame(self, savefile):
+        with open(savefile, 'rb') as gfile:
+            return gfile.read()
+
+    def writeGame(self, savefile, data):
+        atomic_write(savefile, data)
+
+    def openJournal(self, savefile, players, fresh=False):
+        '''Journal writer for a game, fresh drops whatever an earlier game
+        saved under the same name left in it'''
+        journal = JournalWriter(journal_path(savefile))
+        #Older games get their journal started on first use
+        journal.create(players, fresh)
+        return journal
+
+    def readJournal(self, savefile, offset):
+        return read_journal(journal_path(savefile), offset)
+
+    def gameToken(self, savefile):
+        '''Changes whenever the game's journal does, the first value only
+        grows unless the journal was started again'''
+        return file_token(journal_path(savefile))
+
+    def watchPaths(self, savefile):
+        return [savefile, journal_path(savefile)]
+
+    def watchGame(self, savefile):
+        return make_watcher(self.watchPaths(savefile), self.watcherBackend)
+
+    def watchGames(self, savefiles):
+        '''One watcher for many games'''
+        paths = []
+        for savefile in savefiles:
+            paths += [path for path in self.watchPaths(savefile) if path not in paths]
+        return make_watcher(paths, self.watcherBackend)
+
+    def removeGame(self, savefile):
+        for path in (savefile, journal_path(savefile), lock_path(savefile)):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def listGames(self, player):
+        '''Nothing indexes the game folder, each client keeps its own
+        list in its config'''
+        return {}
+
+    def beat(self, name):
+        return self.presence.beat(name)
+
+    def leave(self, name):
+        self.presence.leave(name)
+
+    def roster(self):
+        return self.presence.roster()
+
+    def mailbox(self, name):
+        if name not in self.mailboxes:
+            self.mailboxes[name] = Mailbox(self.invitePath, name)
+        return self.mailboxes[name]
+
+    def sendInvite(self, sender, recipient, gamename, savefile):
+        self.mailbox(sender).send(recipient, gamename, savefile)
+
+    def readInvites(self, name):
+        return dict(self.mailbox(name).read())
+
+    def claimInvite(self, name, gamename):
+        return self.mailbox(name).claim(gamename)
+
+    def lobbyPaths(self, name):
+        return [self.presence.folder, self.mailbox(name).getBox()]
+
+    def watchLobby(self, name):
+        return make_watcher(self.lobbyPaths(name), self.watcherBackend)
+
+    def close(self):
+        pass
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    savefile TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    player1 TEXT NOT NULL,
+    player2 TEXT NOT NULL,
+    snapshot BLOB NOT NULL,
+    updated REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS games_player1 ON games (player1);
+CREATE INDEX IF NOT EXISTS games_player2 ON games (player2);
+CREATE INDEX IF NOT EXISTS games_name ON games (name);
+CREATE TABLE IF NOT EXISTS journal (
+    savefile TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    record BLOB NOT NULL,
+    PRIMARY KEY (savefile, seq));
+CREATE TABLE IF NOT EXISTS presence (
+    name TEXT PRIMARY KEY,
+    beat REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS presence_beat ON presence (beat);
+CREATE TABLE IF NOT EXISTS invites (
+    recipient TEXT NOT NULL,
+    game TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    savefile TEXT NOT NULL,
+    sent REAL NOT NULL,
+    PRIMARY KEY (recipient, game));
+CREATE INDEX IF NOT EXISTS invites_sent ON invites (sent);
+'''
+
+class SQLJournal():
+    '''Journal writer for SQLStore, each record is a row numbered from 1.
+    Rows go in with whatever transaction the caller has open so there's
+    nothing to sync.'''
+    def __init__(self, store, savefile):
+        self.store = store
+        self.savefile = savefile
+
+    def create(self, players):
+        return 0
+
+    def appendMove(self, move, turn):
+        return self.store.appendRecord(self.savefile, move_record(move, turn))
+
+    def appendChat(self, text):
+        return self.store.appendRecord(self.savefile, chat_record(text))
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+class SQLStore():
+    '''Everything in one SQLite database in WAL mode, so readers never
+    wait on the writer. WAL relies on shared memory between the clients,
+    the database has to be on a disk local to the machine they run on
+    rather than on a network share.
+
+    Each process keeps a small pool of connections shared by its threads.
+    Calls made inside lock(savefile) or transaction() run on one
+    connection in one write transaction, a move's read, append and read
+    back is a single commit.
+
+    Parameters:
+        path (str): database file, made if it doesn't exist
+        poolSize (int): idle connections kept per process
+        watcherBackend (str): how the database file is watched
+    '''
+    def __init__(self, path, poolSize=4, watcherBackend='auto'):
+        self.path = path
+        self.poolSize = poolSize
+        self.watcherBackend = watcherBackend
+        self.playsComputer = False
+        self.pool = []
+        self.poolLock = threading.Lock()
+        self.pid = os.getpid()
+        self.local = threading.local()
+        self.lastBeat = 0.0
+        with self.connection() as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=LOCK_TIMEOUT, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def take(self):
+        with self.poolLock:
+            if self.pid != os.getpid():
+                #Forked, the parent's connections aren't safe to use here
+                self.pool = []
+                self.pid = os.getpid()
+            if self.pool:
+                return self.pool.pop()
+        return self.connect()
+
+    def give(self, conn):
+        with self.poolLock:
+            if self.pid == os.getpid() and len(self.pool) < self.poolSize:
+                self.pool.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        '''A connection for a few statements, the open transaction's if
+        this thread is in one'''
+        current = getattr(self.local, 'conn', None)
+        if current is not None:
+            yield current
+            return
+        conn = self.take()
+        try:
+            yield conn
+        finally:
+            self.give(conn)
+
+    @contextmanager
+    def transaction(self):
+        '''Groups every store call made inside into one write transaction,
+        joining the open one if there is one'''
+        if getattr(self.local, 'conn', None) is not None:
+            yield self.local.conn
+            return
+        conn = self.take()
+        conn.execute('BEGIN IMMEDIATE')
+        self.local.conn = conn
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            self.local.conn = None
+            self.give(conn)
+
+    def lock(self, savefile):
+        return self.transaction()
+
+    def exists(self, savefile):
+        with self.connection() as conn:
+            return conn.execute('SELECT 1 FROM games WHERE savefile = ?', (savefile,)).fetchone() is not None
+
+    def readGame(self, savefile):
+        with self.connection() as conn:
+            row = conn.execute('SELECT snapshot FROM games WHERE savefile = ?', (savefile,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(savefile)
+        return row[0]
+
+    def writeGame(self, savefile, data):
+        gamefile = GameFile(data)
+        name = os.path.splitext(os.path.basename(savefile))[0]
+        with self.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?)',
+                         (savefile, name, gamefile.players[0], gamefile.players[1], bytes(data), time.time()))
+
+    def openJournal(self, savefile, players, fresh=False):
+        if fresh:
+            with self.transaction() as conn:
+                conn.execute('DELETE FROM journal WHERE savefile = ?', (savefile,))
+        return SQLJournal(self, savefile)
+
+    def appendRecord(self, savefile, record):
+        with self.transaction() as conn:
+            seq = conn.execute('SELECT IFNULL(MAX(seq), 0) + 1 FROM journal WHERE savefile = ?',
+                               (savefile,)).fetchone()[0]
+            conn.execute('INSERT INTO journal VALUES (?, ?, ?)', (savefile, seq, record))
+        return seq
+
+    def readJournal(self, savefile, offset):
+        '''Records after row offset, offsets are row numbers here'''
+        records = []
+        with self.connection() as conn:
+            rows = conn.execute('SELECT seq, record FROM journal WHERE savefile = ? AND seq > ? ORDER BY seq',
+                                (savefile, offset)).fetchall()
+        for seq, record in rows:
+            for kind, value, end in read_records(record, 0):
+                records.append((kind, value))
+            offset = seq
+        return records, offset
+
+    def gameToken(self, savefile):
+        with self.connection() as conn:
+            return conn.execute('SELECT IFNULL(MAX(seq), 0) FROM journal WHERE savefile = ?',
+                                (savefile,)).fetchone()
+
+    def watchPaths(self, savefile):
+        return [self.path, self.path + '-wal']
+
+    def watchGame(self, savefile):
+        return make_watcher(self.watchPaths(savefile), self.watcherBackend)
+
+    def watchGames(self, savefiles):
+        '''One watcher for many games'''
+        paths = []
+        for savefile in savefiles:
+            paths += [path for path in self.watchPaths(savefile) if path not in paths]
+        return make_watcher(paths, self.watcherBackend)
+
+    def removeGame(self, savefile):
+        with self.transaction() as conn:
+            conn.execute('DELETE FROM games WHERE savefile = ?', (savefile,))
+            conn.execute('DELETE FROM journal WHERE savefile = ?', (savefile,))
+
+    def listGames(self, player):
+        '''{game name: save file} for every game player is in'''
+        with self.connection() as conn:
+            rows = conn.execute('SELECT name, savefile FROM games WHERE player1 = ? '
+                                'UNION SELECT name, savefile FROM games WHERE player2 = ?',
+                                (player, player)).fetchall()
+        return dict(rows)
+
+    def beat(self, name, force=False):
+        now = time.time()
+        if not name or (not force and now - self.lastBeat < TTL/BEATS_PER_TTL):
+            return False
+        with self.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO presence VALUES (?, ?)', (name, now))
+            conn.execute('DELETE FROM presence WHERE beat < ?', (now - TTL,))
+        self.lastBeat = now
+        return True
+
+    def leave(self, name):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM presence WHERE name = ?', (name,))
+        self.lastBeat = 0.0
+
+    def roster(self):
+        with self.connection() as conn:
+            rows = conn.execute('SELECT name FROM presence WHERE beat >= ? ORDER BY name',
+                                (time.time() - TTL,)).fetchall()
+        return [row[0] for row in rows]
+
+    def sendInvite(self, sender, recipient, gamename, savefile):
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO invites VALUES (?, ?, ?, ?, ?)',
+                         (recipient, gamename, sender, savefile, now))
+            conn.execute('DELETE FROM invites WHERE sent < ?', (now - INVITE_TTL,))
+
+    def readInvites(self, name):
+        '''{game name: save file} for name's invites'''
+        with self.connection() as conn:
+            rows = conn.execute('SELECT game, savefile FROM invites WHERE recipient = ? AND sent >= ?',
+                                (name, time.time() - INVITE_TTL)).fetchall()
+        return dict(rows)
+
+    def claimInvite(self, name, gamename):
+        with self.transaction() as conn:
+            row = conn.execute('SELECT savefile FROM invites WHERE recipient = ? AND game = ?',
+                               (name, gamename)).fetchone()
+            if row is None:
+                return None
+            conn.execute('DELETE FROM invites WHERE recipient = ? AND game = ?', (name, gamename))
+        return row[0]
+
+    def lobbyPaths(self, name):
+        return [self.path, self.path + '-wal']
+
+    def watchLobby(self, name):
+        return make_watcher(self.lobbyPaths(name), self.watcherBackend)
+
+    def close(self):
+        with self.poolLock:
+            for conn in self.pool:
+                conn.close()
+            self.pool = []
+
+#The store games are read from and written to in this process
+_store = None
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = FileStore()
+    return _store
+
+def set_store(store):
+    global _store
+    _store = store
+
+def make_store(config):
+    '''Builds the store the config asks for'''
+    backend = config.getServerBackend()
+    if backend == 'network':
+        from lib.netstore import NetStore
+        return NetStore(config.getServerAddress(), config.getGamePath())
+    if backend == 'sqlite':
+        return SQLStore(config.getDatabasePath(), watcherBackend=config.getWatcherBackend())
+    return FileStore(config.getPresencePath(), config.getInvitePath(), config.getWatcherBackend())
+
+def import_games(folder, store):
+    '''Copies every game in a server's games folder into a SQLStore,
+    journals and all, so both backends can run side by side while
+    clients move over'''
+    from lib.gamemodel import load_game
+    files = FileStore()
+    imported = 0
+    skipped = 0
+    for name in sorted(os.listdir(folder)):
+        savefile = os.path.join(folder, name)
+        if not name.endswith('.gtp') or store.exists(savefile):
+            continue
+        try:
+            gamemodel = load_game(savefile, files)
+            records, offset = files.readJournal(savefile, 0)
+        except (ValueError,) + STORE_ERRORS as err:
+            #Pickled saves say to run python -m lib.gamefile first,
+            #the rest still come across
+            print('Skipped ' + savefile + ': ' + str(err))
+            skipped += 1
+            continue
+        with store.transaction():
+            seq = 0
+            for record in records:
+                seq = store.appendRecord(savefile, pack_records([record]))
+            #The model has already replayed all of it
+            gamemodel.close()
+            gamemodel.store = store
+            gamemodel.journalOffset = seq
+            gamemodel.save()
+        imported += 1
+        print('Imported ' + savefile)
+    print('Imported ' + str(imported) + ' games, skipped ' + str(skipped))
+    return imported
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Copy a server folder\'s games into a SQLite store')
+    parser.add_argument('games', help='the server\'s games folder')
+    parser.add_argument('database', help='SQLite database to copy them into')
+    args = parser.parse_args()
+    import_games(args.games, SQLStore(args.database))
@@ -0,0 +1,320 @@
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from lib.gamemodel import CELLS, apply_move, legal_moves, winners
+
+#Values are one byte per position from the side to move's view. 2*d+1 is
+#a win and 2*d+2 a loss d plies from the end of the game, 0 is a draw.
+#UNKNOWN is a position not solved yet, only ever in partitions still
+#being built, finished ones have it turned into DRAW.
+DRAW = 0
+UNKNOWN = 255
+MAX_DISTANCE = 126
+#Passes between checkpoints of a partition that is still being solved
+CHECKPOINT_PASSES = 4
+
+def make_binomials():
+    table = [[0]*(CELLS+1) for n in range(CELLS+1)]
+    for n in range(CELLS+1):
+        table[n][0] = 1
+        for k in range(1, n+1):
+            table[n][k] = table[n-1][k-1] + table[n-1][k]
+    return table
+
+BINOMIAL = make_binomials()
+
+def count(bits):
+    return bin(bits).count('1')
+
+def encode(won, distance):
+    distance = min(distance, MAX_DISTANCE)
+    if won:
+        return 2*distance + 1
+    return 2*distance + 2
+
+def decode(value):
+    '''Returns ('win'|'loss'|'draw', distance in plies)'''
+    if value == DRAW:
+        return 'draw', 0
+    if value & 1:
+        return 'win', (value-1)//2
+    return 'loss', (value-2)//2
+
+def partition_size(own, opp):
+    '''Positions with own cubes for the side to move and opp for the other'''
+    return BINOMIAL[CELLS][own]*BINOMIAL[CELLS-own][opp]
+
+def partition_file(folder, own, opp, ext='.bin'):
+    return os.path.join(folder, 'tb_' + str(own) + '_' + str(opp) + ext)
+
+def rank(bits, cells):
+    '''Colex rank of a set of cells among the given list of cells'''
+    result = 0
+    found = 0
+    for place, bit in enumerate(cells):
+        if bits & bit:
+            found += 1
+            result += BINOMIAL[place][found]
+    return result
+
+def unrank(value, chosen, cells):
+    '''Inverse of rank, picks chosen of the cells'''
+    bits = 0
+    for place in range(len(cells)-1, -1, -1):
+        if chosen and BINOMIAL[place][chosen] <= value:
+            value -= BINOMIAL[place][chosen]
+            bits |= cells[place]
+            chosen -= 1
+    return bits
+
+ALL_CELLS = [1 << cell for cell in range(CELLS)]
+
+def index(own, opp):
+    '''Index of a position within its piece count partition. The side to
+    move's cubes are ranked among all cells and the opponent's among the
+    cells left over.'''
+    free = [bit for bit in ALL_CELLS if not own & bit]
+    oppCount = count(opp)
+    return rank(own, ALL_CELLS)*BINOMIAL[len(free)][oppCount] + rank(opp, free)
+
+def position(idx, ownCount, oppCount):
+    '''Inverse of index, returns (own, opp)'''
+    span = BINOMIAL[CELLS-ownCount][oppCount]
+    own = unrank(idx // span, ownCount, ALL_CELLS)
+    free = [bit for bit in ALL_CELLS if not own & bit]
+    return own, unrank(idx % span, oppCount, free)
+
+def terminal(own, opp):
+    '''Value of a finished game for the side to move, None if it goes on.
+    The previous move completing lines for both is a tie, same as
+    GameModel.checkIfWon.'''
+    ownLine, oppLine = winners((own, opp))
+    if ownLine and oppLine:
+        return DRAW
+    if oppLine:
+        return encode(False, 0)
+    if ownLine:
+        return encode(True, 0)
+    return None
+
+class Tablebase():
+    '''Read only access to solved partitions, memory mapped on first use.
+
+    Parameters:
+        folder (str): folder the partition files were built in
+    '''
+    def __init__(self, folder):
+        self.folder = folder
+        self.maps = {}
+
+    def table(self, own, opp):
+        '''Returns the values for a partition or None if it isn't built'''
+        if (own, opp) not in self.maps:
+            path = partition_file(self.folder, own, opp)
+            table = None
+            if os.path.exists(path) and os.path.getsize(path):
+                with open(path, 'rb') as tfile:
+                    table = mmap.mmap(tfile.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[(own, opp)] = table
+        return self.maps[(own, opp)]
+
+    def hasPartition(self, own, opp):
+        return self.table(own, opp) is not None
+
+    def value(self, own, opp):
+        '''Raw value byte for the side to move, None if not built or not
+        solved'''
+        table = self.table(count(own), count(opp))
+        if table is None:
+            return None
+        value = table[index(own, opp)]
+        if value == UNKNOWN:
+            return None
+        return value
+
+    def probe(self, position, player):
+        '''Looks up an (X bits, O bits) position with player (0 for X, 1 for
+        O) to move. Returns ('win'|'loss'|'draw', plies) or None if its
+        partition hasn't been built.'''
+        value = self.value(position[player], position[1-player])
+        if value is None:
+            return None
+        return decode(value)
+
+    def probeGame(self, gamemodel):
+        '''Probes a GameModel for the player whose turn it is'''
+        return self.probe(gamemodel.getPosition(), gamemodel.getTurnIndex())
+
+    def close(self):
+        for table in self.maps.values():
+            if table is not None:
+                table.close()
+        self.maps = {}
+
+def load_working(folder, own, opp):
+    '''Loads a checkpoint of a partition being solved, or starts a fresh one
+    with only the finished games filled in and the rest UNKNOWN'''
+    path = partition_file(folder, own, opp, '.part')
+    size = partition_size(own, opp)
+    if os.path.exists(path) and os.path.getsize(path) == size:
+        with open(path, 'rb') as pfile:
+            return bytearray(pfile.read()), True
+    values = bytearray([UNKNOWN])*size
+    for idx in range(size):
+        result = terminal(*position(idx, own, opp))
+        if result is not None:
+            values[idx] = result
+    return values, False
+
+def write_file(path, values):
+    temp = path + '.tmp'
+    with open(temp, 'wb') as tfile:
+        tfile.write(values)
+        tfile.flush()
+        os.fsync(tfile.fileno())
+    os.replace(temp, path)
+
+def solve_pair(folder, own, opp):
+    '''Solves partition (own, opp) together with (opp, own). A move that
+    keeps the mover's count goes from one to the other so they have to be
+    iterated together. Moves that add a cube lead into partitions with
+    one more cube, which have to be built already.
+
+    Each pass recomputes every unfinished position from its children until
+    nothing changes, wins take the shortest route and losses the longest.
+    '''
+    parts = [(own, opp)]
+    if own != opp:
+        parts.append((opp, own))
+    tables = {}
+    for part in parts:
+        tables[part] = load_working(folder, *part)[0]
+    base = Tablebase(folder)
+    for ownCount, oppCount in parts:
+        #Picking up a blank adds a cube for the mover, child is from the
+        #other side's view
+        if ownCount+oppCount < CELLS:
+            child = (oppCount, ownCount+1)
+            if child not in tables:
+                if not base.hasPartition(*child):
+                    raise FileNotFoundError('Partition ' + str(child) + ' has to be built first')
+                tables[child] = base.table(*child)
+    passes = 0
+    changed = True
+    while changed:
+        changed = False
+        for ownCount, oppCount in parts:
+            values = tables[(ownCount, oppCount)]
+            for idx in range(len(values)):
+                mine, theirs = position(idx, ownCount, oppCount)
+                if terminal(mine, theirs) is not None:
+                    continue
+                result = solve_position(mine, theirs, tables)
+                if result != values[idx]:
+                    values[idx] = result
+                    changed = True
+        passes += 1
+        if changed and passes % CHECKPOINT_PASSES == 0:
+            for part in parts:
+                write_file(partition_file(folder, *part, '.part'), tables[part])
+    for part in parts:
+        #Whatever is still unsolved can't be forced either way
+        write_file(partition_file(folder, *part), tables[part].replace(bytes([UNKNOWN]), bytes([DRAW])))
+        checkpoint = partition_file(folder, *part, '.part')
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+    base.close()
+    return parts, passes
+
+def solve_position(own, opp, tables):
+    '''Works out a position's value from its children's current values'''
+    quickest = None
+    slowest = -1
+    allLost = True
+    moves = legal_moves((own, opp), 0)
+    for move in moves:
+        mine, theirs = apply_move((own, opp), 0, move)
+        #The child is seen from the opponent's side
+        value = tables[(count(theirs), count(mine))][index(theirs, mine)]
+        if value == DRAW or value == UNKNOWN:
+            allLost = False
+        elif value & 1:
+            slowest = max(slowest, (value-1)//2)
+        else:
+            allLost = False
+            distance = (value-2)//2
+            if quickest is None or distance < quickest:
+                quickest = distance
+    if quickest is not None:
+        return encode(True, quickest+1)
+    if moves and allLost:
+        return encode(False, slowest+1)
+    return UNKNOWN
+
+def pairs_for(total, minCount=0):
+    '''Partition pairs with total cubes, smaller count first'''
+    return [(own, total-own) for own in range(minCount, total//2+1)
+            if total-own <= CELLS and total-own >= minCount]
+
+def buildable(folder, own, opp):
+    '''Whether the partitions a pair's moves lead into are built'''
+    if own+opp == CELLS:
+        return True
+    return all(os.path.exists(partition_file(folder, *child))
+               for child in ((opp, own+1), (own, opp+1)))
+
+def build(folder, workers=1, minTotal=0, minCount=0, maxPositions=None):
+    '''Builds every partition from a full board down to minTotal cubes.
+    Pairs with the same total don't depend on each other so they're solved
+    across the pool. Finished partitions are skipped so a build picks up
+    where it stopped.
+
+    In pure Python the balanced partitions are out of reach, (12, 13)
+    alone is over 5 million positions. maxPositions limits the build to
+    the small lopsided partitions near a full board.
+
+    Parameters:
+        minCount (int): only build partitions where both sides have at
+            least this many cubes, everything they need has too
+        maxPositions (int): skip partitions bigger than this and any that
+            need one that was skipped
+    '''
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    with ProcessPoolExecutor(workers) as pool:
+        for total in range(CELLS, minTotal-1, -1):
+            todo = [pair for pair in pairs_for(total, minCount)
+                    if not os.path.exists(partition_file(folder, *pair))
+                    or not os.path.exists(partition_file(folder, pair[1], pair[0]))]
+            if maxPositions:
+                todo = [pair for pair in todo if partition_size(*pair) <= maxPositions
+                        and buildable(folder, *pair)]
+            futures = [pool.submit(solve_pair, folder, *pair) for pair in todo]
+            for future in futures:
+                parts, passes = future.result()
+                print('Solved ' + str(parts) + ' in ' + str(passes) + ' passes')
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Build or probe the Clairxo endgame tablebase. '
+                                     'A full build is not practical in pure Python, the middle '
+                                     'partitions run to millions of positions each, so use '
+                                     '--max-positions to build the ones near a full board.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    buildArgs = sub.add_parser('build', help='solve partitions into a folder')
+    buildArgs.add_argument('folder')
+    buildArgs.add_argument('--workers', type=int, default=os.cpu_count())
+    buildArgs.add_argument('--min-total', type=int, default=0, help='stop at this many cubes on the board')
+    buildArgs.add_argument('--min-count', type=int, default=0, help='skip partitions with fewer cubes a side')
+    buildArgs.add_argument('--max-positions', type=int, default=None,
+                           help='skip partitions with more positions, and any that depend on them')
+    probeArgs = sub.add_parser('probe', help='look up a position')
+    probeArgs.add_argument('folder')
+    probeArgs.add_argument('xbits', type=lambda text: int(text, 0))
+    probeArgs.add_argument('obits', type=lambda text: int(text, 0))
+    probeArgs.add_argument('player', type=int, help='0 for X to move, 1 for O')
+    args = parser.parse_args()
+    if args.command == 'build':
+        build(args.folder, args.workers, args.min_total, args.min_count, args.max_positions)
+    else:
+        print(Tablebase(args.folder).probe((args.xbits, args.obits), args.player))
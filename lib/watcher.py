@@ -0,0 +1,316 @@
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from lib.journal import file_token
+
+#inotify flags from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_IGNORED = 0x8000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+#Files are watched through their folders so ones replaced by a rename
+#or deleted and made again are still seen
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE)
+EVENT = struct.Struct('iIII')
+#Filesystems inotify can't see other machines' changes on
+NETWORK_FS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p', 'afs', 'ceph', 'glusterfs',
+              'fuse.sshfs', 'fuse.gvfsd-fuse'}
+
+class Watcher():
+    '''Watches a set of files and reports which ones changed. A change is
+    a different size or modification time, or the file appearing or going
+    away, so touching a file's folder or rewriting it identically inside
+    the same tick isn't reported. Each kind of watcher adds wait(timeout),
+    which blocks up to timeout seconds and returns the changed files.
+
+    Parameters:
+        paths (list): files to watch, they don't have to exist yet. A
+            folder is reported when something is added to, removed from
+            or renamed in it.
+    '''
+    def __init__(self, paths):
+        self.tokens = {}
+        self.setPaths(paths)
+
+    def setPaths(self, paths):
+        '''Swaps the watched files, ones still watched keep their token'''
+        paths = [os.path.abspath(path) for path in paths]
+        self.tokens = {path: self.tokens[path] if path in self.tokens else file_token(path)
+                       for path in paths}
+
+    def getPaths(self):
+        return list(self.tokens)
+
+    def changed(self, paths):
+        '''Returns which of the paths really changed since the last look'''
+        found = []
+        for path in paths:
+            if path in self.tokens:
+                token = file_token(path)
+                if token != self.tokens[path]:
+                    self.tokens[path] = token
+                    found.append(path)
+        return found
+
+    def close(self):
+        pass
+
+class PollingWatcher(Watcher):
+    '''Stats the files, works anywhere including network shares. Polls
+    every minInterval after a change and backs off by backoff each quiet
+    poll up to maxInterval, so idle games cost little and a conversation
+    in progress stays quick.'''
+    def __init__(self, paths, minInterval=0.05, maxInterval=1.0, backoff=1.5):
+        super().__init__(paths)
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.backoff = backoff
+        self.interval = minInterval
+        self.nextPoll = 0.0
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            if now >= self.nextPoll:
+                changed = self.changed(self.getPaths())
+                if changed:
+                    self.interval = self.minInterval
+                else:
+                    self.interval = min(self.interval*self.backoff, self.maxInterval)
+                self.nextPoll = now + self.interval
+                if changed:
+                    return changed
+            if now >= deadline:
+                return []
+            time.sleep(max(0.0, min(self.nextPoll, deadline) - now))
+
+class InotifyWatcher(Watcher):
+    '''Linux only, sleeps in the kernel until one of the files' folders
+    has an event. Raises OSError if inotify isn't available.'''
+    def __init__(self, paths):
+        import ctypes
+        import ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.folders = {}
+        try:
+            super().__init__(paths)
+        except OSError:
+            self.close()
+            raise
+
+    def setPaths(self, paths):
+        super().setPaths(paths)
+        self.watchFolders()
+
+    def watchFolders(self):
+        '''Adds watches for folders that have turned up, a file in a folder
+        that isn't there yet is watched through the nearest one that is.
+        Returns True if any were added.'''
+        added = False
+        for path in self.getPaths():
+            folder = path if os.path.isdir(path) else os.path.dirname(path)
+            while not os.path.isdir(folder) and os.path.dirname(folder) != folder:
+                folder = os.path.dirname(folder)
+            if folder not in self.folders.values():
+                wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+                if wd < 0:
+                    if not os.path.isdir(folder):
+                        #Gone again already, the next event looks again
+                        continue
+                    raise OSError('Can\'t watch ' + folder)
+                self.folders[wd] = folder
+                added = True
+        return added
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not poller.poll(remaining*1000):
+                return []
+            touched = set()
+            for folder, name in self.read():
+                touched.add(folder)
+                touched.add(os.path.join(folder, name))
+            #A folder on the way to a watched file may have just been made.
+            #It's watched before anything is reported so nothing written
+            #in it after the caller looks is missed, and what went into it
+            #before the watch is looked at now.
+            if touched and self.watchFolders():
+                touched.update(self.getPaths())
+            changed = self.changed(touched)
+            if changed:
+                return changed
+
+    def read(self):
+        '''Drains the pending events as (folder, file name)'''
+        events = []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset+length].split(b'\0', 1)[0]
+            offset += length
+            if wd not in self.folders:
+                continue
+            if mask & IN_IGNORED:
+                #The folder went away, it's watched again if it comes back
+                events.append((self.folders.pop(wd), ''))
+                continue
+            events.append((self.folders[wd], os.fsdecode(name)))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+class EventWatcher(Watcher):
+    '''Woken by whoever hears about the changes instead of looking at
+    files, like lib.netstore when the server pushes them. Reports the keys
+    passed to notify.
+
+    Parameters:
+        keys (list): what to report, anything hashable
+        onClose: optional callable given the watcher when it's closed
+    '''
+    def __init__(self, keys, onClose=None):
+        self.condition = threading.Condition()
+        self.changes = set()
+        self.onClose = onClose
+        super().__init__(keys)
+
+    def setPaths(self, keys):
+        self.tokens = {key: None for key in keys}
+
+    def notify(self, key):
+        with self.condition:
+            if key in self.tokens:
+                self.changes.add(key)
+                self.condition.notify_all()
+
+    def wait(self, timeout):
+        with self.condition:
+            self.condition.wait_for(lambda: self.changes, timeout)
+            changed = list(self.changes)
+            self.changes.clear()
+        return changed
+
+    def close(self):
+        if self.onClose:
+            self.onClose(self)
+            self.onClose = None
+
+def filesystem_type(path):
+    '''Type of the filesystem path is on from /proc/mounts, None if that
+    can't be worked out'''
+    path = os.path.realpath(path)
+    best = ''
+    fstype = None
+    try:
+        with open('/proc/mounts') as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = fields[1].replace('\\040', ' ')
+                inside = path == mount or path.startswith(mount.rstrip('/') + '/')
+                if inside and len(mount) >= len(best):
+                    best = mount
+                    fstype = fields[2]
+    except OSError:
+        return None
+    return fstype
+
+def make_watcher(paths, backend='auto'):
+    '''Builds a watcher for the files.
+
+    Parameters:
+        backend (str): 'inotify', 'poll' or 'auto' for inotify when on
+            Linux and none of the files are on a network share, polling
+            otherwise or if inotify can't be set up
+    '''
+    if backend == 'poll':
+        return PollingWatcher(paths)
+    if backend == 'auto':
+        if not sys.platform.startswith('linux'):
+            return PollingWatcher(paths)
+        for path in paths:
+            if filesystem_type(os.path.dirname(os.path.abspath(path))) in NETWORK_FS:
+                return PollingWatcher(paths)
+    try:
+        return InotifyWatcher(paths)
+    except (OSError, AttributeError):
+        if backend == 'inotify':
+            raise
+        return PollingWatcher(paths)
+
+def bench(folder, changes=10):
+    '''Times how long each backend takes to see a file change, against
+    the old fixed one second loop'''
+    import random
+    import threading
+    path = os.path.join(folder, 'watched.gtj')
+    open(path, 'wb').close()
+    backends = [('inotify', lambda: make_watcher([path], 'inotify')),
+                ('adaptive poll', lambda: PollingWatcher([path])),
+                ('fixed 1s loop', lambda: PollingWatcher([path], 1.0, 1.0))]
+    for label, build in backends:
+        try:
+            watcher = build()
+        except OSError as err:
+            print(label + ': unavailable, ' + str(err))
+            continue
+        rng = random.Random(0)
+        latencies = []
+        for change in range(changes):
+            #Changes land at random points in the watcher's cycle
+            delay = rng.uniform(0.1, 1.2)
+            written = []
+            def write():
+                time.sleep(delay)
+                written.append(time.perf_counter())
+                with open(path, 'ab') as jfile:
+                    jfile.write(b'x')
+            writer = threading.Thread(target=write)
+            writer.start()
+            seen = []
+            while not seen:
+                seen = watcher.wait(5.0)
+            latencies.append(time.perf_counter() - written[0])
+            writer.join()
+        watcher.close()
+        latencies.sort()
+        print('%s: mean %.1fms, p50 %.1fms, max %.1fms' % (label, 1000*sum(latencies)/len(latencies),
+              1000*latencies[len(latencies)//2], 1000*latencies[-1]))
+    os.remove(path)
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+    parser = argparse.ArgumentParser(description='Compare file watcher latency')
+    parser.add_argument('folder', nargs='?', help='folder to test in, a share to test polling there')
+    parser.add_argument('--changes', type=int, default=10)
+    args = parser.parse_args()
+    bench(args.folder or tempfile.mkdtemp(), args.changes)
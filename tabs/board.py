@@ -0,0 +1,249 @@
+from PyQt5.QtCore import Qt, QObject, QPoint, QRect, QSize, pyqtSignal
+from PyQt5.QtGui import QColor, QFont, QImage, QPainter, QPen
+from PyQt5.QtWidgets import QSizePolicy, QWidget
+from lib.gamemodel import WIDTH, cell_bit
+
+#Cells across the board, the 5x5 grid with a ring of drop squares
+SPAN = WIDTH + 2
+#Colour of every look a cell can have
+LOOKS = {'square': QColor('blue'),
+         'drop': QColor('green'),
+         'hover': QColor('white'),
+         'cube': QColor('#8B4513'),
+         'selected': QColor('pink')}
+GRID = QColor('black')
+
+class BoardSignals(QObject):
+    dropped = pyqtSignal(int, int)
+    lifted = pyqtSignal()
+    cancelled = pyqtSignal()
+
+class BoardGeometry():
+    '''Where the cells go in a width x height area, the board is kept
+    square and centred'''
+    def __init__(self, width, height):
+        self.cell = max(1, min(width, height)//SPAN)
+        self.left = (width - self.cell*SPAN)//2
+        self.top = (height - self.cell*SPAN)//2
+
+    def cellRect(self, row, col):
+        return QRect(self.left + col*self.cell, self.top + row*self.cell, self.cell, self.cell)
+
+    def cellAt(self, pos):
+        '''(row, col) under a point or None off the board and in the
+        corners'''
+        col = (pos.x() - self.left)//self.cell
+        row = (pos.y() - self.top)//self.cell
+        if not (0 <= row < SPAN and 0 <= col < SPAN):
+            return None
+        if row in (0, SPAN-1) and col in (0, SPAN-1):
+            return None
+        return row, col
+
+    def cells(self, rect=None):
+        '''Every cell, or only those crossing rect'''
+        for row in range(SPAN):
+            for col in range(SPAN):
+                if row in (0, SPAN-1) and col in (0, SPAN-1):
+                    continue
+                if rect is None or rect.intersects(self.cellRect(row, col)):
+                    yield row, col
+
+def is_square(row, col):
+    return row in (0, SPAN-1) or col in (0, SPAN-1)
+
+def arrow_text(row, col, state):
+    '''A cube waiting on a drop square, pointing the way it'll be pushed'''
+    if row == 0:
+        return state + '\nv'
+    if row == SPAN-1:
+        return '^\n' + state
+    if col == 0:
+        return state + ' >'
+    return '< ' + state
+
+def paint_cell(painter, rect, look, text, font):
+    painter.fillRect(rect, LOOKS[look])
+    painter.setPen(QPen(GRID))
+    painter.drawRect(rect.adjusted(0, 0, -1, -1))
+    if text:
+        painter.setFont(font)
+        painter.drawText(rect, Qt.AlignCenter, text)
+
+def board_fonts(cell):
+    '''Cube and square fonts scaled to the cell size, the old buttons
+    used 28pt and 16pt on 75 pixel cells'''
+    cube = QFont('Times New Roman')
+    cube.setPixelSize(max(6, cell*37//75))
+    square = QFont('Times New Roman')
+    square.setPixelSize(max(5, cell*21//75))
+    return cube, square
+
+def render_board(position, size, states=('X', 'O')):
+    '''Draws a position from GameModel.getPosition into a size x size
+    QImage without any widgets, for thumbnails'''
+    image = QImage(size, size, QImage.Format_ARGB32_Premultiplied)
+    image.fill(Qt.transparent)
+    geometry = BoardGeometry(size, size)
+    cubeFont, squareFont = board_fonts(geometry.cell)
+    painter = QPainter(image)
+    for row, col in geometry.cells():
+        if is_square(row, col):
+            paint_cell(painter, geometry.cellRect(row, col), 'square', '', squareFont)
+            continue
+        bit = cell_bit(row, col)
+        text = states[0] if position[0] & bit else states[1] if position[1] & bit else ''
+        paint_cell(painter, geometry.cellRect(row, col), 'cube', text, cubeFont)
+    painter.end()
+    return image
+
+class BoardWidget(QWidget):
+    '''The whole board painted by one widget straight from the model.
+    Right click and drag an edge cube onto a green square to queue a
+    move, drag it back onto the board to cancel.
+
+    Only the cells that change are repainted, a move repaints its
+    shifted line through updateCells and a drag the cells it crosses.
+    The board scales to whatever room it's given.
+    '''
+    def __init__(self, client, gamemodel):
+        super().__init__()
+        self.client = client
+        self.gamemodel = gamemodel
+        self.signals = BoardSignals()
+        self.grid = BoardGeometry(self.width(), self.height())
+        self.fonts = board_fonts(self.grid.cell)
+        #Picked up cell, squares it can go to and where it was dropped
+        self.selected = None
+        self.drops = []
+        self.dropped = None
+        #Cell under a drag and where the dragged cube is drawn
+        self.hover = None
+        self.dragging = False
+        self.dragPos = None
+        sizePolicy = QSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        sizePolicy.setHeightForWidth(True)
+        self.setSizePolicy(sizePolicy)
+        self.setMinimumSize(SPAN*30, SPAN*30)
+
+    def sizeHint(self):
+        return QSize(SPAN*75, SPAN*75)
+
+    def hasHeightForWidth(self):
+        return True
+
+    def heightForWidth(self, width):
+        return width
+
+    def resizeEvent(self, event):
+        self.grid = BoardGeometry(self.width(), self.height())
+        self.fonts = board_fonts(self.grid.cell)
+
+    def look(self, row, col):
+        '''Look and text of a cell as things stand'''
+        if is_square(row, col):
+            text = ''
+            if (row, col) == self.dropped:
+                text = arrow_text(row, col, self.gamemodel.getState())
+            if (row, col) == self.hover and self.dragging:
+                return 'hover', text
+            if (row, col) in self.drops:
+                return 'drop', text
+            return 'square', text
+        if (row, col) == self.selected:
+            return 'selected', '| |'
+        return 'cube', self.gamemodel.getCell(row, col) or ''
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        cubeFont, squareFont = self.fonts
+        for row, col in self.grid.cells(event.rect()):
+            look, text = self.look(row, col)
+            paint_cell(painter, self.grid.cellRect(row, col), look, text,
+                       squareFont if is_square(row, col) else cubeFont)
+        if self.dragging and self.dragPos is not None:
+            painter.setFont(cubeFont)
+            painter.drawText(self.dragRect(), Qt.AlignCenter, self.gamemodel.getState())
+        painter.end()
+
+    def dragRect(self):
+        half = self.grid.cell//2
+        return QRect(self.dragPos - QPoint(half, half), QSize(2*half, 2*half))
+
+    def updateCells(self, cells):
+        '''Repaints only these cells'''
+        for row, col in cells:
+            self.update(self.grid.cellRect(row, col))
+
+    def setHover(self, cell):
+        if cell != self.hover:
+            self.updateCells([c for c in (self.hover, cell) if c])
+            self.hover = cell
+
+    def canMove(self):
+        return self.client.getUserName() == self.gamemodel.getCurrentPlayer() and not self.gamemodel.gameOver()
+
+    def mousePressEvent(self, e):
+        if e.button() != Qt.RightButton or not self.canMove():
+            return
+        cell = self.grid.cellAt(e.pos())
+        if cell is None:
+            return
+        if self.dropped and cell == self.dropped:
+            #Picking the waiting cube up again to put it somewhere else
+            self.updateCells([self.dropped])
+            self.dropped = None
+            self.signals.lifted.emit()
+        elif self.selected or self.dropped or is_square(*cell):
+            return
+        else:
+            gamecube = self.gamemodel.getCubes()[cell[0]][cell[1]]
+            if not self.gamemodel.canPickUp(gamecube):
+                return
+            self.selected = cell
+            self.drops = list(self.gamemodel.updateDrops(gamecube))
+            self.updateCells([cell] + self.drops)
+        self.dragging = True
+        self.moveDrag(e.pos())
+
+    def moveDrag(self, pos):
+        if self.dragPos is not None:
+            self.update(self.dragRect())
+        self.dragPos = pos
+        self.update(self.dragRect())
+        self.setHover(self.grid.cellAt(pos))
+
+    def mouseMoveEvent(self, e):
+        if self.dragging:
+            self.moveDrag(e.pos())
+
+    def mouseReleaseEvent(self, e):
+        if not self.dragging or e.button() != Qt.RightButton:
+            return
+        self.dragging = False
+        self.update(self.dragRect())
+        self.dragPos = None
+        cell = self.grid.cellAt(e.pos())
+        self.setHover(None)
+        if cell in self.drops:
+            self.dropped = cell
+            self.updateCells([cell])
+            self.signals.dropped.emit(*cell)
+        else:
+            #Let go anywhere else to put it back
+            self.signals.cancelled.emit()
+
+    def clearMove(self):
+        '''Forgets the picked up cube and its drops, after the move was
+        played or cancelled'''
+        cells = self.drops + ([self.selected] if self.selected else [])
+        self.selected = None
+        self.drops = []
+        self.dropped = None
+        self.dragging = False
+        self.hover = None
+        self.updateCells(cells)
+
+    def thumbnail(self, size):
+        '''The board as it is now in a size x size QImage'''
+        return render_board(self.gamemodel.getPosition(), size, self.gamemodel.states)
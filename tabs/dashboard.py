@@ -0,0 +1,172 @@
+from collections import namedtuple
+from PyQt5.QtCore import Qt, QObject, QRunnable, QSize, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QIcon, QPixmap
+from PyQt5.QtWidgets import QLabel, QListView, QListWidget, QListWidgetItem, QPushButton, QVBoxLayout, QWidget
+import time
+from lib.store import STORE_ERRORS
+from tabs.board import render_board
+
+#Thumbnail size in pixels
+THUMBNAIL = 112
+#Seconds between looking for games added or removed, they don't change
+#any watched files
+RECHECK = 5.0
+
+#One game as the dashboard shows it, gathered off the GUI thread. winner
+#is None while the game is on, thumbnail is a QImage of the board.
+GameSummary = namedtuple('GameSummary', ['name', 'savefile', 'players', 'current', 'turn',
+                                         'winner', 'thumbnail'])
+
+class DashboardSignals(QObject):
+    games = pyqtSignal(object)
+    summary = pyqtSignal(object)
+    openGame = pyqtSignal(str)
+    finished = pyqtSignal()
+
+class GameItem(QListWidgetItem):
+    '''Sorts by sortKey rather than its text'''
+    def __init__(self):
+        super().__init__()
+        self.sortKey = ''
+
+    def __lt__(self, other):
+        return self.sortKey < getattr(other, 'sortKey', '')
+
+class DashboardMonitor(QRunnable):
+    '''Watches every game this client is in with one watcher, sending a
+    GameSummary for each game whose journal moved. The models come from
+    the client's model cache so opening one afterwards doesn't load it.'''
+    def __init__(self, client, *args, **kwargs):
+        super().__init__()
+        self.signals = DashboardSignals()
+        self.client = client
+        self.working = True
+        self.tokens = {}
+
+    def run(self):
+        games = {}
+        watcher = None
+        recheck = 0.0
+        while self.working:
+            self.client.heartbeat()
+            changed = False
+            if time.monotonic() > recheck:
+                recheck = time.monotonic() + RECHECK
+                latest = dict(self.client.getGames())
+                if latest != games or watcher is None:
+                    games = latest
+                    if watcher:
+                        watcher.close()
+                    try:
+                        watcher = self.client.watchGames(list(games.values()))
+                    except STORE_ERRORS:
+                        print('Did not connect to server!')
+                        watcher = None
+                    self.signals.games.emit(sorted(games))
+                    changed = True
+            if watcher is None:
+                #Try again at the next recheck
+                time.sleep(0.5)
+            elif changed or watcher.wait(0.5):
+                self.check(games)
+        if watcher:
+            watcher.close()
+        print('leaving dashboard monitor')
+
+    def check(self, games):
+        store = self.client.getStore()
+        for name, savefile in sorted(games.items()):
+            if not self.working:
+                return
+            try:
+                token = store.gameToken(savefile)
+                if token == self.tokens.get(savefile) and savefile in self.tokens:
+                    continue
+                gamemodel = self.client.getModels().get(savefile)
+            except (ValueError,) + STORE_ERRORS as err:
+                #Deleted, or an old game that has to be converted first
+                print('Can\'t show ' + name + ': ' + str(err))
+                continue
+            self.tokens[savefile] = token
+            self.signals.summary.emit(GameSummary(name, savefile, tuple(gamemodel.players),
+                                                  gamemodel.getCurrentPlayer(), gamemodel.turnCount,
+                                                  gamemodel.gameOver() or None,
+                                                  render_board(gamemodel.getPosition(), THUMBNAIL,
+                                                               gamemodel.states)))
+
+    def end(self):
+        self.working = False
+
+class Dashboard(QWidget):
+    '''Every game this client is in at a glance, whose turn it is and a
+    picture of the board. Double click a game to play it.'''
+    def __init__(self, client, statusbar):
+        super().__init__()
+        self.threadpool = QThreadPool()
+        self.client = client
+        self.statusbar = statusbar
+        self.signals = DashboardSignals()
+        self.items = {}
+        self.gameList = QListWidget()
+        self.gameList.setViewMode(QListView.IconMode)
+        self.gameList.setIconSize(QSize(THUMBNAIL, THUMBNAIL))
+        self.gameList.setResizeMode(QListView.Adjust)
+        self.gameList.setMovement(QListView.Static)
+        self.gameList.setWordWrap(True)
+        self.gameList.setSortingEnabled(True)
+        self.gameList.itemDoubleClicked.connect(self.openGame)
+        self.returnToMainBut = QPushButton('Return To Main')
+        self.returnToMainBut.clicked.connect(self.returnToMain)
+        layout = QVBoxLayout(self)
+        layout.addWidget(QLabel('Your Games'))
+        layout.addWidget(self.gameList)
+        layout.addWidget(self.returnToMainBut)
+        self.monitor = DashboardMonitor(self.client)
+        self.monitor.signals.games.connect(self.setGames)
+        self.monitor.signals.summary.connect(self.showGame)
+        self.threadpool.start(self.monitor)
+        self.statusbar.showMessage('Watching your games')
+
+    def setGames(self, names):
+        '''Drops the games no longer in the list, new ones show up with
+        their first summary'''
+        for name in list(self.items):
+            if name not in names:
+                self.gameList.takeItem(self.gameList.row(self.items.pop(name)))
+
+    def showGame(self, summary):
+        item = self.items.get(summary.name)
+        if item is None:
+            item = GameItem()
+            item.setData(Qt.UserRole, summary.name)
+            self.items[summary.name] = item
+            self.gameList.addItem(item)
+        username = self.client.getUserName()
+        if summary.winner == 'Tie!':
+            status = 'Tied'
+        elif summary.winner:
+            status = 'Won by ' + summary.winner[:-1]
+        elif summary.current == username:
+            status = 'Your turn'
+        else:
+            status = summary.current[:-1] + '\'s turn'
+        opponent = summary.players[1] if summary.players[0] == username else summary.players[0]
+        #Games waiting on you come first
+        item.sortKey = ('0' if status == 'Your turn' else '1') + summary.name
+        item.setText(opponent[:-1] + '\n' + status + '\nTurn ' + str(summary.turn))
+        item.setToolTip(summary.name)
+        item.setIcon(QIcon(QPixmap.fromImage(summary.thumbnail)))
+        self.gameList.sortItems()
+
+    def openGame(self, item):
+        self.end()
+        self.signals.openGame.emit(item.data(Qt.UserRole))
+
+    def end(self):
+        if self.monitor:
+            self.monitor.end()
+            self.monitor = None
+
+    def returnToMain(self):
+        self.end()
+        self.signals.finished.emit()
@@ -3,43 +3,69 @@ from PyQt5.QtGui import QDrag, QPixmap, QPalette, QBrush
 from PyQt5.QtWidgets import (QFileDialog, QGridLayout, QGroupBox, QHBoxLayout, QInputDialog, 
                              QLabel, QListWidget, QListWidgetItem, QLineEdit, QPushButton, QProgressBar, 
                              QRadioButton, QTextEdit, QVBoxLayout, QMessageBox, QWidget)
-import time
-import numpy as np
-import pickle
+from lib.engine import COMPUTER
+from lib.gamemodel import load_game
+from lib.journal import CHAT_RECORD
+from lib.store import STORE_ERRORS
+from tabs.board import BoardWidget
 
 class WorkerSignals(QObject):
     finished = pyqtSignal()
-    notify = pyqtSignal(object)
+    notify = pyqtSignal(int)
     getchat = pyqtSignal(str)
-
-class ButtonSignals(QObject):
-    pickedUp = pyqtSignal(object)
-    receievedCube = pyqtSignal(int, int)
-    cancelSelection = pyqtSignal()
+    moved = pyqtSignal(int)
 
 class GameMonitor(QRunnable):
+    '''Watches the current game's journal, only reading the records added
+    since the last look and only signalling when something changed'''
     def __init__(self, client, waitingForPlayer, *args, **kwargs):
         super().__init__()
         self.signals = WorkerSignals()
         self.client = client
         self.working = True
         self.waitingForPlayer = waitingForPlayer
+        self.gamemodel = None
+        self.token = None
 
     def run(self):
+        savefile = self.client.getCurrentGame()
+        watcher = self.client.watchGame(savefile)
+        retry = True
         while self.working:
-            try:
-                with open(self.client.getCurrentGame(), 'rb') as gfile:
-                    gamemodel = pickle.load(gfile)
-                    if self.waitingForPlayer:
-                        print('Waiting for other player')
-                        if gamemodel.getCurrentPlayer() == self.client.getUserName():
-                            self.signals.notify.emit(gamemodel)
-                    self.signals.getchat.emit(gamemodel.getChat())
-            except:
-                pass
-            time.sleep(1)
+            #Still in the lobby for everyone else while playing
+            self.client.heartbeat()
+            #The timeout is only how quickly end is noticed
+            if watcher.wait(0.5) or retry:
+                try:
+                    self.check()
+                    retry = False
+                except:
+                    #Caught mid write, look again next time round
+                    retry = True
+        watcher.close()
         print('leaving game monitor')
 
+    def check(self):
+        savefile = self.client.getCurrentGame()
+        token = self.client.getStore().gameToken(savefile)
+        if token == self.token and self.gamemodel:
+            return
+        if not self.gamemodel or not token or not self.token or token[0] < self.token[0]:
+            #First look or the journal was replaced, start from the snapshot
+            self.gamemodel = load_game(savefile)
+            chatChanged = True
+        else:
+            records = self.gamemodel.catchUp()
+            chatChanged = any(kind == CHAT_RECORD for kind, value in records)
+        self.token = token
+        if self.waitingForPlayer:
+            print('Waiting for other player')
+            if self.gamemodel.getCurrentPlayer() == self.client.getUserName():
+                #The tab catches its own model up to this turn
+                self.signals.notify.emit(self.gamemodel.turnCount)
+        if chatChanged:
+            self.signals.getchat.emit(self.gamemodel.getChat())
+
     def setWaitingForPlayer(self, waiting=True):
         self.waitingForPlayer = waiting
 
@@ -47,193 +73,26 @@ class GameMonitor(QRunnable):
         print('ending game monitor')
         self.working = False
 
-class SquareWidget(QPushButton):
-    '''Squares are initially blank but can receive cubes
-    temporarily as a way to indicate the intent of moving a
-    block from the square into the game
-    They also are a visual indicator of the valid drop sites
-    that a cube can be placed'''
-    def __init__(self, client, gamemodel, x, y, maxX, maxY):
+class EngineWorker(QRunnable):
+    '''Searches for the computer's move off the GUI thread'''
+    def __init__(self, engine, position, player, key, *args, **kwargs):
         super().__init__()
-        self.client = client
-        self.gamemodel = gamemodel
-        self.gamecube = None
-        self.signals = ButtonSignals()
-        self.setAcceptDrops(True)
-        self.setFixedSize(75, 75)
-        self.validDrop = False
-        self.x = x
-        self.y = y
-        self.maxX = maxX
-        self.maxY = maxY
-        self.style()
-
-    def setGameModel(self, gamemodel):
-        self.gamemodel = gamemodel
-
-    def style(self, background='blue', font='16pt Times New Roman'):
-        if self.gamecube:
-            name = self.gamemodel.getState()
-            if self.x == 0 and (self.y != 0 or self.y != self.maxY):
-                #Top Row, arrow should point down
-                self.setText(name + '\nv')
-            elif self.x == self.maxX and (self.y != 0 and self.y != self.maxY):
-                #Bottom Row, arrow should point up
-                self.setText('^\n' + name)
-            elif self.y == 0:
-                #Left edge, arrow should point right
-                self.setText(name + ' >')
-            elif self.y == self.maxY:
-                #Right edge arrow should point left
-                self.setText('< ' + name)
-        else:
-            self.setText('')
-        if self.validDrop and background=='blue':
-            background='green'
-        self.setStyleSheet("background-color:" + background + ";"
-                           "font: " + font + ";")
-
-    def mouseMoveEvent(self, e):
-        '''Alerts the widget that a cube has been picked up'''
-        if e.buttons() != Qt.RightButton or not self.gamecube:
-            return
-        if self.client.getUserName() != self.gamemodel.getCurrentPlayer():
-            return
-        self.signals.pickedUp.emit(self.gamecube)
-        mimeData = QMimeData()
-        mimeData.setText(str(self.gamecube))
-        drag = QDrag(self)
-        drag.setMimeData(mimeData)
-        drag.setHotSpot(e.pos())
-        dropAction = drag.exec_(Qt.MoveAction)
-        self.gamecube = None
-        self.style()
-
-    def dragEnterEvent(self, e):
-        '''If a drag object enters the square
-        accept the drop regardless of what it is'''
-        e.accept()
-        self.style(background='white')
-
-    def dragLeaveEvent(self, e):
-        self.style()
-
-    def dropEvent(self, e):
-        '''If the drag object drops its payload, and the 
-        square is receiving drops request the gamemodel to 
-        provide a game cube matching the payload's string 
-        parameter'''
-        if self.validDrop:
-            self.gamecube = self.gamemodel.getPickedUpCube()
-            self.signals.receievedCube.emit(self.x, self.y)
-        else:
-            self.gamemodel.cancelPickedUp()
-        self.style()
-
-    def setValidDrop(self, state):
-        self.validDrop = state
-        self.style()
-          
-    def reset(self):
-        self.gamecube = None
-        self.validDrop = False
-        self.style()
-
-    def refresh(self):
-        self.style()
-
-    def resizeEvent(self, event):
-        self.resize(self.width(), self.height())
-
-class CubeWidget(QPushButton):
-    '''Cubes widgets store their gamecubes and show the states
-    they also alert the model that they have been picked up'''
-    def __init__(self, client, gamemodel, gamecube):
-        super().__init__()
-        self.setAcceptDrops(True)
-        self.client = client
-        self.gamemodel = gamemodel
-        self.gamecube = gamecube
-        self.selected = False
-        self.signals = ButtonSignals()
-        self.setFixedSize(75, 75)
-        self.style()
+        self.signals = WorkerSignals()
+        self.engine = engine
+        self.position = position
+        self.player = player
+        self.key = key
+        self.closeWhenDone = False
 
-    def setGameCube(self, gamemodel, gamecube):
-        self.gamemodel = gamemodel
-        self.gamecube = gamecube
-    
-    def style(self, background='#8B4513', font='28pt Times New Roman'):
-        if self.gamecube:
-            state = self.gamecube.getState()
-            if state:
-                self.setText(state)
-            else:
-                self.setText('')
-        if self.selected:
-            self.setText('| |')
-            background = 'pink'
-        self.setStyleSheet("background-color:" + background + ";"
-                           "font: " + font + ";")
-    
-    def mouseMoveEvent(self, e):
-        '''If the cubes is not an edge cube it cannot be picked up
-        additionally, it cannot be picked up if there is already a cube
-        picked up
-        '''
-        if e.buttons() != Qt.RightButton or not self.gamecube.edge:
-            #print('Edge Cube?: ' + str(self.gamecube.edge))
-            return
-        #Make sure there arent picked up cubes already on the board
-        pc = self.gamemodel.getPickedUpCube()
-        if pc:
-            if self.gamecube != pc:
-                #print('still a picked up cube on the board')
-                return
-        #Make sure there arent cubes waiting in drop zones
-        dp = self.gamemodel.getDroppedPoint()
-        if dp:
-            #print('still a dropped cube in waiting zone')
-            return
-        #Make sure you are allowed to pick up this cube type
-        state = self.gamecube.getState()
-        if state:
-            if state != self.gamemodel.getState():
-                return
-        #Ensure you can be playing right now
-        if self.client.getUserName() != self.gamemodel.getCurrentPlayer():
+    def run(self):
+        move, score, depth, nodes = self.engine.search(self.position, self.player, self.key)
+        print('Computer searched ' + str(nodes) + ' nodes to depth ' + str(depth))
+        #The game was left mid search, the engine's pool is ours to shut
+        if self.closeWhenDone:
+            self.engine.close()
             return
-        self.signals.pickedUp.emit(self.gamecube)
-        self.selected = True
-        mimeData = QMimeData()
-        mimeData.setText(str(self.gamecube))
-        drag = QDrag(self)
-        drag.setMimeData(mimeData)
-        drag.setHotSpot(e.pos())
-        dropAction = drag.exec_(Qt.MoveAction)
-        self.style()
-
-    def deSelect(self):
-        self.selected = False
-
-    def dragEnterEvent(self, e):
-        e.accept()
-
-    def dragLeaveEvent(self, e):
-        self.style()
-
-    def dropEvent(self, e):
-        '''Intent of dropping on a cube must be to cancel the move'''
-        self.selected = False
-        self.signals.cancelSelection.emit()
-        self.style()
-
-    def reset(self):
-        self.selected = False
-        self.style()
-
-    def refresh(self):
-        self.style()
+        if move is not None:
+            self.signals.moved.emit(move)
 
 class GameTab(QWidget):
     def __init__(self, client, gamemodel, statusbar):
@@ -243,8 +102,17 @@ class GameTab(QWidget):
         self.gamemodel = gamemodel
         self.statusbar = statusbar
         print(self.gamemodel.getCurrentPlayer())
-        self.gameMonitor = GameMonitor(self.client, self.gamemodel.getCurrentPlayer() != self.client.getUserName())
-        self.gameMonitor.signals.notify.connect(self.reloadGame)
+        #Computer moves are played here so there's nothing to wait for,
+        #unless the store plays them and they come in like a person's
+        self.vsComputer = COMPUTER in self.gamemodel.players and not self.client.getStore().playsComputer
+        self.engineWorker = None
+        #One engine for the game so its transposition table carries over
+        self.engine = None
+        if self.vsComputer:
+            self.engine = self.client.makeEngine()
+        waiting = self.gamemodel.getCurrentPlayer() != self.client.getUserName()
+        self.gameMonitor = GameMonitor(self.client, waiting and not self.vsComputer)
+        self.gameMonitor.signals.notify.connect(self.opponentMoved)
         self.gameMonitor.signals.getchat.connect(self.updateChat)
         self.threadpool.start(self.gameMonitor)
         player1 = QLabel(self.gamemodel.getPlayerOne()[:-1])
@@ -274,77 +142,68 @@ class GameTab(QWidget):
         layout.addWidget(QLabel('Chat'))
         layout.addWidget(self.chatWindow)
         layout.addWidget(self.sendWindow)
-        #Development
-        gameArea = QWidget()
-        layout = QGridLayout(gameArea)
-        #Make the outer layer of Squares
-        self.squares = []
-        self.cubes = np.ndarray(shape=(8,8), dtype=object)
-        maxrows = self.gamemodel.maxwidth
-        maxcols = self.gamemodel.maxwidth
-        for idx, row in enumerate(self.gamemodel.getCubes()):
-            for idy, gamecube in enumerate(row):
-                if gamecube is not None:
-                    newCube = CubeWidget(self.client, self.gamemodel, gamecube)
-                    newCube.signals.pickedUp.connect(self.pickedUp)
-                    newCube.signals.cancelSelection.connect(self.cancelMove)
-                    self.cubes[idx][idy] = newCube
-                    layout.addWidget(newCube, gamecube.x, gamecube.y)
-                else:
-                    if idx == 0 and idy == 0:
-                        continue
-                    elif idx == maxrows+1 and idy == 0:
-                        continue
-                    elif idx == 0 and idy == maxcols+1:
-                        continue
-                    elif idx == maxrows+1 and idy == maxcols+1:
-                        continue
-                    else:
-                        newSquare = SquareWidget(self.client, self.gamemodel, idx, idy, maxrows+1, maxcols+1)
-                        newSquare.signals.receievedCube.connect(self.queueDrop)
-                        newSquare.signals.pickedUp.connect(self.pickedUp)
-                        self.squares.append(newSquare)
-                        layout.addWidget(newSquare, idx, idy)
+        #The whole board is one widget painted from the model
+        self.board = BoardWidget(self.client, self.gamemodel)
+        self.board.signals.dropped.connect(self.queueDrop)
+        self.board.signals.lifted.connect(self.liftDrop)
+        self.board.signals.cancelled.connect(self.cancelMove)
         layout = QGridLayout(self)
         layout.setRowStretch(1, 2)
         layout.addWidget(vsbox,               0, 0)
-        layout.addWidget(gameArea,            1, 0)
+        layout.addWidget(self.board,          1, 0)
         layout.addWidget(msgArea,             0, 1, 2, 1)
         layout.addWidget(self.passTurnBut,    2, 0)
         layout.addWidget(self.returnToMainBut,2, 1)
         self.setAcceptDrops(True)
+        #Only the cubes a move shifted are redrawn after it
+        self.gamemodel.addMoveListener(self.moveMade)
         self.refresh()
+        self.computerTurn()
 
     def sendMessage(self):
         print('Sending Message')
-        self.gamemodel.addMessage(self.client.getUserName(), self.sendWindow.text())
+        try:
+            self.gamemodel.addMessage(self.client.getUserName(), self.sendWindow.text())
+        except STORE_ERRORS as err:
+            #Left in the box to send again
+            self.statusbar.showMessage('Message not sent: ' + str(err))
+            return
         self.sendWindow.setText('')
 
     def updateChat(self, newchat):
         self.chatWindow.setText(newchat)
-        self.gamemodel.setChat(newchat)
+        #The chat is in the journal, catching up keeps the messages apart
+        #for the next snapshot
+        self.catchUp()
         self.chatWindow.verticalScrollBar().setValue(self.chatWindow.verticalScrollBar().maximum())
 
-    def reloadGame(self, newgamemodel):
-        print('Reloading Game for your turn')
-        self.gamemodel = newgamemodel
-        for idx, row in enumerate(self.gamemodel.getCubes()):
-            for idy, gamecube in enumerate(row):
-                if gamecube is not None:
-                    self.cubes[idx][idy].setGameCube(self.gamemodel, gamecube)
-                    self.cubes[idx][idy].reset()
-        for square in self.squares:
-            square.setGameModel(self.gamemodel)
-            square.reset()
+    def catchUp(self):
+        '''Applies whatever the journal has past this tab's model, the
+        moves redraw their own cubes through moveMade'''
+        turn = self.gamemodel.turnCount
+        self.gamemodel.catchUp()
+        if self.gamemodel.turnCount != turn:
+            self.updateTurn()
+
+    def opponentMoved(self, turn):
+        print('Catching up to your turn')
         self.gameMonitor.setWaitingForPlayer(False)
-        self.refresh()
+        self.catchUp()
+
+    def moveMade(self, delta):
+        '''Repaints only the cubes the move shifted'''
+        self.board.updateCells(delta.cells)
     
     def refresh(self):
-        '''Tests whether the user is the current player or not
-        if the player is the current player refresh only updates the chat
-        otherwise if there isnt already a game monitor spawns a new one
-        and waits for the game to progress'''
+        '''Redraws the whole board, only needed when the tab is made.
+        Moves redraw the cubes they shifted themselves.'''
         print('Refreshing')
+        self.updateTurn()
+        self.board.update()
+        print('refresh done')
+
+    def updateTurn(self):
+        '''Shows whose turn it is, or the result if the game is over'''
         username = self.client.getUserName()
         winner = self.gamemodel.gameOver()
         #If there is a winner the game is over and we should exit
@@ -360,47 +219,61 @@ class GameTab(QWidget):
             self.statusbar.showMessage('Your Turn!')
         else:
             self.statusbar.showMessage(self.gamemodel.getCurrentPlayer() + '\'s turn')
-        #Refresh the cubes displayed
-        for row in self.cubes:
-            for cube in row:
-                if cube:
-                    cube.refresh()
-        for square in self.squares:
-            square.refresh()
-        print('refresh done')
 
     def passTurn(self):
-        self.gameMonitor.setWaitingForPlayer(True)
+        self.gameMonitor.setWaitingForPlayer(not self.vsComputer)
         self.passTurnBut.setEnabled(False)
-        self.gamemodel.passTurn()
-        for square in self.squares:
-            square.reset()
-        for row in self.cubes:
-            for cube in row:
-                if cube:
-                    cube.reset()
-        self.refresh()
-        
-    def pickedUp(self, gamecube):
-        dropPoints = self.gamemodel.updateDrops(gamecube)
-        for point in dropPoints:
-            for square in self.squares:
-                if point[0] == square.x and point[1] == square.y:
-                    square.setValidDrop(True)
+        #The shifted cubes repaint through moveMade, the board only has to
+        #clear the squares the cube could have gone to
+        try:
+            self.gamemodel.passTurn()
+        except STORE_ERRORS as err:
+            #The model kept the move, it can be passed again or cancelled
+            self.gameMonitor.setWaitingForPlayer(False)
+            self.passTurnBut.setEnabled(True)
+            self.statusbar.showMessage('Move not sent: ' + str(err))
+            return
+        self.board.clearMove()
+        self.updateTurn()
+        self.computerTurn()
 
+
+    def computerTurn(self):
+        '''Starts the engine searching if it's the computer's move'''
+        if not self.vsComputer or self.engineWorker or self.gamemodel.gameOver():
+            return
+        if self.gamemodel.getCurrentPlayer() != COMPUTER:
+            return
+        self.statusbar.showMessage('Computer is thinking')
+        self.engineWorker = EngineWorker(self.engine, self.gamemodel.getPosition(),
+                                         self.gamemodel.getTurnIndex(), self.gamemodel.getKey())
+        self.engineWorker.signals.moved.connect(self.computerMoved)
+        self.threadpool.start(self.engineWorker)
+
+    def computerMoved(self, move):
+        '''Plays the computer's move through the model like any other turn'''
+        self.engineWorker = None
+        #The tab was left while the computer was thinking
+        if not self.gameMonitor:
+            return
+        try:
+            self.gamemodel.playMove(move)
+        except STORE_ERRORS as err:
+            #Searched again when the game is opened next
+            self.cancelMove()
+            self.statusbar.showMessage('Computer\'s move not saved: ' + str(err))
+            return
+        self.updateTurn()
+        
     def cancelMove(self):
         self.passTurnBut.setEnabled(False)
-        self.gamemodel.cancelPickedUp()
-        dropPoints = self.gamemodel.getDropPoints()
-        for point in dropPoints:
-            for square in self.squares:
-                if point[0] == square.x and point[1] == square.y:
-                    square.setValidDrop(False)
-        for row in self.cubes:
-            for cube in row:
-                if cube:
-                    cube.deSelect()
-        self.refresh()
+        if self.gamemodel.getPickedUpCube():
+            self.gamemodel.cancelPickedUp()
+        self.board.clearMove()
+
+    def liftDrop(self):
+        '''The waiting cube was picked up again to go somewhere else'''
+        self.passTurnBut.setEnabled(False)
         
     def queueDrop(self, x, y):
         '''Alert the game model that a square now has a valid
@@ -423,17 +296,33 @@ class GameTab(QWidget):
         msgWidget.exec_()
         self.endGame()
 
+    def closeEngine(self):
+        if self.engine:
+            if self.engineWorker:
+                self.engineWorker.closeWhenDone = True
+            else:
+                self.engine.close()
+            self.engine = None
+
     def endGame(self):
+        self.gamemodel.removeMoveListener(self.moveMade)
         if self.gameMonitor:
             self.gameMonitor.end()
             self.gameMonitor = None
+        self.closeEngine()
+        self.gamemodel.close()
         #Delete the game from the server and set it 
         #to no current game
         self.client.removeCurrentGame()
         self.signals.finished.emit()
 
     def returnToMain(self):
+        self.gamemodel.removeMoveListener(self.moveMade)
         if self.gameMonitor:
             self.gameMonitor.end()
             self.gameMonitor = None
+        self.closeEngine()
+        self.gamemodel.close()
+        #Kept so coming back to this game doesn't load it again
+        self.client.giveModel(self.gamemodel)
         self.signals.finished.emit()
\ No newline at end of file
@@ -0,0 +1,98 @@
+import threading
+from collections import OrderedDict
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap
+
+BACKGROUND = 'lib/images/background.jpg'
+#Scaled copies are made in steps of this many pixels, resizing within a
+#step reuses the same copy
+BUCKET = 128
+#Scaled copies kept per image, the least recently used go first
+KEEP = 4
+
+class ScaleSignals(QObject):
+    scaled = pyqtSignal(object, object)
+
+class ScaleWorker(QRunnable):
+    '''Scales an image off the GUI thread, QImage is safe to use anywhere
+    unlike QPixmap'''
+    def __init__(self, cache, key):
+        super().__init__()
+        self.signals = ScaleSignals()
+        self.cache = cache
+        self.key = key
+
+    def run(self):
+        width, height = self.key
+        image = self.cache.source().scaled(width, height, Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        self.signals.scaled.emit(self.key, image)
+
+class ImageCache(QObject):
+    '''An image decoded once and a few scaled copies of it, bucketed by
+    size. Copies are scaled on the thread pool and ready is emitted when
+    one comes in, cached then has it.
+
+    Parameters:
+        path (str): image file
+        bucket (int): pixels between scaled sizes
+        keep (int): scaled copies kept
+    '''
+    ready = pyqtSignal()
+
+    def __init__(self, path, bucket=BUCKET, keep=KEEP):
+        super().__init__()
+        self.path = path
+        self.bucket = bucket
+        self.keep = keep
+        self.image = None
+        self.imageLock = threading.Lock()
+        self.variants = OrderedDict()
+        self.scaling = set()
+
+    def source(self):
+        '''The full size image, only read from disk the first time'''
+        with self.imageLock:
+            if self.image is None:
+                self.image = QImage(self.path)
+            return self.image
+
+    def key(self, width, height):
+        '''Size of the copy used for width x height, rounded up so it's
+        never smaller'''
+        return (max(1, -(-width//self.bucket))*self.bucket,
+                max(1, -(-height//self.bucket))*self.bucket)
+
+    def cached(self, width, height):
+        '''The QPixmap for width x height if it has been scaled, else None'''
+        key = self.key(width, height)
+        if key not in self.variants:
+            return None
+        self.variants.move_to_end(key)
+        return self.variants[key]
+
+    def request(self, width, height):
+        '''Starts scaling a copy for width x height if there isn't one'''
+        key = self.key(width, height)
+        if key in self.variants or key in self.scaling:
+            return
+        self.scaling.add(key)
+        worker = ScaleWorker(self, key)
+        worker.signals.scaled.connect(self.addVariant)
+        QThreadPool.globalInstance().start(worker)
+
+    def addVariant(self, key, image):
+        self.scaling.discard(key)
+        #Pixmaps can only be made on the GUI thread
+        self.variants[key] = QPixmap.fromImage(image)
+        while len(self.variants) > self.keep:
+            self.variants.popitem(last=False)
+        self.ready.emit()
+
+_background = None
+
+def background_cache():
+    '''The home screen background, shared by every HomeScreen made'''
+    global _background
+    if _background is None:
+        _background = ImageCache(BACKGROUND)
+    return _background
@@ -1,14 +1,16 @@
-from PyQt5.QtCore import Qt, QMimeData, pyqtSignal, QObject, QThreadPool, QRunnable
+from PyQt5.QtCore import Qt, QMimeData, pyqtSignal, QObject, QThreadPool, QRunnable, QTimer
 from PyQt5.QtGui import QDrag, QPixmap, QPalette, QBrush
 from PyQt5.QtWidgets import (QFileDialog, QGridLayout, QGroupBox, QHBoxLayout, QInputDialog, 
                              QLabel, QListWidget, QListWidgetItem, QLineEdit, QPushButton, QProgressBar, 
                              QRadioButton, QTextEdit, QVBoxLayout, QDialog, QWidget)
 import time
-import numpy as np
+from lib.engine import COMPUTER
+from tabs.imagecache import background_cache
 
 class WorkerSignals(QObject):
     newGame = pyqtSignal(str)
     loadGame = pyqtSignal()
+    dashboard = pyqtSignal()
 
 class PlayerQuery(QDialog):
     def __init__(self, client):
@@ -20,6 +22,8 @@ class PlayerQuery(QDialog):
         self.cancelBut.clicked.connect(self.reject)
         self.playerList = QListWidget()
         self.msgBar = QLabel('')
+        #The computer is always around for a game
+        self.playerList.addItem(COMPUTER[:-1])
         players = self.client.getOnlinePlayers()
         for player in players:
             self.playerList.addItem(player[:-1])
@@ -68,8 +72,10 @@ class InviteQuery(QDialog):
 
     def testAccept(self):
         if self.invite:
-            self.client.acceptInvite(self.invite)
-            self.accept()
+            if self.client.acceptInvite(self.invite):
+                self.accept()
+            else:
+                self.msgBar.setText('That invite has already been taken')
         else:
             self.msgBar.setText('Select a invite first!')
 
@@ -129,13 +135,15 @@ class HomeScreen(QWidget):
         resumeBut.clicked.connect(self.resumeGame)
         loadGameBut = QPushButton('Load Game')
         loadGameBut.clicked.connect(self.loadGame)
+        dashboardBut = QPushButton('All Games')
+        dashboardBut.clicked.connect(self.showDashboard)
         invites = self.client.getInvites()
         self.inviteBut = QPushButton('No invites :(')
         self.inviteBut.clicked.connect(self.viewInvites)
         self.playerList = QListWidget()
         layout = QGridLayout(self)
         layout.setRowStretch(0, 2)
-        layout.setRowStretch(8, 2)
+        layout.setRowStretch(9, 2)
         layout.setColumnStretch(0, 2)
         layout.setColumnStretch(2, 2)
         layout.addWidget(QLabel('\t'),                  0, 0, 1, 2)
@@ -143,40 +151,68 @@ class HomeScreen(QWidget):
         layout.addWidget(startNewBut,                   2, 1)
         layout.addWidget(resumeBut,                     3, 1)
         layout.addWidget(loadGameBut,                   4, 1)
-        layout.addWidget(self.inviteBut,                5, 1)
+        layout.addWidget(dashboardBut,                  5, 1)
+        layout.addWidget(self.inviteBut,                6, 1)
         label = QLabel('Online Players')
         label.setStyleSheet('background-color:white')
-        layout.addWidget(label,                         6, 1)
-        layout.addWidget(self.playerList,               7, 1)
-        layout.addWidget(QLabel('\t'),                  8, 0, 1, 3)
+        layout.addWidget(label,                         7, 1)
+        layout.addWidget(self.playerList,               8, 1)
+        layout.addWidget(QLabel('\t'),                  9, 0, 1, 3)
 
     def setBackground(self):
-        background = 'lib/images/background.jpg'
-        self.image = QPixmap(background)
+        #Decoded once and scaled off the GUI thread, shared with every
+        #home screen made after this one
+        self.background = background_cache()
+        self.shownBackground = None
+        self.background.ready.connect(self.showBackground)
         self.setAutoFillBackground(True)
-        newmap = self.image.scaled(self.width(), self.height())
+        #Resizing only rescales once the window has stopped for a moment
+        self.resizeTimer = QTimer(self)
+        self.resizeTimer.setSingleShot(True)
+        self.resizeTimer.setInterval(100)
+        self.resizeTimer.timeout.connect(self.scaleBackground)
+        self.scaleBackground()
+
+    def scaleBackground(self):
+        if not self.showBackground():
+            self.background.request(self.width(), self.height())
+
+    def showBackground(self):
+        '''Uses the scaled background for this size if there is one yet,
+        returns whether there was'''
+        newmap = self.background.cached(self.width(), self.height())
+        if newmap is None:
+            return False
+        if newmap is self.shownBackground:
+            return True
+        self.shownBackground = newmap
         p = self.palette()
         p.setBrush(self.backgroundRole(), QBrush(newmap))
         self.setPalette(p)
+        return True
         
-    def refresh(self):
-        self.client.connect()
-        self.playerList.clear()
-        self.userName.setText(self.client.getUserName()[:-1])
-        players = self.client.getOnlinePlayers()
-        for player in players:
-            self.playerList.addItem(player[:-1])
-        invites = self.client.getInvites()
-        if invites:
+    def refresh(self, snapshot):
+        '''Shows a LobbySnapshot the client monitor gathered, only
+        touching the players that came or went'''
+        self.userName.setText(snapshot.name)
+        wanted = snapshot.players
+        for row in range(self.playerList.count()-1, -1, -1):
+            if self.playerList.item(row).text() not in wanted:
+                self.playerList.takeItem(row)
+        #Both are sorted so the missing names slot in where they belong
+        for row, player in enumerate(wanted):
+            item = self.playerList.item(row)
+            if item is None or item.text() != player:
+                self.playerList.insertItem(row, player)
+        if snapshot.invites:
             self.inviteBut.setText('Invites Available!')
         else:
             self.inviteBut.setText('No invites :(')
 
     def resizeEvent(self, event):
-        newmap = self.image.scaled(self.width(), self.height())
-        p = self.palette()
-        p.setBrush(self.backgroundRole(), QBrush(newmap))
-        self.setPalette(p)
+        #The copy for this size may already be there from earlier
+        if not self.showBackground():
+            self.resizeTimer.start()
 
     def viewInvites(self):
         if self.client.getUserName():
@@ -187,17 +223,15 @@ class HomeScreen(QWidget):
 
     def startNewGame(self):
         if self.client.getUserName():
-            if self.client.getOnlinePlayers():
-                self.client.setPlayerTarget('')
-                self.playerSelect = PlayerQuery(self.client)
-                self.playerSelect.exec_()
-                #Check if the client has a selected player
-                player = self.client.getPlayerTarget()
-                if player:
-                    self.statusbar.showMessage('Starting new game!')
-                    self.signals.newGame.emit(player)
-            else:
-                self.statusbar.showMessage('No online players to play with :(')
+            #No need for online players, the computer can always play
+            self.client.setPlayerTarget('')
+            self.playerSelect = PlayerQuery(self.client)
+            self.playerSelect.exec_()
+            #Check if the client has a selected player
+            player = self.client.getPlayerTarget()
+            if player:
+                self.statusbar.showMessage('Starting new game!')
+                self.signals.newGame.emit(player)
         else:
             self.statusbar.showMessage('Setup username first!')
 
@@ -219,5 +253,12 @@ class HomeScreen(QWidget):
                     self.resumeGame()
                 else:
                     self.statusbar.showMessage('No current games')
+        else:
+            self.statusbar.showMessage('Set up username first!')
+
+    def showDashboard(self):
+        if self.client.getUserName():
+            self.statusbar.showMessage('Loading all games')
+            self.signals.dashboard.emit()
         else:
             self.statusbar.showMessage('Set up username first!')
\ No newline at end of file
@@ -0,0 +1,45 @@
+import random
+from lib.engine import INFINITY, Engine, evaluate, outcome
+from lib.gamemodel import MOVE_LINES, apply_move, legal_moves
+
+def brute(position, player, depth, ply):
+    '''Plain negamax with no pruning or table, scored like Engine.negamax'''
+    if depth == 0:
+        return evaluate(position[player], position[1-player])
+    best = -INFINITY
+    for move in legal_moves(position, player):
+        child = apply_move(position, player, move)
+        score = outcome(child[player], child[1-player], MOVE_LINES[move], ply+1)
+        if score is None:
+            score = -brute(child, 1-player, depth-1, ply+1)
+        best = max(best, score)
+    return best
+
+def positions(count, seed=7):
+    '''The start and a few positions part way through random games'''
+    rng = random.Random(seed)
+    found = [((0, 0), 0)]
+    while len(found) < count:
+        position, player = (0, 0), 0
+        for ply in range(rng.randrange(4, 16)):
+            move = rng.choice(legal_moves(position, player))
+            child = apply_move(position, player, move)
+            if outcome(child[player], child[1-player], MOVE_LINES[move], 1) is not None:
+                break
+            position, player = child, 1-player
+        found.append((position, player))
+    return found
+
+def test_search_matches_brute_force():
+    for symmetric in (False, True):
+        #One engine throughout so the table carries over between searches
+        engine = Engine(timeLimit=60, maxDepth=3, symmetric=symmetric)
+        for position, player in positions(6):
+            move, score, depth, nodes = engine.search(position, player)
+            assert score == brute(position, player, 3, 0)
+            #And the move it gives back is one that gets that score
+            child = apply_move(position, player, move)
+            moveScore = outcome(child[player], child[1-player], MOVE_LINES[move], 1)
+            if moveScore is None:
+                moveScore = -brute(child, 1-player, 2, 1)
+            assert moveScore == score
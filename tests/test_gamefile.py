@@ -0,0 +1,33 @@
+import pickle
+import pytest
+from lib.gamefile import GameFile, is_pickled, pack_game, read_game
+
+PLAYERS = ['alice\n', 'Zoë\n']
+MESSAGES = ['-alice\nhi\n\n', '', '-Zoë\nhello ✓\n\n']
+
+def test_game_file_round_trip(tmp_path):
+    data = pack_game(PLAYERS, [0b10101, 1 << 24], 17, 123456, [0, 5, 43, 2], MESSAGES)
+    path = tmp_path / 'game.gtp'
+    path.write_bytes(data)
+    gamefile = read_game(str(path))
+    assert gamefile.players == PLAYERS
+    assert gamefile.getBoards() == [0b10101, 1 << 24]
+    assert gamefile.turnCount == 17
+    assert gamefile.journalOffset == 123456
+    assert gamefile.getMoves() == [0, 5, 43, 2]
+    assert gamefile.getMessages() == MESSAGES
+    assert not is_pickled(str(path))
+
+def test_empty_game_round_trip():
+    gamefile = GameFile(pack_game(PLAYERS, [0, 0], 0, 0, [], []))
+    assert gamefile.getMoves() == []
+    assert gamefile.getMessages() == []
+
+def test_bad_game_files_are_refused(tmp_path):
+    data = pack_game(PLAYERS, [0, 0], 2, 0, [1, 2], MESSAGES)
+    for bad in (data[:10], data[:-1], b'XXXX' + data[4:]):
+        with pytest.raises(ValueError):
+            GameFile(bad)
+    path = tmp_path / 'old.gtp'
+    path.write_bytes(pickle.dumps({'turnCount': 2}))
+    assert is_pickled(str(path))
@@ -0,0 +1,69 @@
+import os
+import random
+from lib.gamemodel import (MOVE_SYMMETRY, SYMMETRIES, GameModel, apply_move, canonical,
+                           canonical_key, legal_moves, load_game, transform)
+from lib.store import FileStore, SQLStore
+
+def play_again(store, folder):
+    '''Plays three moves, then starts the same players' game again'''
+    first = GameModel(folder, 'alice\n', 'bob\n', store)
+    for ply in range(3):
+        first.playMove(first.legalMoves()[0])
+    first.close()
+    second = GameModel(folder, 'alice\n', 'bob\n', store)
+    assert second.getSaveFile() == first.getSaveFile()
+    return second
+
+def check_fresh(gamemodel, store):
+    assert gamemodel.turnCount == 0
+    assert gamemodel.moves == []
+    assert gamemodel.getPosition() == (0, 0)
+    loaded = load_game(gamemodel.getSaveFile(), store)
+    assert loaded.turnCount == 0
+    assert loaded.moves == []
+    gamemodel.close()
+    loaded.close()
+
+def test_new_game_drops_old_journal_files(tmp_path):
+    store = FileStore()
+    check_fresh(play_again(store, str(tmp_path)), store)
+
+def test_new_game_drops_old_journal_sqlite(tmp_path):
+    store = SQLStore(os.path.join(str(tmp_path), 'games.db'))
+    check_fresh(play_again(store, str(tmp_path)), store)
+
+def random_positions(count, seed=11):
+    rng = random.Random(seed)
+    found = [((0, 0), 0)]
+    for n in range(count):
+        cells = [rng.randrange(3) for cell in range(25)]
+        xbits = sum(1 << i for i, cell in enumerate(cells) if cell == 1)
+        obits = sum(1 << i for i, cell in enumerate(cells) if cell == 2)
+        found.append(((xbits, obits), rng.randrange(2)))
+    return found
+
+def test_canonical_same_for_every_symmetry_and_colour():
+    for position, player in random_positions(200):
+        board, sym = canonical(position, player)
+        assert board == (transform(position[player], sym), transform(position[1-player], sym))
+        key = canonical_key(position, player)
+        for other in range(len(SYMMETRIES)):
+            moved = (transform(position[0], other), transform(position[1], other))
+            assert canonical(moved, player)[0] == board
+            assert canonical_key(moved, player) == key
+            #The same board with the colours swapped and the other side
+            #to move
+            swapped = (moved[1], moved[0])
+            assert canonical(swapped, 1-player)[0] == board
+            assert canonical_key(swapped, 1-player) == key
+
+def test_moves_follow_the_symmetry():
+    for position, player in random_positions(50):
+        moves = legal_moves(position, player)
+        for sym in range(len(SYMMETRIES)):
+            moved = (transform(position[0], sym), transform(position[1], sym))
+            assert sorted(legal_moves(moved, player)) == sorted(MOVE_SYMMETRY[sym][move] for move in moves)
+            for move in moves:
+                child = apply_move(position, player, move)
+                expected = (transform(child[0], sym), transform(child[1], sym))
+                assert apply_move(moved, player, MOVE_SYMMETRY[sym][move]) == expected
@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+#What batch workers pay for the rules, measured in a fresh interpreter
+IMPORT_LIMIT = 0.05
+
+CHECK = '''
+import sys
+import time
+start = time.perf_counter()
+import client
+import lib.cfg
+import lib.gamemodel
+print(time.perf_counter() - start)
+print(' '.join(name for name in ('PyQt5', 'numpy') if name in sys.modules))
+'''
+
+def test_core_imports_without_qt_or_numpy():
+    result = subprocess.run([sys.executable, '-c', CHECK], cwd=ROOT, capture_output=True,
+                            text=True, check=True)
+    lines = result.stdout.splitlines()
+    assert ''.join(lines[1:]).strip() == ''
+    assert float(lines[0]) < IMPORT_LIMIT
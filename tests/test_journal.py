@@ -0,0 +1,57 @@
+import os
+from lib.journal import (CHAT_RECORD, MOVE_RECORD, JournalWriter, chat_record, move_record,
+                         read_journal)
+
+def write_game(path):
+    journal = JournalWriter(path)
+    start = journal.create(['alice\n', 'bob\n'])
+    journal.appendMove(3, 0)
+    journal.appendChat('-alice\nhi\n\n')
+    journal.appendMove(41, 1)
+    journal.close()
+    return start
+
+def test_records_read_back(tmp_path):
+    path = str(tmp_path / 'game.gtj')
+    start = write_game(path)
+    records, offset = read_journal(path, 0)
+    assert [kind for kind, value in records] == [MOVE_RECORD, CHAT_RECORD, MOVE_RECORD]
+    assert records[0][1][:2] == (3, 0)
+    assert records[1][1] == '-alice\nhi\n\n'
+    assert records[2][1][:2] == (41, 1)
+    assert offset == os.path.getsize(path)
+    #Reading on from the offset only gives what was added since
+    assert read_journal(path, offset) == ([], offset)
+    journal = JournalWriter(path)
+    assert journal.create(['alice\n', 'bob\n']) == start
+    journal.appendMove(7, 2)
+    journal.close()
+    records, after = read_journal(path, offset)
+    assert [value[:2] for kind, value in records] == [(7, 2)]
+    assert after == os.path.getsize(path)
+
+def test_record_still_being_written_is_left(tmp_path):
+    path = str(tmp_path / 'game.gtj')
+    start = write_game(path)
+    with open(path, 'rb') as jfile:
+        data = jfile.read()
+    #Not even the header yet
+    with open(path, 'wb') as jfile:
+        jfile.write(data[:start-1])
+    assert read_journal(path, 0) == ([], 0)
+    with open(path, 'wb') as jfile:
+        jfile.write(data)
+    records, offset = read_journal(path, 0)
+    for partial in (move_record(9, 2), chat_record('-bob\nhello\n\n')):
+        for cut in range(1, len(partial)):
+            with open(path, 'r+b') as jfile:
+                jfile.truncate(offset)
+                jfile.seek(offset)
+                jfile.write(partial[:cut])
+            assert read_journal(path, 0) == (records, offset)
+            assert read_journal(path, offset) == ([], offset)
+        #Once the rest lands it's read from where the last read stopped
+        with open(path, 'ab') as jfile:
+            jfile.write(partial[cut:])
+        more, after = read_journal(path, offset)
+        assert len(more) == 1 and after == offset + len(partial)
@@ -0,0 +1,51 @@
+import os
+import subprocess
+import sys
+import pytest
+from lib.storage import FileLock, fcntl
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TRY_LOCK = '''
+import sys
+from lib.storage import FileLock, LockTimeout
+try:
+    with FileLock(sys.argv[1], timeout=0.2):
+        print('locked')
+except LockTimeout:
+    print('timeout')
+'''
+
+#Read, change, write of a shared counter, only safe under the lock
+COUNT = '''
+import sys
+from lib.storage import FileLock, atomic_write
+for n in range(int(sys.argv[2])):
+    with FileLock(sys.argv[1]):
+        with open(sys.argv[1]) as counter:
+            value = int(counter.read())
+        atomic_write(sys.argv[1], str(value + 1).encode())
+'''
+
+def run(script, *args):
+    return subprocess.Popen([sys.executable, '-c', script] + [str(arg) for arg in args], cwd=ROOT,
+                            stdout=subprocess.PIPE, text=True)
+
+@pytest.mark.skipif(fcntl is None, reason='no advisory locks without fcntl')
+def test_lock_keeps_another_process_out(tmp_path):
+    path = str(tmp_path / 'users.txt')
+    with FileLock(path):
+        assert run(TRY_LOCK, path).communicate()[0].strip() == 'timeout'
+    assert run(TRY_LOCK, path).communicate()[0].strip() == 'locked'
+
+@pytest.mark.skipif(fcntl is None, reason='no advisory locks without fcntl')
+def test_locked_updates_are_not_lost(tmp_path):
+    path = str(tmp_path / 'counter.txt')
+    with open(path, 'w') as counter:
+        counter.write('0')
+    workers = [run(COUNT, path, 50) for n in range(4)]
+    for worker in workers:
+        worker.communicate()
+        assert worker.returncode == 0
+    with open(path) as counter:
+        assert int(counter.read()) == 200
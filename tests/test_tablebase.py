@@ -0,0 +1,72 @@
+from lib.gamemodel import apply_move, legal_moves, winners
+from lib.tablebase import (UNKNOWN, Tablebase, decode, load_working, partition_file, position,
+                           solve_pair, terminal, write_file)
+
+def brute(own, opp, depth):
+    '''Plain negamax to depth plies, 100-d for a win d plies away, -(100-d)
+    for a loss and 0 for a draw or nothing forced inside the horizon'''
+    ownLine, oppLine = winners((own, opp))
+    if ownLine and oppLine:
+        return 0
+    if oppLine:
+        return -100
+    if ownLine:
+        return 100
+    moves = legal_moves((own, opp), 0)
+    if depth == 0 or not moves:
+        return 0
+    best = -100
+    for move in moves:
+        mine, theirs = apply_move((own, opp), 0, move)
+        score = -brute(theirs, mine, depth-1)
+        #A step further from the end for this side
+        if score > 0:
+            score -= 1
+        elif score < 0:
+            score += 1
+        best = max(best, score)
+    return best
+
+def table_score(value):
+    result, distance = decode(value)
+    if result == 'win':
+        return 100 - distance
+    if result == 'loss':
+        return distance - 100
+    return 0
+
+def test_full_board_partition_matches_negamax(tmp_path):
+    '''(5, 20) and (20, 5) stay on a full board so they only need each
+    other, and have positions lost or won a move or two out'''
+    folder = str(tmp_path)
+    solve_pair(folder, 5, 20)
+    tablebase = Tablebase(folder)
+    checked = 0
+    for part in ((5, 20), (20, 5)):
+        table = bytes(tablebase.table(*part))
+        assert UNKNOWN not in table
+        for idx, value in enumerate(table):
+            own, opp = position(idx, *part)
+            if terminal(own, opp) is not None:
+                continue
+            assert table_score(value) == brute(own, opp, 3)
+            checked += 1
+    tablebase.close()
+    assert checked
+
+def test_unsolved_positions_are_not_draws(tmp_path):
+    folder = str(tmp_path)
+    values, resumed = load_working(folder, 5, 20)
+    assert not resumed
+    #Half solved, as a checkpoint would leave it
+    write_file(partition_file(folder, 5, 20), values)
+    tablebase = Tablebase(folder)
+    for idx, value in enumerate(values):
+        own, opp = position(idx, 5, 20)
+        if terminal(own, opp) is None:
+            assert value == UNKNOWN
+            assert tablebase.value(own, opp) is None
+            break
+    else:
+        assert False, 'no unfinished position'
+    tablebase.close()